@@ -6,10 +6,38 @@ import argparse
 import logging
 import logging.config
 
-from twisted.internet import reactor
+from twisted.internet import defer, reactor
 
+from cardinal import metrics
 from cardinal.config import ConfigParser, ConfigSpec
 from cardinal.bot import CardinalBotFactory
+from cardinal.election import FileLease, LeaderElection
+from cardinal.health import HealthChecks
+from cardinal.lag import LagMonitor
+from cardinal.sharding import ReplicaWatcher, Shards, statefulset_ordinal
+from cardinal.util import parse_server
+from cardinal.watcher import PluginWatcher
+
+
+NETWORK_OPTIONS = (
+    'network',
+    'port',
+    'servers',
+    'ssl',
+    'ssl_verify',
+    'ssl_ca_certs',
+    'ssl_ciphers',
+    'server_password',
+    'server_commands',
+    'nickname',
+    'password',
+    'username',
+    'realname',
+    'channels',
+    'plugins',
+    'blacklist',
+)
+"""Options which can be set for each network in the networks option"""
 
 
 def setup_logging(config=None):
@@ -24,6 +52,67 @@ def setup_logging(config=None):
     return logging.getLogger(__name__)
 
 
+def create_factory(config, db_locks, shard=None):
+    """Creates the CardinalBotFactory of a network.
+
+    Keyword arguments:
+      config -- The config, with the network's own options applied.
+      db_locks -- Database locks shared by every network's factory.
+      shard -- This replica's shard, if channels are sharded.
+
+    Returns:
+      CardinalBotFactory -- The factory.
+    """
+    logger = logging.getLogger(__name__)
+
+    # If no username is supplied, default to nickname
+    if config['username'] is None:
+        config['username'] = config['nickname']
+
+    # Other servers of the network, which are raced to connect to
+    servers = [(config['network'], config['port'])] + [
+        parse_server(server, config['port']) for server in config['servers']]
+
+    ssl_context = None
+    if config['ssl']:
+        # Imported here, so pyOpenSSL is only needed for SSL
+        from cardinal.tls import MODERN_CIPHERS, TLSContexts
+        ssl_context = TLSContexts(config['ssl_verify'],
+                                  config['ssl_ca_certs'],
+                                  config['ssl_ciphers'] or MODERN_CIPHERS)
+
+    shards = None
+    if shard is not None:
+        shards = Shards(shard, config['shards'] or 1)
+
+    logger.debug("Instantiating CardinalBotFactory for %s" % config['network'])
+    return CardinalBotFactory(config['network'],
+                              config['server_password'],
+                              config['server_commands'],
+                              config['channels'],
+                              config['nickname'],
+                              config['password'],
+                              config['username'],
+                              config['realname'],
+                              config['plugins'],
+                              config['blacklist'],
+                              config['storage'],
+                              config['lazy_plugins'],
+                              config['isolated_plugins'],
+                              config['blocking_threads'],
+                              config['blocking_limit'],
+                              config['plugin_timeout'],
+                              config['plugin_timeouts'],
+                              config['max_in_flight'],
+                              config['ping_interval'] or None,
+                              config['max_missed_pongs'],
+                              servers,
+                              ssl_context,
+                              config['connection_attempt_delay'] / 1000.0,
+                              db_locks,
+                              shards)
+
+
 if __name__ == "__main__":
     # Create a new instance of ArgumentParser with a description about Cardinal
     arg_parser = argparse.ArgumentParser(description="""
@@ -49,9 +138,14 @@ https://github.com/JohnMaguire/Cardinal
     spec.add_option('realname', str, None)
     spec.add_option('network', str, 'irc.freenode.net')
     spec.add_option('port', int, 6667)
+    spec.add_option('servers', list, [])
+    spec.add_option('connection_attempt_delay', int, 250)
     spec.add_option('server_password', str, None)
     spec.add_option('server_commands', list, [])
     spec.add_option('ssl', bool, False)
+    spec.add_option('ssl_verify', bool, True)
+    spec.add_option('ssl_ca_certs', str, None)
+    spec.add_option('ssl_ciphers', str, None)
     spec.add_option('storage', str, os.path.join(
         os.path.dirname(os.path.realpath(sys.argv[0])),
         'storage'
@@ -74,6 +168,25 @@ https://github.com/JohnMaguire/Cardinal
     ])
     spec.add_option('blacklist', dict, {})
     spec.add_option('logging', dict, None)
+    spec.add_option('watch_plugins', bool, False)
+    spec.add_option('lazy_plugins', bool, False)
+    spec.add_option('isolated_plugins', list, [])
+    spec.add_option('blocking_threads', int, 10)
+    spec.add_option('blocking_limit', int, 2)
+    spec.add_option('plugin_timeout', int, None)
+    spec.add_option('plugin_timeouts', dict, {})
+    spec.add_option('max_in_flight', int, None)
+    spec.add_option('metrics_port', int, None)
+    spec.add_option('metrics_interface', str, '')
+    spec.add_option('lag_threshold', int, 500)
+    spec.add_option('ping_interval', int, 60)
+    spec.add_option('max_missed_pongs', int, 3)
+    spec.add_option('networks', list, [])
+    spec.add_option('shards', int, None)
+    spec.add_option('shard', int, None)
+    spec.add_option('shard_service', str, None)
+    spec.add_option('leader_lease', str, None)
+    spec.add_option('leader_lease_duration', int, 15)
 
     parser = ConfigParser(spec)
 
@@ -114,41 +227,80 @@ https://github.com/JohnMaguire/Cardinal
                     "Initializing storage directory: {}".format(directory))
                 os.makedirs(directory)
 
-    # If no username is supplied, default to nickname
-    if config['username'] is None:
-        config['username'] = config['nickname']
+    # Options in the top level of the config apply to every network, unless
+    # a network overrides them. Plugins and databases are shared between
+    # networks, and databases are namespaced by network where it matters.
+    db_locks = {}
 
-    # Instance a new factory, and connect with/without SSL
-    logger.debug("Instantiating CardinalBotFactory")
-    factory = CardinalBotFactory(config['network'],
-                                 config['server_password'],
-                                 config['server_commands'],
-                                 config['channels'],
-                                 config['nickname'],
-                                 config['password'],
-                                 config['username'],
-                                 config['realname'],
-                                 config['plugins'],
-                                 config['blacklist'],
-                                 config['storage'])
-
-    if not config['ssl']:
-        logger.info(
-            "Connecting over plaintext to %s:%d" %
-            (config['network'], config['port'])
-        )
+    # Split the channels between replicas of the bot, each one a shard. By
+    # default, the shard is the replica's ordinal in its StatefulSet.
+    shard = None
+    if config['shards'] or config['shard_service']:
+        shard = config['shard']
+        if shard is None:
+            shard = statefulset_ordinal()
+        if shard is None:
+            logger.error("Unable to tell which shard this is, set the shard "
+                         "option")
+            sys.exit(1)
+
+        logger.info("Running as shard {}".format(shard))
+
+    factories = [
+        create_factory(network_config, db_locks, shard)
+        for network_config in parser.load_overrides('networks',
+                                                    NETWORK_OPTIONS)
+    ]
+
+    # Log what blocks the reactor for longer than lag_threshold milliseconds
+    lag_monitor = None
+    if config['lag_threshold']:
+        lag_monitor = LagMonitor(factories,
+                                 threshold=config['lag_threshold'] / 1000.0)
+        lag_monitor.start()
+
+    # Serve metrics for Prometheus to scrape, and /healthz and /readyz for
+    # Kubernetes probes
+    if config['metrics_port']:
+        health = HealthChecks(factories, lag_monitor)
+        metrics.listen(config['metrics_port'], config['metrics_interface'],
+                       resources=health.resources())
+
+    # Only the replica holding the lease runs work that must only run once,
+    # like watching feeds. The lease file is relative to the storage path,
+    # which replicas must share.
+    if config['leader_lease']:
+        election = LeaderElection(
+            factories,
+            FileLease(os.path.join(config['storage'] or '',
+                                   config['leader_lease'])),
+            duration=config['leader_lease_duration'])
+        for factory in factories:
+            factory.election = election
+
+        election.start()
+        reactor.addSystemEventTrigger('before', 'shutdown', election.stop)
+
+    # Rebalance the channels as the StatefulSet is scaled
+    if shard is not None and config['shard_service']:
+        ReplicaWatcher(factories, config['shard_service']).start()
+
+    for factory in factories:
+        # Reload plugins as their files change, handy while developing them
+        if config['watch_plugins']:
+            PluginWatcher(factory.plugin_manager).start()
 
-        reactor.connectTCP(config['network'], config['port'], factory)
-    else:
         logger.info(
-            "Connecting over SSL to %s:%d" %
-            (config['network'], config['port'])
+            "Connecting to %s over %s via %s" %
+            (factory.network,
+             "SSL" if factory.ssl_context else "plaintext",
+             ', '.join(str(server) for server in factory.servers.ordered()))
         )
+        factory.connect()
 
-        # For SSL, we need to import the SSL module from Twisted
-        from twisted.internet import ssl
-        reactor.connectSSL(config['network'], config['port'], factory,
-                           ssl.ClientContextFactory())
+    # Quit once we've disconnected from every network
+    defer.DeferredList([factory.disconnected for factory in factories]) \
+        .addCallback(lambda _: reactor.stop())
 
     # Run the Twisted reactor
     reactor.run()
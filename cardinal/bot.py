@@ -2,7 +2,10 @@ import signal
 import json
 import logging
 import os
+import random
 import re
+import time
+import weakref
 from collections import namedtuple
 from contextlib import contextmanager
 from datetime import datetime
@@ -11,7 +14,9 @@ from twisted.internet import defer, protocol, reactor
 from twisted.internet.task import deferLater
 from twisted.words.protocols import irc
 
+from cardinal import metrics
 from cardinal.plugins import PluginManager, EventManager
+from cardinal.servers import ConnectionRace, ServerList
 from cardinal.exceptions import (
     CommandNotFoundError,
     ConfigNotFoundError,
@@ -72,10 +77,21 @@ class CardinalBot(irc.IRCClient, object):
     def realname(self, value):
         self.factory.realname = value
 
+    @property
+    def heartbeatInterval(self):
+        """Seconds between PINGs, see _sendHeartbeat()"""
+        return self.factory.ping_interval
+
     @property
     def storage_path(self):
         return self.factory.storage_path
 
+    @property
+    def is_leader(self):
+        """Whether this replica should run work that must only run once"""
+        election = getattr(self.factory, 'election', None)
+        return election is None or election.is_leader
+
     def __init__(self):
         """Initializes the logging"""
         self.logger = logging.getLogger(__name__)
@@ -102,6 +118,9 @@ class CardinalBot(irc.IRCClient, object):
         self.event_manager.register("irc.part", 3)
         self.event_manager.register("irc.kick", 4)
         self.event_manager.register("irc.quit", 2)
+        self.event_manager.register("irc.signedon", 0)
+        self.event_manager.register("leader.elected", 0)
+        self.event_manager.register("leader.deposed", 0)
 
         # State variables for the WHO command
         self._who_cache = {}
@@ -110,20 +129,35 @@ class CardinalBot(irc.IRCClient, object):
         # Database file locks
         self.db_locks = {}
 
+        # Whether we're signed on, and the channels we're in, for readiness
+        # checks
+        self.signed_on = False
+        self.joined_channels = set()
+
+        # Maps tokens of our unanswered PINGs to when they were sent, and the
+        # round-trip time of the last one answered
+        self._pings = {}
+        self._ping_count = 0
+        self.rtt = None
+
     def signedOn(self):
         """Called once we've connected to a network"""
         super().signedOn()
 
         self.logger.info("Signed on as %s" % self.nickname)
+        self.signed_on = True
 
         # Give the factory the instance it created in case it needs to
         # interface for error handling or metadata retention.
         self.factory.cardinal = self
 
-        # Setup PluginManager
-        self.plugin_manager = PluginManager(self,
-                                            self.factory.plugins,
-                                            self.factory.blacklist)
+        # We're registered, so the next reconnection can be quick again
+        self.factory.last_reconnection_wait = None
+
+        # PluginManager is kept by the factory, so plugins loaded on a previous
+        # connection carry over to this one
+        self.plugin_manager = self.factory.plugin_manager
+        self.plugin_manager.rebind(self)
 
         if self.factory.server_commands:
             self.logger.info("Sending server commands")
@@ -139,19 +173,101 @@ class CardinalBot(irc.IRCClient, object):
         self.send("MODE {} +B".format(self.nickname))
 
         # Attempt to join channels
-        for channel in self.factory.channels:
+        for channel in self.factory.owned_channels():
             self.join(channel)
 
+        # Plugins were preloaded by the factory while we connected, so this
+        # just activates them. It doesn't hold up the joins above either way.
+        if not self.factory.plugins_loaded:
+            self.factory.plugins_loaded = True
+            d = self.plugin_manager.load_async(self.factory.plugins)
+            d.addCallback(self.factory._plugins_activated)
+
         # Set the uptime as now and grab the  boot time from the factory
         self.uptime = datetime.now()
         self.booted = self.factory.booted
 
+        # Plugins outlive this connection, so let any that hold on to the
+        # previous CardinalBot know about the new one
+        self.event_manager.fire("irc.signedon")
+
     def joined(self, channel):
         """Called when we join a channel.
 
         channel -- Channel joined. Provided by Twisted.
         """
         self.logger.info("Joined %s" % channel)
+        self.joined_channels.add(channel.lower())
+
+    def left(self, channel):
+        """Called when we leave a channel.
+
+        channel -- Channel left. Provided by Twisted.
+        """
+        self.logger.info("Left %s" % channel)
+        self.joined_channels.discard(channel.lower())
+
+    def kickedFrom(self, channel, kicker, message):
+        """Called when we're kicked from a channel.
+
+        channel -- Channel kicked from. Provided by Twisted.
+        kicker -- Nick of the user who kicked us. Provided by Twisted.
+        message -- Reason given for the kick. Provided by Twisted.
+        """
+        self.logger.warning("Kicked from %s by %s (%s)" %
+                            (channel, kicker, message))
+        self.joined_channels.discard(channel.lower())
+
+    def connectionLost(self, reason):
+        """Called when the connection to the server is lost.
+
+        reason -- Reason for disconnect. Provided by Twisted.
+        """
+        self.signed_on = False
+        self.joined_channels = set()
+        self._pings = {}
+        super().connectionLost(reason)
+
+    def _createHeartbeat(self):
+        heartbeat = super()._createHeartbeat()
+        heartbeat.clock = self.factory.reactor
+        return heartbeat
+
+    def _sendHeartbeat(self):
+        """Pings the server, unless too many pings went unanswered already.
+
+        Twisted starts this once we've registered with the server. If the
+        server stops answering, the connection is dropped, and the factory
+        reconnects like it would after any lost connection.
+        """
+        if len(self._pings) >= self.factory.max_missed_pongs:
+            metrics.PING_TIMEOUTS.inc(self.network)
+            self.logger.warning(
+                "Server didn't answer the last %d PINGs, reconnecting" %
+                len(self._pings))
+
+            self._pings = {}
+            self.stopHeartbeat()
+            self.transport.abortConnection()
+            return
+
+        self._ping_count += 1
+        token = "cardinal-%d" % self._ping_count
+        self._pings[token] = time.monotonic()
+        self.sendLine("PING :%s" % token)
+
+    def irc_PONG(self, prefix, params):
+        """Called when the server answers a PING"""
+        sent = self._pings.get(params[-1])
+        if sent is None:
+            return
+
+        self.rtt = time.monotonic() - sent
+        metrics.SERVER_RTT.observe(self.rtt, self.network)
+        self.logger.debug("Server round-trip time: %.3f seconds" % self.rtt)
+
+        # The server is there, even if earlier PINGs went unanswered
+        self._pings = {}
 
     def lineReceived(self, line):
         """Called for every line received from the server."""
@@ -175,6 +291,7 @@ class CardinalBot(irc.IRCClient, object):
 
         # Log if the command received is in the error range
         _, command, _ = irc.parsemsg(line)
+        metrics.LINES_RECEIVED.inc(self.network, command)
         if command.isnumeric() and 400 <= int(command) <= 599:
             self.logger.warning(
                 "Received an error from the server: {}"
@@ -483,6 +600,23 @@ class CardinalBot(irc.IRCClient, object):
 
         return config
 
+    def sendLine(self, line):
+        """Sends (or queues) a line to the server, counting it by command.
+
+        Keyword arguments:
+          line -- The line to send.
+        """
+        if isinstance(line, bytes):
+            line = line.decode('utf-8', 'replace')
+
+        words = line.split(' ', 2)
+        # Skip the prefix, if any
+        if words[0].startswith(':') and len(words) > 1:
+            words.pop(0)
+        metrics.LINES_SENT.inc(self.network, words[0].upper())
+
+        super().sendLine(line)
+
     def sendMsg(self, channel, message, length=None):
         """Wrapper command to send messages.
 
@@ -539,13 +673,19 @@ class CardinalBot(irc.IRCClient, object):
 
                 # Load the DB as JSON, use it, then save the result
                 with open(db_path, 'r+') as f:
+                    started = time.monotonic()
                     database = json.load(f)
+                    metrics.DB_SECONDS.observe(time.monotonic() - started,
+                                               'load')
 
                     yield database
 
+                    started = time.monotonic()
                     f.seek(0)
                     f.truncate()
                     json.dump(database, f)
+                    metrics.DB_SECONDS.observe(time.monotonic() - started,
+                                               'save')
             finally:
                 self.db_locks[db_path] = UNLOCKED
 
@@ -565,8 +705,14 @@ class CardinalBotFactory(protocol.ClientFactory):
     protocol = CardinalBot
     """Tells Twisted to look at the CardinalBot class for a client"""
 
+    _instances = weakref.WeakSet()
+    """Every factory, one per network, whose queues the metrics add up"""
+
+    FIRST_RECONNECTION_WAIT = 1
+    """Maximum time in seconds before the first reconnection attempt"""
+
     MINIMUM_RECONNECTION_WAIT = 10
-    """Minimum time in seconds before reconnection attempt"""
+    """Minimum time in seconds before later reconnection attempts"""
 
     MAXIMUM_RECONNECTION_WAIT = 300
     """Maximum time in connections before reconnection attempt"""
@@ -586,7 +732,21 @@ class CardinalBotFactory(protocol.ClientFactory):
                  realname,
                  plugins,
                  blacklist,
-                 storage):
+                 storage,
+                 lazy_plugins=False,
+                 isolated_plugins=None,
+                 blocking_threads=10,
+                 blocking_limit=2,
+                 plugin_timeout=None,
+                 plugin_timeouts=None,
+                 max_in_flight=None,
+                 ping_interval=60,
+                 max_missed_pongs=3,
+                 servers=None,
+                 ssl_context=None,
+                 connection_attempt_delay=0.25,
+                 db_locks=None,
+                 shards=None):
         """Boots the bot, triggers connection, and initializes logging.
 
         Keyword arguments:
@@ -601,26 +761,85 @@ class CardinalBotFactory(protocol.ClientFactory):
           plugins -- A list of plugins to load on boot.
           blacklist -- A dict mapping plugins to lists of blacklisted channels.
           storage -- A string containing path to storage directory.
+          lazy_plugins -- Whether to import plugins the first time they're
+            used, rather than on sign-on.
+          isolated_plugins -- A list of plugins to run in worker processes.
+          blocking_threads -- Size of the thread pool blocking commands are
+            run in.
+          blocking_limit -- How many blocking commands of each plugin can run
+            at once.
+          plugin_timeout -- Seconds a plugin's command or callback may take
+            before it's cancelled, or None for no timeout.
+          plugin_timeouts -- A dict mapping plugins to their own timeouts.
+          max_in_flight -- How many unfinished commands and callbacks each
+            plugin may have, or None for no limit.
+          ping_interval -- Seconds between pinging the server, or None to not
+            ping it.
+          max_missed_pongs -- How many pings may go unanswered before the
+            connection is considered dead.
+          servers -- A list of (host, port) or (host, port, priority) tuples
+            of the network's servers, by default the network on port 6667.
+          ssl_context -- The `TLSContexts` to connect over TLS with, or None
+            to connect in plaintext.
+          connection_attempt_delay -- Seconds to wait on connecting to one
+            server before also trying the next.
+          db_locks -- A dict of database locks to share with the factories
+            of other networks using the same storage.
+          shards -- A `Shards` splitting the channels between replicas of
+            the bot, or None to join every channel.
         """
         self.logger = logging.getLogger(__name__)
         self.network = network.lower()
         self.server_password = server_password
         self.server_commands = server_commands
         self.channels = channels
-        self.nickname = nickname
+        self.shards = shards
+        self.nickname = shards.nickname(nickname) if shards else nickname
         self.password = password
         self.username = username
         self.realname = realname
         self.plugins = plugins
         self.blacklist = blacklist
         self.storage_path = storage
+        self.ping_interval = ping_interval
+        self.max_missed_pongs = max_missed_pongs
+        self.servers = ServerList(servers or [(self.network, 6667)])
+        self.ssl_context = ssl_context
+        self.connection_attempt_delay = connection_attempt_delay
+        self.db_locks = db_locks if db_locks is not None else {}
+
+        # Register SIGINT handler, so we can close the connection cleanly.
+        # When there's a factory per network, each passes it on to the one
+        # registered before it.
+        self._previous_sigint = signal.signal(signal.SIGINT, self._sigint)
 
-        # Register SIGINT handler, so we can close the connection cleanly
-        signal.signal(signal.SIGINT, self._sigint)
+        # Fires once we've disconnected on purpose
+        self.disconnected = defer.Deferred()
 
         # Cardinal will set an instance of itself here later
         self.cardinal = None
 
+        # Start importing plugins while we connect, unless they're imported
+        # once used. CardinalBot will load them on its first sign-on and hand
+        # them to each new connection after.
+        self.plugin_manager = PluginManager(None, [], blacklist,
+                                            lazy=lazy_plugins,
+                                            isolated=isolated_plugins,
+                                            blocking_threads=blocking_threads,
+                                            blocking_limit=blocking_limit,
+                                            timeout=plugin_timeout,
+                                            max_in_flight=max_in_flight,
+                                            timeouts=plugin_timeouts)
+        if not lazy_plugins:
+            self.plugin_manager.preload(plugins)
+        self.plugins_loaded = False
+
+        # Whether the plugins being loaded have all been activated
+        self.plugins_ready = False
+
+        # Kept across connections along with the plugins, see buildProtocol()
+        self.event_manager = None
+
         # This will be set to True when we don't want to trigger reconnection
         # logic.
         self.disconnect = False
@@ -628,9 +847,95 @@ class CardinalBotFactory(protocol.ClientFactory):
         # The time we first connected to the network with Cardinal
         self.booted = datetime.now()
 
-        # Used for backing off when reconnecting
+        # Used for backing off when reconnecting. Reset once signed on.
         self.last_reconnection_wait = None
 
+        # The ConnectionRace of the current (or last) connection
+        self.race = None
+
+        # The LeaderElection this replica takes part in, if any
+        self.election = None
+
+        CardinalBotFactory._instances.add(self)
+        metrics.OUTBOUND_QUEUE.set_function(
+            CardinalBotFactory._outbound_queue_length)
+
+    @classmethod
+    def _outbound_queue_length(cls):
+        """Returns how many lines are waiting to be sent, to every network."""
+        return sum(len(getattr(factory.cardinal, '_queue', None) or [])
+                   for factory in list(cls._instances))
+
+    def _plugins_activated(self, failed_plugins):
+        self.plugins_ready = True
+        return failed_plugins
+
+    def buildProtocol(self, addr):
+        """Creates an instance of CardinalBot for a new connection.
+
+        The EventManager of the first instance is kept for every connection
+        after it, so callbacks and events registered by plugins survive
+        reconnects. It calls plugins' callbacks within the PluginManager's
+        limits.
+
+        Keyword arguments:
+          addr -- Address of the server. Provided by Twisted.
+
+        Returns:
+          CardinalBot -- The new instance.
+        """
+        cardinal = super().buildProtocol(addr)
+
+        if self.event_manager is None:
+            self.event_manager = cardinal.event_manager
+        else:
+            cardinal.event_manager = self.event_manager
+        self.event_manager.cardinal = cardinal
+        self.event_manager.limits = self.plugin_manager.limits
+        cardinal.db_locks = self.db_locks
+
+        return cardinal
+
+    def owned_channels(self):
+        """Returns the channels this replica of the bot should be in.
+
+        Returns:
+          list -- Every channel, or this shard's if channels are sharded.
+        """
+        if self.shards is None:
+            return list(self.channels)
+        return self.shards.channels(self.channels)
+
+    def reshard(self, count):
+        """Rebalances channels after the number of replicas changed.
+
+        Channels no longer ours are left, and ones that now are joined.
+
+        Keyword arguments:
+          count -- Number of replicas.
+        """
+        if self.shards is None or count == self.shards.count:
+            return
+
+        before = self.owned_channels()
+        self.shards.resize(count)
+        after = self.owned_channels()
+
+        self.logger.info("Rebalancing channels over %d replicas, %d of %d "
+                         "channels are ours" %
+                         (self.shards.count, len(after), len(self.channels)))
+
+        cardinal = self.cardinal
+        if cardinal is None or not cardinal.signed_on:
+            return
+
+        for channel in before:
+            if channel not in after:
+                cardinal.part(channel, 'Rebalancing channels')
+        for channel in after:
+            if channel not in before:
+                cardinal.join(channel)
+
     def _sigint(self, signal, frame):
         """Called when a SIGINT is received.
 
@@ -640,6 +945,72 @@ class CardinalBotFactory(protocol.ClientFactory):
         self.disconnect = True
         if self.cardinal:
             self.cardinal.quit('Received SIGINT.')
+        elif not self.disconnected.called:
+            self.disconnected.callback(None)
+
+        previous = self._previous_sigint
+        if isinstance(getattr(previous, '__self__', None),
+                      CardinalBotFactory):
+            previous(signal, frame)
+
+    def next_reconnection_wait(self):
+        """Picks how long to wait before the next reconnection attempt.
+
+        The first attempt after we were signed on is made almost right away,
+        since most drops are transient. After that, waits back off with
+        decorrelated jitter: each is random, between the minimum and three
+        times the last wait, up to the maximum. That way, bots that lost
+        their connection at once don't keep reconnecting in lockstep.
+
+        Returns:
+          float -- Seconds to wait.
+        """
+        if self.last_reconnection_wait is None:
+            wait_time = random.uniform(0, self.FIRST_RECONNECTION_WAIT)
+        else:
+            wait_time = min(self.MAXIMUM_RECONNECTION_WAIT, random.uniform(
+                self.MINIMUM_RECONNECTION_WAIT,
+                max(self.MINIMUM_RECONNECTION_WAIT,
+                    self.last_reconnection_wait * 3)))
+
+        self.last_reconnection_wait = wait_time
+        return wait_time
+
+    def connect(self):
+        """Connects to whichever of the network's servers answers first.
+
+        Servers are tried by priority, then those that connected fastest
+        before, then in the configured order.
+
+        Returns:
+          ConnectionRace -- The race between the servers.
+        """
+        if self.ssl_context is not None:
+            def connect(host, port, factory):
+                return self.reactor.connectSSL(host, port, factory,
+                                               self.ssl_context.creator(host))
+        else:
+            connect = self.reactor.connectTCP
+
+        self.race = ConnectionRace(self,
+                                   self.servers.ordered(),
+                                   connect,
+                                   self.connection_attempt_delay,
+                                   _reactor=self.reactor)
+        self.race.start()
+
+        return self.race
+
+    def _reconnect(self):
+        """Waits, then connects again.
+
+        Returns:
+          float -- Seconds until reconnecting.
+        """
+        wait_time = self.next_reconnection_wait()
+        deferLater(self.reactor, wait_time, self.connect)
+
+        return wait_time
 
     def clientConnectionLost(self, connector, reason):
         """Called when we lose connection to the server.
@@ -651,26 +1022,25 @@ class CardinalBotFactory(protocol.ClientFactory):
         # This flag tells us if Cardinal was told to disconnect by a user. If
         # not, we'll attempt to reconnect.
         if not self.disconnect:
-            self.logger.info(
-                "Connection lost (%s), reconnecting in %d seconds." %
-                (reason, self.MINIMUM_RECONNECTION_WAIT)
-            )
+            metrics.RECONNECTS.inc(self.network, 'lost')
+
+            # A server that drops us before we're registered is tried last
+            if self.last_reconnection_wait is not None and \
+                    self.race is not None and self.race.winner is not None:
+                self.race.winner.server.failed()
 
-            # Reset the last reconnection wait time since this is the first
-            # time we've disconnected since a successful connection and then
-            # wait before connecting.
-            self.last_reconnection_wait = self.MINIMUM_RECONNECTION_WAIT
-            deferLater(
-                self.reactor,
-                self.last_reconnection_wait,
-                connector.connect
+            wait_time = self._reconnect()
+            self.logger.info(
+                "Connection lost (%s), reconnecting in %.1f seconds." %
+                (reason, wait_time)
             )
         else:
             self.logger.info(
                 "Disconnected successfully (%s), quitting." % reason
             )
 
-            self.reactor.stop()
+            if not self.disconnected.called:
+                self.disconnected.callback(None)
 
     def clientConnectionFailed(self, connector, reason):
         """Called when a connection attempt fails.
@@ -679,27 +1049,9 @@ class CardinalBotFactory(protocol.ClientFactory):
           connector -- Twisted IRC connector. Provided by Twisted.
           reason -- Reason connection failed. Provided by Twisted.
         """
-        # If we disconnected on our first connection attempt, then we don't
-        # need to calculate a wait time, we can just use the minimum time
-        if not self.last_reconnection_wait:
-            wait_time = self.MINIMUM_RECONNECTION_WAIT
-        else:
-            # We'll attempt to reconnect after waiting twice as long as the
-            # last time we waited, unless it exceeds the maximum wait time, in
-            # which case we'll wait that long instead
-            wait_time = self.last_reconnection_wait * 2
-            if wait_time > self.MAXIMUM_RECONNECTION_WAIT:
-                wait_time = self.MAXIMUM_RECONNECTION_WAIT
-
+        metrics.RECONNECTS.inc(self.network, 'failed')
+        wait_time = self._reconnect()
         self.logger.info(
-            "Could not connect (%s), retrying in %d seconds" %
+            "Could not connect (%s), retrying in %.1f seconds" %
             (reason, wait_time)
         )
-
-        # Update the last connection wait time, then wait and try to connect
-        self.last_reconnection_wait = wait_time
-        deferLater(
-            self.reactor,
-            self.last_reconnection_wait,
-            connector.connect
-        )
@@ -130,3 +130,46 @@ class ConfigParser:
                 option, value)
 
         return self.config
+
+    def load_overrides(self, name, options):
+        """Returns copies of the config, with each of a list of overrides.
+
+        The option `name` holds a list of dicts, each overriding some of the
+        given options, e.g. one per IRC network. Values are validated like the
+        rest of the config, invalid ones and other options are ignored.
+
+        Keyword arguments:
+          name -- Name of the option holding the list of overrides.
+          options -- Names of the options that may be overridden.
+
+        Returns:
+          list -- A config dict for each override, or just the config if there
+            are none.
+        """
+        configs = []
+        for overrides in self.config.get(name) or []:
+            if not isinstance(overrides, dict):
+                self.logger.warning(
+                    "Value in option %s was invalid -- ignoring" % name)
+                continue
+
+            config = dict(self.config)
+            for option, value in overrides.items():
+                if option not in options:
+                    self.logger.warning(
+                        "Option %s can't be set in %s -- ignoring" %
+                        (option, name))
+                    continue
+
+                type_check, _ = self.spec.options[option]
+                if not isinstance(value, type_check):
+                    self.logger.warning(
+                        "Value passed in for option %s in %s was invalid -- "
+                        "ignoring" % (option, name))
+                    continue
+
+                config[option] = value
+
+            configs.append(config)
+
+        return configs or [self.config]
@@ -1,10 +1,14 @@
 import re
+import weakref
 
 
 _RETYPE = type(re.compile('foobar'))
 
+# Maps plugin classes to the names of their commands and event callbacks
+_manifests = weakref.WeakKeyDictionary()
 
-def command(triggers):
+
+def command(triggers, blocking=False):
     if isinstance(triggers, str):
         triggers = [triggers]
 
@@ -13,18 +17,23 @@ def command(triggers):
 
     def wrap(f):
         f.commands = triggers
+        # Blocking commands are run in a thread pool
+        if blocking:
+            f.blocking = True
         return f
 
     return wrap
 
 
-def regex(expression):
+def regex(expression, blocking=False):
     if (not isinstance(expression, str) and
             not isinstance(expression, _RETYPE)):
         raise TypeError("Regular expression must be a string or regex type")
 
     def wrap(f):
         f.regex = expression
+        if blocking:
+            f.blocking = True
         return f
 
     return wrap
@@ -62,3 +71,51 @@ def event(triggers):
         return f
 
     return wrap
+
+
+def get_manifest(cls):
+    """Returns the names of a class's commands and event callbacks.
+
+    These are the methods the decorators above were applied to. The class is
+    only looked through once, its manifest is cached after that. Only the
+    class dictionaries are looked at, so no properties are triggered.
+
+    Keyword arguments:
+      cls -- The class, e.g. of a plugin instance.
+
+    Returns:
+      tuple -- Sorted lists of command names and event callback names.
+    """
+    try:
+        return _manifests[cls]
+    except (KeyError, TypeError):
+        pass
+
+    commands = []
+    callbacks = []
+    seen = set()
+    for klass in cls.__mro__:
+        for name, value in vars(klass).items():
+            # Overridden in a subclass
+            if name in seen:
+                continue
+            seen.add(name)
+
+            if isinstance(value, (staticmethod, classmethod)):
+                value = value.__func__
+            if not callable(value):
+                continue
+
+            if hasattr(value, 'regex') or hasattr(value, 'commands'):
+                commands.append(name)
+            if hasattr(value, 'events'):
+                callbacks.append(name)
+
+    manifest = (sorted(commands), sorted(callbacks))
+    try:
+        _manifests[cls] = manifest
+    except TypeError:
+        # Can't be weakly referenced, so don't cache it
+        pass
+
+    return manifest
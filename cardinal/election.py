@@ -0,0 +1,201 @@
+import fcntl
+import json
+import logging
+import os
+import socket
+import time
+from contextlib import contextmanager
+
+from twisted.internet import reactor
+from twisted.internet.task import LoopingCall
+
+from cardinal import metrics
+
+
+class FileLease:
+    """A lease stored in a file, which replicas take turns holding.
+
+    The file is locked while the lease is read and written, so it works
+    between processes on one host, or between hosts sharing the file on a
+    filesystem with working locks. Other stores only need the same
+    acquire() and release() methods.
+    """
+
+    def __init__(self, path):
+        """Creates a new lease.
+
+        Keyword arguments:
+          path -- Path to the lease file, created if it doesn't exist.
+        """
+        self.logger = logging.getLogger(__name__)
+        self.path = path
+
+    @contextmanager
+    def _locked(self):
+        with open(self.path, 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield f
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _read(self, f):
+        f.seek(0)
+        try:
+            lease = json.loads(f.read() or '{}')
+        except ValueError:
+            self.logger.warning("Lease file %s is corrupt -- ignoring" %
+                                self.path)
+            return None
+
+        if not lease.get('holder') or lease.get('expires', 0) <= time.time():
+            return None
+
+        return lease
+
+    def _write(self, f, lease):
+        f.seek(0)
+        f.truncate()
+        f.write(json.dumps(lease))
+        f.flush()
+        os.fsync(f.fileno())
+
+    def holder(self):
+        """Returns who holds the lease.
+
+        Returns:
+          str -- The holder, or None if the lease is free or expired.
+        """
+        with self._locked() as f:
+            lease = self._read(f)
+
+        return lease['holder'] if lease else None
+
+    def acquire(self, holder, duration):
+        """Takes or renews the lease, unless someone else holds it.
+
+        Keyword arguments:
+          holder -- Who's taking the lease.
+          duration -- Seconds until the lease expires, unless renewed.
+
+        Returns:
+          bool -- Whether the lease is now held by `holder`.
+        """
+        with self._locked() as f:
+            lease = self._read(f)
+            if lease is not None and lease['holder'] != holder:
+                return False
+
+            self._write(f, {'holder': holder,
+                            'expires': time.time() + duration})
+
+        return True
+
+    def release(self, holder):
+        """Gives up the lease, if it's held by `holder`.
+
+        Keyword arguments:
+          holder -- Who's releasing the lease.
+        """
+        with self._locked() as f:
+            lease = self._read(f)
+            if lease is not None and lease['holder'] == holder:
+                self._write(f, {})
+
+
+class LeaderElection:
+    """Elects one replica of the bot to run work that must only run once.
+
+    Replicas race to hold a lease, and the one holding it is the leader
+    until it stops renewing it. The others keep trying, so one of them takes
+    over soon after the leader goes away. Plugins check
+    `CardinalBot.is_leader`, and are told of changes by the leader.elected
+    and leader.deposed events.
+    """
+
+    @property
+    def reactor(self):
+        return getattr(self, '_reactor', reactor)
+
+    def __init__(self, factories, lease, identity=None, duration=15):
+        """Creates a new election. Call start() to take part in it.
+
+        Keyword arguments:
+          factories -- The `CardinalBotFactory` of each network, whose
+            plugins are told about changes of leadership.
+          lease -- The lease store, e.g. a `FileLease`.
+          identity -- Name of this replica, by default its hostname and PID.
+          duration -- Seconds the leader has to renew the lease before
+            another replica may take it.
+        """
+        self.logger = logging.getLogger(__name__)
+        self.factories = factories
+        self.lease = lease
+        self.identity = identity or "%s:%d" % (socket.gethostname(),
+                                               os.getpid())
+        self.duration = duration
+
+        # Until when the lease is ours, by time.monotonic()
+        self.expires = None
+
+        # Whether plugins were last told we lead
+        self._leading = False
+
+        self._looping_call = None
+
+    @property
+    def is_leader(self):
+        """Whether this replica holds the lease right now."""
+        return self.expires is not None and time.monotonic() < self.expires
+
+    def start(self):
+        """Starts trying to take the lease, and renewing it."""
+        self.logger.info("Running for leader as %s" % self.identity)
+
+        self._looping_call = LoopingCall(self.renew)
+        self._looping_call.clock = self.reactor
+        self._looping_call.start(self.duration / 3.0)
+
+    def stop(self):
+        """Stops renewing the lease, and releases it if we hold it."""
+        if self._looping_call is not None and self._looping_call.running:
+            self._looping_call.stop()
+        self._looping_call = None
+
+        if self.is_leader:
+            try:
+                self.lease.release(self.identity)
+            except Exception:
+                self.logger.exception("Unable to release lease")
+        self.expires = None
+        self._changed()
+
+    def renew(self):
+        """Takes or renews the lease, if we can."""
+        started = time.monotonic()
+        try:
+            acquired = self.lease.acquire(self.identity, self.duration)
+        except Exception:
+            self.logger.exception("Unable to renew lease")
+            acquired = False
+
+        # Our lease runs from before we asked for it, to be safe
+        self.expires = started + self.duration if acquired else None
+        self._changed()
+
+    def _changed(self):
+        leading = self.is_leader
+        if leading == self._leading:
+            return
+        self._leading = leading
+
+        metrics.LEADER.set(1 if leading else 0)
+        if leading:
+            self.logger.info("Elected leader")
+        else:
+            self.logger.warning("No longer leader")
+
+        for factory in self.factories:
+            if factory.event_manager is not None:
+                factory.event_manager.fire(
+                    'leader.elected' if leading else 'leader.deposed')
@@ -10,6 +10,10 @@ class PluginError(CardinalException):
     """Raised when a plugin is invalid in some way."""
 
 
+class PluginBusyError(CardinalException):
+    """Raised when a plugin has too many calls in flight."""
+
+
 class CommandNotFoundError(CardinalException):
     """Raised when a given command isn't loaded."""
 
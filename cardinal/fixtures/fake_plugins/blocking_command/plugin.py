@@ -0,0 +1,18 @@
+from cardinal.decorators import command
+
+
+class TestBlockingCommandPlugin:
+    def __init__(self):
+        self.calls = []
+
+    @command('slow', blocking=True)
+    def slow(self, *args):
+        self.calls.append(args)
+
+    @command('fast')
+    def fast(self, *args):
+        self.calls.append(args)
+
+
+def setup():
+    return TestBlockingCommandPlugin()
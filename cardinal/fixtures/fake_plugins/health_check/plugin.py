@@ -0,0 +1,12 @@
+class TestHealthCheckPlugin:
+    def __init__(self):
+        self.problem = None
+
+    def health_check(self):
+        if self.problem == 'raise':
+            raise Exception()
+        return self.problem
+
+
+def setup():
+    return TestHealthCheckPlugin()
@@ -0,0 +1,25 @@
+from cardinal.decorators import command, event
+
+
+class TestWorkerPlugin:
+    def __init__(self):
+        self.closed = False
+
+    @command('echo')
+    def echo(self, cardinal, user, channel, msg):
+        cardinal.sendMsg(channel, "%s said: %s" % (user.nick, msg))
+        return msg
+
+    @command('fail')
+    def fail(self, cardinal, user, channel, msg):
+        raise Exception("Failed on purpose")
+
+    @event('irc.join')
+    def joined(self, cardinal, user, channel):
+        cardinal.sendMsg(channel, "Hi %s" % user.nick)
+
+    def close(self):
+        self.closed = True
+
+
+entrypoint = TestWorkerPlugin
@@ -0,0 +1,127 @@
+import logging
+import time
+
+from twisted.web.resource import Resource
+
+
+class HealthResource(Resource):
+    """Serves the result of a health check, for Kubernetes probes.
+
+    Responds 200 with "ok" when the check finds no problems, and 503 with
+    the problems, one per line, otherwise. Checks run on the reactor thread,
+    so they only look at state that's already known.
+    """
+
+    isLeaf = True
+
+    def __init__(self, check):
+        """Creates a new resource.
+
+        Keyword arguments:
+          check -- Callable returning a list of problems.
+        """
+        super().__init__()
+        self.logger = logging.getLogger(__name__)
+        self.check = check
+
+    def render_GET(self, request):
+        try:
+            problems = self.check()
+        except Exception:
+            self.logger.exception("Health check failed")
+            problems = ["health check failed"]
+
+        request.setHeader(b'Content-Type', b'text/plain; charset=utf-8')
+        if problems:
+            request.setResponseCode(503)
+            return ''.join(problem + '\n' for problem in problems) \
+                .encode('utf-8')
+
+        return b'ok\n'
+
+
+class HealthChecks:
+    """Liveness and readiness checks of a bot.
+
+    The bot is live when its reactor keeps up, and ready once it's signed on,
+    joined its channels, and its plugins are loaded and report no problems.
+    """
+
+    def __init__(self, factories, lag_monitor=None):
+        """Creates checks for a bot.
+
+        Keyword arguments:
+          factories -- The `CardinalBotFactory` of each network.
+          lag_monitor -- The bot's `LagMonitor`, if lag is monitored.
+        """
+        self.factories = factories
+        self.lag_monitor = lag_monitor
+
+    def live(self):
+        """Checks whether the bot is running, rather than wedged.
+
+        That this runs at all means the reactor is responsive. It must also
+        not have been blocked for longer than the lag threshold recently.
+
+        Returns:
+          list -- Descriptions of problems.
+        """
+        monitor = self.lag_monitor
+        if monitor is None or monitor.last_tick is None:
+            return []
+
+        problems = []
+        if monitor.lag >= monitor.threshold:
+            problems.append("reactor lagged %.3f seconds" % monitor.lag)
+
+        since_tick = time.monotonic() - monitor.last_tick
+        if since_tick > monitor.interval + monitor.threshold:
+            problems.append("lag monitor last ran %.3f seconds ago" %
+                            since_tick)
+
+        return problems
+
+    def ready(self):
+        """Checks whether the bot is doing its job, on every network.
+
+        Returns:
+          list -- Descriptions of problems.
+        """
+        problems = []
+        for factory in self.factories:
+            for problem in self._ready(factory):
+                if len(self.factories) > 1:
+                    problem = "%s: %s" % (factory.network, problem)
+                problems.append(problem)
+
+        return problems
+
+    @staticmethod
+    def _ready(factory):
+        problems = []
+
+        cardinal = factory.cardinal
+        if cardinal is None or not cardinal.signed_on:
+            problems.append("not signed on")
+        else:
+            missing = [channel for channel in factory.owned_channels()
+                       if channel.lower() not in cardinal.joined_channels]
+            if missing:
+                problems.append("not in channels: %s" % ', '.join(missing))
+
+        if not factory.plugins_ready:
+            problems.append("plugins not loaded")
+        problems.extend(factory.plugin_manager.check_health())
+
+        return problems
+
+    def resources(self):
+        """Returns the probes' resources, to serve with `metrics.listen()`.
+
+        Returns:
+          dict -- Maps paths to resources.
+        """
+        return {
+            b'healthz': HealthResource(self.live),
+            b'readyz': HealthResource(self.ready),
+        }
@@ -0,0 +1,171 @@
+import logging
+import sys
+import threading
+import time
+import traceback
+
+from twisted.internet import reactor
+from twisted.internet.task import LoopingCall
+
+from cardinal import metrics
+
+
+class LagMonitor:
+    """Detects when the reactor is blocked, and by what.
+
+    A frequent LoopingCall measures how late the reactor gets round to it,
+    which is how long nothing else could run. Since the reactor can't report
+    on itself while it's blocked, a watchdog thread checks when the
+    LoopingCall last ran, and logs the reactor thread's stack once it's late
+    by more than the threshold. Stalls are blamed on the plugin command,
+    callback or event running on the reactor thread at the time, if any.
+    """
+
+    @property
+    def reactor(self):
+        return getattr(self, '_reactor', reactor)
+
+    def __init__(self, factories, interval=0.1, threshold=0.5):
+        """Creates a new monitor for a bot's reactor.
+
+        Keyword arguments:
+          factories -- The `CardinalBotFactory` of each network, to tell
+            what's running.
+          interval -- Seconds between measuring lag.
+          threshold -- Seconds of lag after which stalls are logged.
+        """
+        self.logger = logging.getLogger(__name__)
+        self.factories = factories
+        self.interval = interval
+        self.threshold = threshold
+
+        # When the LoopingCall last ran, by time.monotonic()
+        self.last_tick = None
+
+        # Seconds the LoopingCall was late the last time it ran
+        self.lag = 0.0
+
+        # Whether the current stall has been logged by the watchdog already
+        self._reported = False
+
+        self._thread_id = None
+        self._looping_call = None
+        self._watchdog = None
+        self._stopped = threading.Event()
+
+    def start(self, watchdog=True):
+        """Starts measuring lag. Must be called from the reactor thread.
+
+        Keyword arguments:
+          watchdog -- Whether to start the thread logging stalls as they
+            happen.
+        """
+        self.logger.info(
+            "Monitoring reactor lag, logging stalls over %s seconds" %
+            self.threshold)
+
+        self._thread_id = threading.get_ident()
+        self._stopped.clear()
+
+        self._looping_call = LoopingCall(self.tick)
+        self._looping_call.clock = self.reactor
+        self._looping_call.start(self.interval)
+
+        if watchdog:
+            self._watchdog = threading.Thread(target=self._watch,
+                                              name='reactor-watchdog',
+                                              daemon=True)
+            self._watchdog.start()
+
+    def stop(self):
+        """Stops measuring lag."""
+        self._stopped.set()
+        if self._looping_call is not None and self._looping_call.running:
+            self._looping_call.stop()
+        self._looping_call = None
+        self._watchdog = None
+
+    def running(self):
+        """Describes what's running on the reactor thread right now.
+
+        Returns:
+          str -- A description, or None if no plugin or event is running.
+        """
+        for factory in self.factories:
+            running = self._running(factory)
+            if running is not None and len(self.factories) > 1:
+                return "%s on %s" % (running, factory.network)
+            elif running is not None:
+                return running
+
+        return None
+
+    @staticmethod
+    def _running(factory):
+        plugin_manager = factory.plugin_manager
+        current = plugin_manager.profiler.current if plugin_manager else None
+        event_manager = factory.event_manager
+        firing = event_manager.firing if event_manager else None
+
+        if current is not None and firing is not None:
+            return "%s of plugin %s, for event %s" % (
+                current[1], current[0], firing)
+        elif current is not None:
+            return "%s of plugin %s" % (current[1], current[0])
+        elif firing is not None:
+            return "a callback for event %s" % firing
+
+        return None
+
+    def tick(self):
+        """Measures how late the reactor ran this, since the last time."""
+        now = time.monotonic()
+        if self.last_tick is not None:
+            lag = max(0.0, now - self.last_tick - self.interval)
+            self.lag = lag
+            metrics.REACTOR_LAG.observe(lag)
+
+            if lag >= self.threshold:
+                self.logger.warning(
+                    "Reactor was blocked for %.3f seconds" % lag)
+
+        self.last_tick = now
+        self._reported = False
+
+    def check(self):
+        """Logs the reactor thread's stack, if it's blocked right now.
+
+        Called from the watchdog thread. Each stall is only logged once.
+
+        Returns:
+          bool -- Whether a stall was logged.
+        """
+        last_tick = self.last_tick
+        if last_tick is None or self._reported:
+            return False
+
+        lag = time.monotonic() - last_tick - self.interval
+        if lag < self.threshold:
+            return False
+
+        self._reported = True
+        metrics.REACTOR_STALLS.inc()
+
+        frame = sys._current_frames().get(self._thread_id)
+        stack = ''.join(traceback.format_stack(frame)) if frame else ''
+        running = self.running()
+
+        self.logger.warning(
+            "Reactor has been blocked for %.3f seconds%s, at:\n%s" %
+            (lag,
+             " running %s" % running if running else "",
+             stack))
+
+        return True
+
+    def _watch(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.check()
+            except Exception:
+                self.logger.exception("Error checking for reactor stalls")
@@ -0,0 +1,150 @@
+import logging
+from collections import defaultdict
+
+from twisted.internet import defer, error, reactor
+from twisted.python.failure import Failure
+
+from cardinal.exceptions import PluginBusyError
+
+
+class CallLimits:
+    """Bounds how long plugin calls may take and how many may be in flight.
+
+    A call that hasn't finished within its plugin's timeout is cancelled, so
+    a hung plugin doesn't keep its Deferred (and everything it references)
+    around forever. Calls made while a plugin already has too many in flight
+    are refused rather than queued.
+    """
+
+    @property
+    def reactor(self):
+        return getattr(self, '_reactor', reactor)
+
+    def __init__(self, timeout=None, max_in_flight=None, timeouts=None,
+                 profiler=None):
+        """Creates new limits. By default, calls aren't limited.
+
+        Keyword arguments:
+          timeout -- Seconds a call may take, or None for no timeout.
+          max_in_flight -- How many calls each plugin may have unfinished, or
+            None for no limit.
+          timeouts -- A dict mapping plugin names to their own timeouts.
+          profiler -- A `Profiler` to record calls with, if any.
+        """
+        self.logger = logging.getLogger(__name__)
+        self.timeout = timeout
+        self.max_in_flight = max_in_flight
+        self.timeouts = timeouts or {}
+        self.profiler = profiler
+
+        # Maps plugin names to their number of unfinished calls
+        self.in_flight = defaultdict(int)
+
+    def get_timeout(self, plugin):
+        """Returns the timeout of a plugin's calls.
+
+        Keyword arguments:
+          plugin -- Name of the plugin.
+
+        Returns:
+          float -- Seconds, or None for no timeout.
+        """
+        return self.timeouts.get(plugin, self.timeout)
+
+    def call(self, plugin, f, *args, name=None, cancel=True):
+        """Calls a plugin's command or callback within its limits.
+
+        Keyword arguments:
+          plugin -- Name of the plugin.
+          f -- The callable, which may return a Deferred.
+          args -- Arguments to call it with.
+          name -- Name of the call for logging, by default that of `f`.
+          cancel -- Whether to cancel the call once it times out. Calls that
+            can't really be stopped, like ones running in a thread, should
+            keep counting as in flight until they finish instead.
+
+        Returns:
+          Deferred -- Fires with the call's result. Fails with a TimeoutError
+            if it took too long, or a PluginBusyError if the plugin had too
+            many calls in flight.
+        """
+        name = name or getattr(f, '__name__', repr(f))
+        if self.max_in_flight is not None and \
+                self.in_flight.get(plugin, 0) >= self.max_in_flight:
+            self.logger.warning(
+                "Plugin %s has %d calls in flight, refusing another: %s" %
+                (plugin, self.in_flight.get(plugin, 0), name))
+            return defer.fail(PluginBusyError(
+                "Too many calls in flight for plugin: %s" % plugin))
+
+        if self.profiler is not None:
+            d = self.profiler.call(plugin, name, f, *args)
+        else:
+            d = defer.maybeDeferred(f, *args)
+        # Most calls finish right away. One waiting on another Deferred, like
+        # a call queued for a thread, has fired but not finished
+        if d.called and not d.paused:
+            return d
+
+        self.in_flight[plugin] += 1
+
+        def finished(result):
+            self.in_flight[plugin] -= 1
+            if not self.in_flight[plugin]:
+                del self.in_flight[plugin]
+            return result
+
+        timeout = self.get_timeout(plugin)
+        if timeout is not None and not cancel:
+            d.addBoth(finished)
+            return self._time_out(d, plugin, name, timeout)
+
+        if timeout is not None:
+            def on_timeout(result, timeout):
+                self.logger.warning(
+                    "Call to %s of plugin %s timed out after %s seconds" %
+                    (name, plugin, timeout))
+                if isinstance(result, Failure) and \
+                        result.check(defer.CancelledError):
+                    raise error.TimeoutError(
+                        "Call to %s of plugin %s timed out" % (name, plugin))
+                return result
+
+            d.addTimeout(timeout, self.reactor, onTimeoutCancel=on_timeout)
+
+        d.addBoth(finished)
+
+        return d
+
+    def _time_out(self, d, plugin, name, timeout):
+        """Fails with a TimeoutError if a call takes too long, but lets it go
+        on rather than cancelling it.
+
+        Returns:
+          Deferred -- Fires with the call's result, or the TimeoutError.
+        """
+        # Giving up on the call early stops waiting for the timeout too
+        result = defer.Deferred(lambda _: delayed_call.cancel())
+
+        def on_timeout():
+            self.logger.warning(
+                "Call to %s of plugin %s timed out after %s seconds, still "
+                "waiting for it to finish" % (name, plugin, timeout))
+            result.errback(error.TimeoutError(
+                "Call to %s of plugin %s timed out" % (name, plugin)))
+        delayed_call = self.reactor.callLater(timeout, on_timeout)
+
+        def done(value):
+            if delayed_call.active():
+                delayed_call.cancel()
+                if isinstance(value, Failure):
+                    result.errback(value)
+                else:
+                    result.callback(value)
+            elif isinstance(value, Failure):
+                self.logger.warning(
+                    "Call to %s of plugin %s failed after timing out: %s" %
+                    (name, plugin, value.getErrorMessage()))
+        d.addBoth(done)
+
+        return result
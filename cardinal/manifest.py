@@ -0,0 +1,97 @@
+import ast
+import logging
+
+logger = logging.getLogger(__name__)
+
+DECORATORS = ('command', 'regex', 'event', 'help')
+"""Names of the decorators in `cardinal.decorators` a manifest is read from"""
+
+
+def _decorator_name(node):
+    """Returns the name of a decorator call like `@command(...)`, or None."""
+    if not isinstance(node, ast.Call) or len(node.args) != 1:
+        return None
+
+    func = node.func
+    if isinstance(func, ast.Name):
+        name = func.id
+    elif isinstance(func, ast.Attribute):
+        name = func.attr
+    else:
+        return None
+
+    return name if name in DECORATORS else None
+
+
+def read_manifest(filename):
+    """Reads the commands and events of a plugin without importing it.
+
+    The plugin's source is parsed and the arguments of the `@command`,
+    `@regex`, `@event` and `@help` decorators on its methods are read, as long
+    as they're literals (e.g. strings or lists of strings).
+
+    Keyword arguments:
+      filename -- Path to the plugin's module.
+
+    Returns:
+      dict -- With a list of `commands` (each a dict with the method name,
+        `commands`, `regex`, `help` and whether it's `blocking`) and a list
+        of `callbacks` (each a dict with the method name and `event_names`).
+        None if the module can't be read or a decorator argument isn't a
+        literal.
+    """
+    try:
+        with open(filename, 'r') as f:
+            tree = ast.parse(f.read(), filename)
+    except (OSError, SyntaxError, ValueError):
+        logger.debug("Can't read manifest from %s" % filename,
+                     exc_info=True)
+        return None
+
+    commands = []
+    callbacks = []
+    for node in ast.walk(tree):
+        if not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            continue
+
+        entry = {'method': node.name}
+        for decorator in node.decorator_list:
+            name = _decorator_name(decorator)
+            if name is None:
+                continue
+
+            try:
+                value = ast.literal_eval(decorator.args[0])
+                keywords = {keyword.arg: ast.literal_eval(keyword.value)
+                            for keyword in decorator.keywords}
+            except ValueError:
+                logger.debug("Non-literal @%s on %s in %s" %
+                             (name, node.name, filename))
+                return None
+
+            if name == 'help':
+                # Decorators listed first end up first in the help
+                entry.setdefault('help', [])
+                entry['help'] += [value] if isinstance(value, str) else value
+            elif name == 'regex':
+                entry['regex'] = value
+            else:
+                key = 'commands' if name == 'command' else 'event_names'
+                entry[key] = [value] if isinstance(value, str) else value
+
+            if keywords.get('blocking'):
+                entry['blocking'] = True
+
+        if 'commands' in entry or 'regex' in entry:
+            commands.append({key: entry[key] for key in
+                             ('method', 'commands', 'regex', 'help',
+                              'blocking')
+                             if key in entry})
+        if 'event_names' in entry:
+            callbacks.append({'method': entry['method'],
+                              'event_names': entry['event_names']})
+
+    return {
+        'commands': commands,
+        'callbacks': callbacks,
+    }
@@ -0,0 +1,317 @@
+"""Metrics about the bot, served for Prometheus over HTTP.
+
+Metrics are always collected, since that's cheap. Serving them is optional,
+see listen(). Only what Cardinal needs of the Prometheus text format is
+implemented here, so there's no extra dependency.
+"""
+import logging
+import math
+from bisect import bisect_left
+
+from twisted.internet import reactor
+from twisted.web.resource import Resource
+from twisted.web.server import Site
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1.0, 2.5, 5.0, 10.0)
+"""Upper bounds of histogram buckets, in seconds"""
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n') \
+        .replace('"', r'\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+
+    return '{%s}' % ','.join('%s="%s"' % (name, _escape(value))
+                             for name, value in pairs)
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value))
+
+
+class Metric:
+    """Base class of metrics, which have a name, help and labels."""
+
+    type = None
+
+    def __init__(self, name, documentation, labels=()):
+        """Creates a new metric.
+
+        Keyword arguments:
+          name -- Name of the metric.
+          documentation -- What the metric measures.
+          labels -- Names of the metric's labels.
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+
+        # Maps tuples of label values to the values for them
+        self.values = {}
+
+    def _key(self, labels):
+        if len(labels) != len(self.labels):
+            raise ValueError("Metric %s takes labels %s, got %r" %
+                             (self.name, self.labels, labels))
+        return tuple(str(label) for label in labels)
+
+    def samples(self):
+        """Returns the metric's samples.
+
+        Returns:
+          list -- Tuples of sample name, label names, label values and value.
+        """
+        return [(self.name, self.labels, key, value)
+                for key, value in sorted(self.values.items())]
+
+    def render(self):
+        lines = [
+            '# HELP %s %s' % (self.name, self.documentation),
+            '# TYPE %s %s' % (self.name, self.type),
+        ]
+        for name, label_names, label_values, value in self.samples():
+            lines.append('%s%s %s' % (
+                name,
+                _format_labels(label_names, label_values),
+                _format_value(value),
+            ))
+
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    """A count that only goes up."""
+
+    type = 'counter'
+
+    def inc(self, *labels, amount=1):
+        """Increments the count for some label values.
+
+        Keyword arguments:
+          labels -- Values of the metric's labels, in order.
+          amount -- How much to increment by.
+        """
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, *labels):
+        return self.values.get(self._key(labels), 0)
+
+
+class Gauge(Metric):
+    """A value that's read when the metrics are collected."""
+
+    type = 'gauge'
+
+    def __init__(self, name, documentation, labels=()):
+        super().__init__(name, documentation, labels)
+        self._function = None
+
+    def set(self, value, *labels):
+        self.values[self._key(labels)] = value
+
+    def set_function(self, function):
+        """Reads the (unlabelled) gauge's value from a function.
+
+        Keyword arguments:
+          function -- Callable returning the value.
+        """
+        self._function = function
+
+    def get(self, *labels):
+        if self._function is not None:
+            return self._function()
+        return self.values.get(self._key(labels), 0)
+
+    def samples(self):
+        if self._function is None:
+            return super().samples()
+
+        try:
+            value = self._function()
+        except Exception:
+            logger.exception("Couldn't read gauge %s" % self.name)
+            return []
+
+        return [(self.name, (), (), value)]
+
+
+class Histogram(Metric):
+    """Counts observed durations into buckets."""
+
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labels=(),
+                 buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets) + (math.inf,)
+
+    def observe(self, value, *labels):
+        """Records an observation for some label values.
+
+        Keyword arguments:
+          value -- The observed value, e.g. seconds.
+          labels -- Values of the metric's labels, in order.
+        """
+        key = self._key(labels)
+        if key not in self.values:
+            self.values[key] = {
+                'buckets': [0] * len(self.buckets),
+                'sum': 0.0,
+                'count': 0,
+            }
+        data = self.values[key]
+
+        data['buckets'][bisect_left(self.buckets, value)] += 1
+        data['sum'] += value
+        data['count'] += 1
+
+    def get(self, *labels):
+        return self.values.get(self._key(labels))
+
+    def samples(self):
+        samples = []
+        for key, data in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, data['buckets']):
+                cumulative += count
+                samples.append((
+                    self.name + '_bucket',
+                    self.labels + ('le',),
+                    key + (_format_value(bound),),
+                    cumulative,
+                ))
+            samples.append((self.name + '_sum', self.labels, key,
+                            data['sum']))
+            samples.append((self.name + '_count', self.labels, key,
+                            data['count']))
+
+        return samples
+
+
+class Registry:
+    """A collection of metrics, rendered together."""
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, *args, **kwargs):
+        return self.register(Counter(*args, **kwargs))
+
+    def gauge(self, *args, **kwargs):
+        return self.register(Gauge(*args, **kwargs))
+
+    def histogram(self, *args, **kwargs):
+        return self.register(Histogram(*args, **kwargs))
+
+    def render(self):
+        """Renders every metric in the Prometheus text format.
+
+        Returns:
+          str -- The metrics.
+        """
+        return ''.join(metric.render() + '\n' for metric in self.metrics)
+
+
+REGISTRY = Registry()
+
+LINES_RECEIVED = REGISTRY.counter(
+    'cardinal_lines_received_total',
+    "Lines received from the IRC server, by network and command.",
+    ['network', 'command'])
+LINES_SENT = REGISTRY.counter(
+    'cardinal_lines_sent_total',
+    "Lines sent to the IRC server, by network and command.",
+    ['network', 'command'])
+OUTBOUND_QUEUE = REGISTRY.gauge(
+    'cardinal_outbound_queue_lines',
+    "Lines waiting to be sent to the IRC server.")
+EVENTS_FIRED = REGISTRY.counter(
+    'cardinal_events_fired_total',
+    "Events fired, by event.",
+    ['event'])
+EVENT_SECONDS = REGISTRY.histogram(
+    'cardinal_event_seconds',
+    "Seconds until every callback of an event finished, by event.",
+    ['event'])
+COMMAND_SECONDS = REGISTRY.histogram(
+    'cardinal_command_seconds',
+    "Seconds until a command finished, by plugin and command.",
+    ['plugin', 'command'])
+RECONNECTS = REGISTRY.counter(
+    'cardinal_reconnects_total',
+    "Reconnection attempts, by network and why the last connection ended.",
+    ['network', 'reason'])
+DB_SECONDS = REGISTRY.histogram(
+    'cardinal_db_seconds',
+    "Seconds spent loading and saving plugin databases.",
+    ['operation'])
+SERVER_RTT = REGISTRY.histogram(
+    'cardinal_server_rtt_seconds',
+    "Seconds until the IRC server answered a PING, by network.",
+    ['network'])
+PING_TIMEOUTS = REGISTRY.counter(
+    'cardinal_ping_timeouts_total',
+    "Times the connection was dropped after PINGs went unanswered, by "
+    "network.",
+    ['network'])
+REACTOR_LAG = REGISTRY.histogram(
+    'cardinal_reactor_lag_seconds',
+    "Seconds the reactor was late running a frequent timer.")
+REACTOR_STALLS = REGISTRY.counter(
+    'cardinal_reactor_stalls_total',
+    "Times the reactor was blocked for longer than the lag threshold.")
+LEADER = REGISTRY.gauge(
+    'cardinal_leader',
+    "Whether this replica is the elected leader.")
+
+
+class MetricsResource(Resource):
+    """Serves a registry's metrics."""
+
+    isLeaf = True
+
+    def __init__(self, registry=REGISTRY):
+        super().__init__()
+        self.registry = registry
+
+    def render_GET(self, request):
+        request.setHeader(b'Content-Type',
+                          b'text/plain; version=0.0.4; charset=utf-8')
+        return self.registry.render().encode('utf-8')
+
+
+def listen(port, interface='', registry=REGISTRY, resources=None,
+           _reactor=reactor):
+    """Serves metrics over HTTP at /metrics.
+
+    Keyword arguments:
+      port -- Port to listen on.
+      interface -- Address to listen on, all of them by default.
+      registry -- The registry to serve.
+      resources -- A dict mapping other paths (as bytes, without slashes) to
+        resources to serve alongside the metrics.
+
+    Returns:
+      IListeningPort -- The port listened on.
+    """
+    root = Resource()
+    root.putChild(b'metrics', MetricsResource(registry))
+    for path, resource in (resources or {}).items():
+        root.putChild(path, resource)
+
+    logger.info("Serving metrics on port %d" % port)
+    return _reactor.listenTCP(port, Site(root), interface=interface)
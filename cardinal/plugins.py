@@ -1,12 +1,17 @@
+import ast
 import os
 import re
+import sys
 import string
 import logging
 import importlib
+import importlib.util
 import inspect
 import linecache
 import random
 import json
+import time
+import weakref
 from collections import defaultdict
 from copy import copy
 from imp import reload
@@ -20,8 +25,14 @@ from cardinal.exceptions import (
     EventRejectedMessage,
     PluginError,
 )
+from cardinal.decorators import get_manifest
+from cardinal.manifest import read_manifest
+from cardinal import metrics
+from cardinal.limits import CallLimits
+from cardinal.pool import BlockingPool
+from cardinal.profiling import Profiler
 
-from twisted.internet import defer
+from twisted.internet import defer, threads
 
 
 class PluginManager:
@@ -41,6 +52,13 @@ class PluginManager:
                  cardinal,
                  plugins,
                  blacklist,
+                 lazy=False,
+                 isolated=None,
+                 blocking_threads=10,
+                 blocking_limit=2,
+                 timeout=None,
+                 max_in_flight=None,
+                 timeouts=None,
                  _plugin_module_import_prefix='plugins',
                  _plugin_module_directory=None):
         """Creates a new instance, optionally with a list of plugins to load
@@ -48,6 +66,18 @@ class PluginManager:
         Keyword arguments:
           cardinal -- An instance of `CardinalBot` to pass to plugins.
           plugins -- A list of plugins to be loaded when instanced.
+          blacklist -- A dict mapping plugins to lists of blacklisted channels.
+          lazy -- Whether to import plugins the first time they're used.
+          isolated -- A list of plugins to run in worker processes.
+          blocking_threads -- Size of the thread pool blocking commands are
+            run in.
+          blocking_limit -- How many blocking commands of each plugin can run
+            at once.
+          timeout -- Seconds a command or callback may take before it's
+            cancelled, or None for no timeout.
+          max_in_flight -- How many unfinished commands and callbacks each
+            plugin may have, or None for no limit.
+          timeouts -- A dict mapping plugin names to their own timeouts.
 
         Raises:
           TypeError -- When the `plugins` argument is not a list.
@@ -56,6 +86,15 @@ class PluginManager:
         self.logger = logging.getLogger(__name__)
         self.cardinal = cardinal
         self._blacklist = blacklist
+        self.lazy = lazy
+        self.isolated = isolated or []
+        self.blocking_pool = BlockingPool(max_threads=blocking_threads,
+                                          per_plugin=blocking_limit)
+        self.profiler = Profiler()
+        self.limits = CallLimits(timeout=timeout,
+                                 max_in_flight=max_in_flight,
+                                 timeouts=timeouts,
+                                 profiler=self.profiler)
 
         # Module name from which plugins are imported. This exists to assist
         # in unit testing.
@@ -75,6 +114,9 @@ class PluginManager:
         self.plugins = {}
         self._module_cache = {}
 
+        # Maps plugin names to Deferreds firing with their module and config
+        self._preloaded = {}
+
         self.load(plugins)
 
     def __iter__(self):
@@ -121,14 +163,26 @@ class PluginManager:
         Returns:
           The module that was loaded.
         """
-        # Sort of a hack... this helps with debugging, as uncaught exceptions
-        # can show the wrong data (line numbers / relevant code) if linecache
-        # doesn't get cleared when a module is reloaded. This is Python's
-        # internal cache of code files and line numbers.
-        linecache.clearcache()
-
         if plugin in self._module_cache:
-            module = reload(self._module_cache[plugin])
+            module = self._module_cache[plugin]
+
+            # This helps with debugging, as uncaught exceptions can show the
+            # wrong data (line numbers / relevant code) if linecache isn't
+            # updated when a module is reloaded. This is Python's internal
+            # cache of code files and line numbers. Only the plugin's own
+            # files are checked, the rest of the cache is left alone.
+            plugin_directory = os.path.dirname(module.__file__) + os.sep
+            for filename in list(linecache.cache.keys()):
+                if filename.startswith(plugin_directory):
+                    linecache.checkcache(filename)
+
+            # Reload the helper modules the plugin imports from its package
+            # first, so changes to them are picked up as well. Others, like
+            # the plugin's tests, are left alone.
+            for helper in _helper_modules(module):
+                reload(helper)
+
+            module = reload(module)
         else:
             module = importlib.import_module(
                 '%s.%s.%s' %
@@ -196,7 +250,7 @@ class PluginManager:
 
         return entrypoint(**kwargs)
 
-    def _register_plugin_callbacks(self, callbacks):
+    def _register_plugin_callbacks(self, callbacks, plugin=None):
         """Registers callbacks found in a plugin
 
         Registers all event callbacks provided by _get_plugin_callbacks with
@@ -207,6 +261,7 @@ class PluginManager:
 
         Keyword arguments:
             callbacks - List of callbacks to register.
+            plugin - Name of the plugin, whose limits the callbacks get.
 
         Returns:
             dict -- Maps event names to a list of EventManager callback IDs.
@@ -228,7 +283,7 @@ class PluginManager:
                     # Get callback ID from register_callback method
                     try:
                         id_ = self.cardinal.event_manager.register_callback(
-                            event_name, callback['method'])
+                            event_name, callback['method'], plugin)
                     except Exception:
                         self.logger.exception(
                             "Error registering callback for event: {}"
@@ -344,6 +399,20 @@ class PluginManager:
         # Return config
         return config
 
+    def _get_plugin_methods(self, instance, names, attrs):
+        """Returns a plugin's methods with given names, sorted by name.
+
+        Callables assigned to the instance itself which have one of the
+        decorator attributes are included as well.
+        """
+        methods = {name: getattr(instance, name) for name in names}
+        for name, value in getattr(instance, '__dict__', {}).items():
+            if callable(value) and \
+                    any(hasattr(value, attr) for attr in attrs):
+                methods[name] = value
+
+        return [methods[name] for name in sorted(methods)]
+
     def _get_plugin_commands(self, instance):
         """Find the commands in a plugin and return them as callables.
 
@@ -354,21 +423,12 @@ class PluginManager:
           list -- A list of callable commands.
 
         """
-        commands = []
-
-        # Loop through each method on the instance, checking whether it's a
-        # method meant to be interpreted as a command or not.
-        for method in dir(instance):
-            method = getattr(instance, method)
-
-            if callable(method) and (hasattr(method, 'regex') or
-                                     hasattr(method, 'commands')):
-                # Since this method has either the 'regex' or the 'commands'
-                # attribute assigned, it's registered as a command for
-                # Cardinal.
-                commands.append(method)
-
-        return commands
+        # Methods with either the 'regex' or the 'commands' attribute assigned
+        # are registered as commands for Cardinal. Which ones those are is
+        # looked up once per plugin class.
+        commands, _ = get_manifest(type(instance))
+        return self._get_plugin_methods(instance, commands,
+                                        ('regex', 'commands'))
 
     def _get_plugin_callbacks(self, instance):
         """Finds the event callbacks in a plugin and returns them as a list.
@@ -380,19 +440,42 @@ class PluginManager:
             list -- A list of dictionaries holding event names and callable
                     methods.
         """
-        callbacks = []
-        for method in dir(instance):
-            method = getattr(instance, method)
+        # Methods with the 'events' attribute assigned are registered as event
+        # callbacks for Cardinal
+        _, callbacks = get_manifest(type(instance))
+        return [{
+            'event_names': method.events,
+            'method': method,
+        } for method in self._get_plugin_methods(instance, callbacks,
+                                                 ('events',))]
+
+    def check_health(self):
+        """Asks loaded plugins whether they're working.
+
+        Plugins may define a health_check() method taking no arguments, which
+        returns a description of what's wrong, or None if nothing is. It's
+        called from health probes on the reactor thread, so it must be quick.
 
-            if callable(method) and (hasattr(method, 'events')):
-                # Since this method has the 'events' attribute assigned,
-                # it is registered as a event for Cardinal
-                callbacks.append({
-                    'event_names': method.events,
-                    'method': method
-                })
+        Returns:
+          list -- Descriptions of problems, prefixed by the plugin's name.
+        """
+        problems = []
+        for name, plugin in list(self.plugins.items()):
+            health_check = getattr(plugin['instance'], 'health_check', None)
+            if not inspect.ismethod(health_check):
+                continue
+
+            try:
+                problem = health_check()
+            except Exception:
+                self.logger.exception(
+                    "Health check of plugin %s failed" % name)
+                problem = "health check failed"
+
+            if problem:
+                problems.append("%s: %s" % (name, problem))
 
-        return callbacks
+        return problems
 
     def itercommands(self, channel=None):
         """Simple generator to iterate through all commands of loaded plugins.
@@ -400,6 +483,15 @@ class PluginManager:
         Returns:
           iterator -- Iterator for looping through commands
         """
+        for _, command in self._itercommands(channel):
+            yield command
+
+    def _itercommands(self, channel=None):
+        """Like itercommands(), but yields the plugin's name with each command.
+
+        Returns:
+          iterator -- Iterator of plugin name and command tuples
+        """
         # Loop through each plugin we have loaded
         for name, plugin in list(self.plugins.items()):
             if channel is not None and channel in plugin['blacklist']:
@@ -409,7 +501,116 @@ class PluginManager:
             # class methods with attributes assigned to them, so they are all
             # callable) and yield the command
             for command in plugin['commands']:
-                yield command
+                yield name, command
+
+    def _prepare_plugin(self, plugin):
+        """Imports a plugin's module and reads its config.
+
+        This does no work on the plugin's instance or CardinalBot, so it's safe
+        to run in a thread.
+
+        Keyword arguments:
+          plugin -- Name of the plugin to prepare.
+
+        Returns:
+          tuple -- The plugin's module and its config (or None).
+
+        Raises:
+          Exception -- Whatever importing the plugin's module raised.
+        """
+        module = self._import_module(plugin)
+
+        # Attempt to load the config file for the given plugin.
+        config = None
+        try:
+            config = self._load_plugin_config(plugin)
+        except ConfigNotFoundError:
+            self.logger.debug(
+                "No config found for plugin: %s" % plugin
+            )
+
+        return module, config
+
+    def _activate_plugin(self, plugin, module, config):
+        """Instantiates a prepared plugin and registers its callbacks.
+
+        Keyword arguments:
+          plugin -- Name of the plugin to activate.
+          module -- The plugin's module, as returned by _prepare_plugin().
+          config -- The plugin's config, as returned by _prepare_plugin().
+
+        Returns:
+          bool -- Whether the plugin was activated.
+        """
+        # Instanstiate the plugin
+        try:
+            instance = self._instantiate_plugin(module, config)
+        except Exception:
+            self.logger.exception(
+                "Could not instantiate plugin: %s" % plugin
+            )
+            return False
+
+        commands = self._get_plugin_commands(instance)
+        callbacks = self._get_plugin_callbacks(instance)
+
+        try:
+            # do this last to ensure the rollback functionality works
+            # correctly to remove callbacks if loading fails
+            callback_ids = self._register_plugin_callbacks(callbacks, plugin)
+        except Exception:
+            self.logger.exception(
+                "Could not register events for plugin: %s" % plugin
+            )
+            return False
+
+        self.plugins[plugin] = {
+            'name': plugin,
+            'instance': instance,
+            'commands': commands,
+            'callbacks': callbacks,
+            'callback_ids': callback_ids,
+            'config': config,
+            'blacklist': (
+                copy(self._blacklist[plugin])
+                if plugin in self._blacklist else
+                []
+            ),
+        }
+
+        self.logger.info("Plugin %s successfully loaded" % plugin)
+        return True
+
+    def _start_loading(self, plugins):
+        """Validates a list of plugins to load, unloading loaded ones first.
+
+        Keyword arguments:
+          plugins -- This can be either a single or list of plugin names.
+
+        Returns:
+          list -- A list of plugin names.
+
+        Raises:
+          TypeError -- When the `plugins` argument is not a string or list.
+        """
+        if isinstance(plugins, str):
+            plugins = [plugins]
+        if not isinstance(plugins, list):
+            raise TypeError(
+                "Plugins argument must be a string or list of plugins"
+            )
+
+        for plugin in plugins:
+            # Reload flag so we can update the reload counter if necessary
+            self.logger.info("Attempting to load plugin: %s" % plugin)
+
+            if plugin in list(self.plugins.keys()):
+                self.logger.info("Already loaded, unloading first: %s" %
+                                 plugin)
+
+                self.unload(plugin)
+
+        return plugins
 
     def load(self, plugins):
         """Takes either a plugin name or a list of plugins and loads them.
@@ -428,32 +629,21 @@ class PluginManager:
           TypeError -- When the `plugins` argument is not a string or list.
 
         """
-        global _module_cache
-
-        if isinstance(plugins, str):
-            plugins = [plugins]
-        if not isinstance(plugins, list):
-            raise TypeError(
-                "Plugins argument must be a string or list of plugins"
-            )
+        plugins = self._start_loading(plugins)
 
         # List of plugins which failed to load
         failed_plugins = []
 
         for plugin in plugins:
-            # Reload flag so we can update the reload counter if necessary
-            self.logger.info("Attempting to load plugin: %s" % plugin)
+            if plugin in self.isolated and self._load_in_worker(plugin):
+                continue
+            if self.lazy and self._load_lazily(plugin):
+                continue
 
             # Import each plugin's module with our own hacky function to reload
             # modules that have already been imported previously
             try:
-                if plugin in list(self.plugins.keys()):
-                    self.logger.info("Already loaded, unloading first: %s" %
-                                     plugin)
-
-                    self.unload(plugin)
-
-                module = self._import_module(plugin)
+                module, config = self._prepare_plugin(plugin)
             except Exception:
                 # Probably a syntax error in the plugin, log the exception
                 self.logger.exception(
@@ -463,59 +653,303 @@ class PluginManager:
 
                 continue
 
-            # Attempt to load the config file for the given plugin.
-            config = None
-            try:
-                config = self._load_plugin_config(plugin)
-            except ConfigNotFoundError:
-                self.logger.debug(
-                    "No config found for plugin: %s" % plugin
-                )
-
-            # Instanstiate the plugin
-            try:
-                instance = self._instantiate_plugin(module, config)
-            except Exception:
-                self.logger.exception(
-                    "Could not instantiate plugin: %s" % plugin
-                )
+            if not self._activate_plugin(plugin, module, config):
                 failed_plugins.append(plugin)
 
-                continue
+        return failed_plugins
 
-            commands = self._get_plugin_commands(instance)
-            callbacks = self._get_plugin_callbacks(instance)
+    def load_async(self, plugins):
+        """Like load(), but imports plugins in parallel in the thread pool.
 
-            try:
-                # do this last to ensure the rollback functionality works
-                # correctly to remove callbacks if loading fails
-                callback_ids = self._register_plugin_callbacks(callbacks)
-            except Exception:
-                self.logger.exception(
-                    "Could not register events for plugin: %s" % plugin
-                )
+        Importing a plugin's module (and its dependencies) and reading its
+        config happens in the reactor's thread pool, for all plugins at once.
+        Plugins are still instantiated and have their callbacks registered on
+        the reactor thread, in the order given, as each one becomes ready.
 
-                failed_plugins.append(plugin)
+        Keyword arguments:
+          plugins -- This can be either a single or list of plugin names.
+
+        Returns:
+          Deferred -- Fires with a list of failed plugins, or an empty list.
+
+        Raises:
+          TypeError -- When the `plugins` argument is not a string or list.
+        """
+        plugins = self._start_loading(plugins)
+
+        prepared = []
+        for plugin in plugins:
+            if plugin in self.isolated and self._load_in_worker(plugin) or \
+                    self.lazy and self._load_lazily(plugin):
+                prepared.append(None)
+            elif plugin in self._preloaded:
+                prepared.append(self._preloaded.pop(plugin))
+            else:
+                prepared.append(
+                    threads.deferToThread(self._prepare_plugin, plugin))
+
+        @defer.inlineCallbacks
+        def activate():
+            failed_plugins = []
+
+            for plugin, d in zip(plugins, prepared):
+                # Loaded lazily or in a worker, so not imported here
+                if d is None:
+                    continue
+
+                try:
+                    module, config = yield d
+                except Exception:
+                    # Probably a syntax error in the plugin, log the exception
+                    self.logger.exception(
+                        "Could not load plugin module: %s" % plugin
+                    )
+                    failed_plugins.append(plugin)
+
+                    continue
+
+                if not self._activate_plugin(plugin, module, config):
+                    failed_plugins.append(plugin)
+
+            return failed_plugins
+
+        return activate()
+
+    def _load_from_manifest(self, plugin, stub, instance=None):
+        """Loads a plugin from its manifest, without importing it.
+
+        The plugin's commands and event callbacks are read from its source
+        (see `cardinal.manifest`) and stand-ins are registered for them.
+
+        Plugins without commands or callbacks (which must be running to be of
+        any use), or whose decorators can't be read statically, aren't loaded.
+
+        Keyword arguments:
+          plugin -- Name of the plugin to load.
+          stub -- Callable creating a stand-in for a method, given its entry
+            in the manifest.
+          instance -- What to keep as the plugin's instance.
+
+        Returns:
+          bool -- Whether the plugin was loaded.
+        """
+        manifest = read_manifest(os.path.join(
+            self.plugins_directory, plugin, 'plugin.py'))
+        if not manifest or \
+                not (manifest['commands'] or manifest['callbacks']):
+            return False
+
+        config = None
+        try:
+            config = self._load_plugin_config(plugin)
+        except ConfigNotFoundError:
+            self.logger.debug(
+                "No config found for plugin: %s" % plugin
+            )
+
+        commands = [stub(entry) for entry in manifest['commands']]
+        callbacks = [{
+            'event_names': entry['event_names'],
+            'method': stub(entry),
+        } for entry in manifest['callbacks']]
+
+        try:
+            callback_ids = self._register_plugin_callbacks(callbacks, plugin)
+        except Exception:
+            self.logger.exception(
+                "Could not register events for plugin: %s" % plugin
+            )
+            return False
+
+        self.plugins[plugin] = {
+            'name': plugin,
+            'instance': instance,
+            'commands': commands,
+            'callbacks': callbacks,
+            'callback_ids': callback_ids,
+            'config': config,
+            'blacklist': (
+                copy(self._blacklist[plugin])
+                if plugin in self._blacklist else
+                []
+            ),
+        }
+
+        return True
+
+    def _stub_method(self, method, entry):
+        """Gives a stand-in the name and decorator attributes of a method.
+
+        Keyword arguments:
+          method -- The stand-in.
+          entry -- The method's entry in the plugin's manifest.
+
+        Returns:
+          callable -- The stand-in.
+        """
+        method.__name__ = entry['method']
+        for attr, key in (('commands', 'commands'),
+                          ('regex', 'regex'),
+                          ('help', 'help'),
+                          ('events', 'event_names')):
+            if key in entry:
+                setattr(method, attr, entry[key])
+
+        return method
+
+    def _load_lazily(self, plugin):
+        """Loads a plugin without importing it, if possible.
+
+        Stand-ins are registered for the plugin's commands and callbacks (see
+        _load_from_manifest()). The first time one of them is called, the
+        plugin is imported and instantiated and the call is passed on to it.
+
+        Keyword arguments:
+          plugin -- Name of the plugin to load.
+
+        Returns:
+          bool -- Whether the plugin was loaded lazily.
+        """
+        def stub(entry):
+            return self._lazy_method(plugin, entry)
+
+        if not self._load_from_manifest(plugin, stub):
+            return False
+        self.plugins[plugin]['lazy'] = True
+
+        self.logger.info("Plugin %s loaded lazily" % plugin)
+        return True
+
+    def _lazy_method(self, plugin, entry):
+        """Creates a stand-in for a method of a lazily loaded plugin.
+
+        Keyword arguments:
+          plugin -- Name of the plugin.
+          entry -- The method's entry in the plugin's manifest.
+
+        Returns:
+          callable -- Activates the plugin and calls the method. Blocking
+            commands are marked as such, and have an `activate()` method
+            returning the real method, for _call_command() to run in the
+            thread pool.
+        """
+        def activate():
+            instance = self._activate_lazy_plugin(plugin)
+            return getattr(instance, entry['method'])
+
+        def method(cardinal, *args):
+            return activate()(cardinal, *args)
+
+        if entry.get('blocking'):
+            method.blocking = True
+            method.activate = activate
+
+        return self._stub_method(method, entry)
+
+    def _load_in_worker(self, plugin):
+        """Loads a plugin in a worker process, if possible.
+
+        Stand-ins are registered for the plugin's commands and callbacks (see
+        _load_from_manifest()) which forward calls to the worker. The
+        `PluginWorker` is kept as the plugin's instance.
+
+        Keyword arguments:
+          plugin -- Name of the plugin to load.
+
+        Returns:
+          bool -- Whether the plugin was loaded in a worker.
+        """
+        # Imported here since cardinal.worker imports this module
+        from cardinal.worker import PluginWorker
+
+        worker = PluginWorker(self, plugin)
+
+        def stub(entry):
+            def method(cardinal, *args):
+                return worker.call(entry['method'], *args)
+
+            return self._stub_method(method, entry)
+
+        if not self._load_from_manifest(plugin, stub, worker):
+            self.logger.warning(
+                "Couldn't read commands and callbacks of plugin %s, "
+                "loading it in-process instead" % plugin
+            )
+            return False
+        self.plugins[plugin]['isolated'] = True
+
+        worker.start()
+
+        self.logger.info("Plugin %s loaded in a worker" % plugin)
+        return True
+
+    def _activate_lazy_plugin(self, plugin):
+        """Imports and instantiates a lazily loaded plugin, if it isn't yet.
+
+        Keyword arguments:
+          plugin -- Name of the plugin to activate.
+
+        Returns:
+          object -- The instance of the plugin.
+
+        Raises:
+          PluginError -- When the plugin was unloaded or failed to load.
+        """
+        if plugin not in self.plugins:
+            raise PluginError("Plugin is not loaded: %s" % plugin)
+        if not self.plugins[plugin].get('lazy'):
+            return self.plugins[plugin]['instance']
 
+        self.logger.info("Activating lazily loaded plugin: %s" % plugin)
+
+        # Channels may have been blacklisted since the plugin was loaded
+        blacklist = self.plugins[plugin]['blacklist']
+        self.unload(plugin)
+
+        try:
+            module, config = self._prepare_plugin(plugin)
+        except Exception:
+            self.logger.exception(
+                "Could not load plugin module: %s" % plugin
+            )
+            raise PluginError("Could not load plugin module: %s" % plugin)
+
+        if not self._activate_plugin(plugin, module, config):
+            raise PluginError("Could not activate plugin: %s" % plugin)
+        self.plugins[plugin]['blacklist'] = blacklist
+
+        return self.plugins[plugin]['instance']
+
+    def preload(self, plugins):
+        """Starts importing plugins and reading their configs in threads.
+
+        This doesn't need an instance of CardinalBot, so it can happen before
+        we've connected. A later load_async() of the same plugins activates
+        the preloaded modules rather than importing them again.
+
+        Keyword arguments:
+          plugins -- A list of plugin names.
+        """
+        for plugin in plugins:
+            # Plugins run in workers are imported there
+            if plugin in self._preloaded or plugin in self.isolated:
                 continue
 
-            self.plugins[plugin] = {
-                'name': plugin,
-                'instance': instance,
-                'commands': commands,
-                'callbacks': callbacks,
-                'callback_ids': callback_ids,
-                'config': config,
-                'blacklist': (
-                    copy(self._blacklist[plugin])
-                    if plugin in self._blacklist else
-                    []
-                ),
-            }
-
-            self.logger.info("Plugin %s successfully loaded" % plugin)
+            self.logger.info("Preloading plugin: %s" % plugin)
+            self._preloaded[plugin] = threads.deferToThread(
+                self._prepare_plugin, plugin)
 
-        return failed_plugins
+    def rebind(self, cardinal):
+        """Hands loaded plugins to a new instance of CardinalBot.
+
+        Called after reconnecting, so plugins don't have to be loaded again.
+        Their callbacks stay registered, since the factory keeps the same
+        EventManager for every connection.
+
+        Keyword arguments:
+          cardinal -- The new instance of `CardinalBot`.
+        """
+        self.cardinal = cardinal
 
     def unload(self, plugins):
         """Takes either a plugin name or a list of plugins and unloads them.
@@ -689,12 +1123,13 @@ class PluginManager:
         command_match = re.match(self.COMMAND_REGEX, message)
 
         dl = []
-        for command in self.itercommands(channel):
+        for plugin, command in self._itercommands(channel):
             # Check whether the current command has a regex to match by, and if
             # it does, and the message given to us matches the regex, then call
             # the command.
             if hasattr(command, 'regex') and re.search(command.regex, message):
-                dl.append(self._call_command(command, user, channel, message))
+                dl.append(self._call_command(command, user, channel, message,
+                                             plugin))
                 called_command = True
                 continue
 
@@ -705,7 +1140,8 @@ class PluginManager:
             # the message.
             if (hasattr(command, 'commands') and
                     command_match.group(1) in command.commands):
-                dl.append(self._call_command(command, user, channel, message))
+                dl.append(self._call_command(command, user, channel, message,
+                                             plugin))
                 called_command = True
                 continue
 
@@ -724,19 +1160,45 @@ class PluginManager:
             message
         )
 
-    def _call_command(self, command, user, channel, message):
+    def _call_command(self, command, user, channel, message, plugin=None):
         """Calls a command method and treats it as a Deferred.
 
+        Commands marked as blocking are run in the thread pool. Either way,
+        the call is limited by its plugin's timeout and in-flight limit.
+
         Keyword arguments:
           command -- A callable for the command that may return a Deferred.
           user -- A tuple containing a user's nick, ident, and hostname.
           channel -- A string representing where replies should be sent.
           message -- A string containing a message received by CardinalBot.
+          plugin -- Name of the plugin the command belongs to.
         """
         args = (self.cardinal, user, channel, message)
 
-        d = defer.maybeDeferred(
-            command, *args)
+        # Before the call, since commands that don't return a Deferred have
+        # finished by the time it returns
+        started = time.monotonic()
+
+        if getattr(command, 'blocking', False):
+            def run(*args):
+                # Lazily loaded plugins are activated on the reactor thread,
+                # only the command itself runs in the pool
+                f = command.activate() if hasattr(command, 'activate') \
+                    else command
+                return self.blocking_pool.run(plugin, f, *args)
+
+            # Threads can't be cancelled, so a timed out command keeps its
+            # plugin's slots until it returns
+            d = self.limits.call(plugin, run, *args,
+                                 name=command.__name__, cancel=False)
+        else:
+            d = self.limits.call(plugin, command, *args)
+
+        def observe(result):
+            metrics.COMMAND_SECONDS.observe(time.monotonic() - started,
+                                            plugin, command.__name__)
+            return result
+        d.addBoth(observe)
 
         def errback(failure):
             self.logger.error('Unhandled error: {}'.format(failure))
@@ -746,15 +1208,165 @@ class PluginManager:
         return d
 
 
+def _package_imports(module):
+    """Reads which modules of its own package a module imports.
+
+    The module's source is read rather than its namespace, so helpers it
+    only imports names from (e.g. `from .helpers import VALUE`) are found.
+
+    Keyword arguments:
+      module -- The module.
+
+    Returns:
+      list -- Names of the modules, which may not all exist.
+    """
+    package = module.__name__.rsplit('.', 1)[0]
+    try:
+        with open(module.__file__, 'r') as f:
+            tree = ast.parse(f.read(), module.__file__)
+    except (OSError, SyntaxError, TypeError, ValueError):
+        return []
+
+    names = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names += [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom):
+            try:
+                base = importlib.util.resolve_name(
+                    '.' * node.level + (node.module or ''), package)
+            except (ImportError, ValueError):
+                continue
+            # Either names from a module, or modules from a package
+            names.append(base)
+            names += [base + '.' + alias.name for alias in node.names]
+
+    return [name for name in names if name.startswith(package + '.')]
+
+
+def _helper_modules(module):
+    """Finds the helper modules a plugin's module imports from its package.
+
+    Keyword arguments:
+      module -- The plugin's module.
+
+    Returns:
+      list -- The already imported helper modules, including those they
+        import in turn, with each after the helpers it imports.
+    """
+    helpers = []
+    visited = {module.__name__}
+
+    def visit(module):
+        for name in _package_imports(module):
+            helper = sys.modules.get(name)
+            if name in visited or helper is None:
+                continue
+            visited.add(name)
+
+            visit(helper)
+            helpers.append(helper)
+
+    visit(module)
+    return helpers
+
+
+# Maps functions to the arity _callback_arity() worked out for them
+_arity_cache = weakref.WeakKeyDictionary()
+
+
+def _callback_arity(callback):
+    """Works out how many positional arguments a callback takes.
+
+    Results are cached per function, so reloading a plugin (or registering
+    the same method with several events) doesn't inspect it again.
+
+    Keyword arguments:
+      callback -- The callback to inspect.
+
+    Returns:
+      tuple -- The number of positional arguments, how many of those are
+        required, and whether extra positional arguments are accepted.
+
+    Raises:
+      EventCallbackError -- If the callback isn't callable or requires
+        keyword arguments.
+    """
+    # Bound methods share their function's signature, minus self
+    func = getattr(callback, '__func__', callback)
+    bound = 1 if inspect.ismethod(callback) else 0
+
+    try:
+        arity = _arity_cache[func]
+    except (KeyError, TypeError):
+        try:
+            parameters = inspect.signature(func).parameters
+        except TypeError:
+            raise EventCallbackError(
+                "Can't register callback that isn't callable"
+            )
+
+        num_func_args = 0
+        num_required_args = 0
+        accepts_vargs = False
+        for param in parameters.values():
+            if param.kind in (param.POSITIONAL_ONLY,
+                              param.POSITIONAL_OR_KEYWORD):
+                num_func_args += 1
+                if param.default == param.empty:
+                    num_required_args += 1
+            # As long as num_func_args doesn't exceed the number of arguments
+            # required, this ensures that the signature works
+            elif param.kind == param.VAR_POSITIONAL:
+                accepts_vargs = True
+            # We will never pass keyword arguments, so if the param must be a
+            # keyword, and there's no default set, we can error early
+            elif param.kind == param.KEYWORD_ONLY \
+                    and param.default == param.empty:
+                raise EventCallbackError(
+                    "Callbacks must not take required keyword arguments"
+                )
+            # These are irrelevant - we'll never pass any but they are optional
+            elif param.kind == param.VAR_KEYWORD:
+                pass
+
+        arity = (num_func_args, num_required_args, accepts_vargs)
+        try:
+            _arity_cache[func] = arity
+        except TypeError:
+            # Can't be weakly referenced, so don't cache it
+            pass
+
+    num_func_args, num_required_args, accepts_vargs = arity
+    return (max(0, num_func_args - bound),
+            max(0, num_required_args - bound),
+            accepts_vargs)
+
+
 class EventManager:
-    def __init__(self, cardinal):
-        """Initializes the logger"""
+    def __init__(self, cardinal, limits=None):
+        """Initializes the logger
+
+        Keyword arguments:
+          cardinal -- The instance of CardinalBot.
+          limits -- The `CallLimits` plugins' callbacks are called within, if
+            any.
+        """
         self.cardinal = cardinal
         self.logger = logging.getLogger(__name__)
 
         self.registered_events = defaultdict(dict)
         self.registered_callbacks = defaultdict(dict)
 
+        # Maps event names to the plugins callbacks belong to, by callback ID
+        self.callback_plugins = defaultdict(dict)
+
+        # Limits the calls of plugins' callbacks, see CardinalBotFactory
+        self.limits = limits
+
+        # Name of the event whose callbacks are being called right now, if any
+        self.firing = None
+
     def register(self, name, required_params):
         """Registers a plugin's event so other events can set callbacks.
 
@@ -798,12 +1410,13 @@ class EventManager:
 
         self.logger.info("Removed event: %s" % name)
 
-    def register_callback(self, event_name, callback):
+    def register_callback(self, event_name, callback, plugin=None):
         """Registers a callback to be called when an event fires.
 
         Keyword arguments:
           event_name -- Event name to bind callback to.
           callback -- Callable to bind.
+          plugin -- Name of the plugin the callback belongs to, if any.
 
         Raises:
           EventCallbackError -- If an invalid callback is passed in.
@@ -812,36 +1425,8 @@ class EventManager:
             "Attempting to register callback for event: %s" % event_name
         )
 
-        try:
-            parameters = inspect.signature(callback).parameters
-        except TypeError:
-            raise EventCallbackError(
-                "Can't register callback that isn't callable"
-            )
-
-        num_func_args = 0
-        num_required_args = 0
-        accepts_vargs = False
-        for param in parameters.values():
-            if param.kind in (param.POSITIONAL_ONLY,
-                              param.POSITIONAL_OR_KEYWORD):
-                num_func_args += 1
-                if param.default == param.empty:
-                    num_required_args += 1
-            # As long as num_func_args doesn't exceed the number of arguments
-            # required, this ensures that the signature works
-            elif param.kind == param.VAR_POSITIONAL:
-                accepts_vargs = True
-            # We will never pass keyword arguments, so if the param must be a
-            # keyword, and there's no default set, we can error early
-            elif param.kind == param.KEYWORD_ONLY \
-                    and param.default == param.empty:
-                raise EventCallbackError(
-                    "Callbacks must not take required keyword arguments"
-                )
-            # These are irrelevant - we'll never pass any but they are optional
-            elif param.kind == param.VAR_KEYWORD:
-                pass
+        num_func_args, num_required_args, accepts_vargs = \
+            _callback_arity(callback)
 
         # If no event is registered, we will still register the callback but
         # we can't sanity check it since the event hasn't been registered yet
@@ -850,7 +1435,7 @@ class EventManager:
                 raise EventCallbackError(
                     "Callback must take at least one argument (cardinal)")
 
-            return self._add_callback(event_name, callback)
+            return self._add_callback(event_name, callback, plugin)
 
         # Add one to needed args to account for CardinalBot being passed in
         num_needed_args = self.registered_events[event_name] + 1
@@ -868,7 +1453,7 @@ class EventManager:
                 (num_needed_args, num_required_args)
             )
 
-        return self._add_callback(event_name, callback)
+        return self._add_callback(event_name, callback, plugin)
 
     def remove_callback(self, event_name, callback_id):
         """Removes a callback with a given ID from an event's callback list.
@@ -896,6 +1481,7 @@ class EventManager:
             return
 
         del self.registered_callbacks[event_name][callback_id]
+        self.callback_plugins[event_name].pop(callback_id, None)
 
         self.logger.info("Removed callback %s for event: %s",
                          callback_id, event_name)
@@ -927,10 +1513,23 @@ class EventManager:
             (len(callbacks), name)
         )
 
+        metrics.EVENTS_FIRED.inc(name)
+        started = time.monotonic()
+
+        # Copied, since a callback may load or unload plugins while we loop
         cb_deferreds = []
-        for callback_id, callback in callbacks.items():
-            d = defer.maybeDeferred(
-                callback, self.cardinal, *params)
+        for callback_id, callback in list(callbacks.items()):
+            plugin = self.callback_plugins[name].get(callback_id)
+            previous, self.firing = self.firing, name
+            try:
+                if self.limits is not None and plugin is not None:
+                    d = self.limits.call(plugin, callback, self.cardinal,
+                                         *params)
+                else:
+                    d = defer.maybeDeferred(
+                        callback, self.cardinal, *params)
+            finally:
+                self.firing = previous
 
             # It is necessary to pass callback_id in to this function in order
             # to make sure it doesn't change when the loop iterates
@@ -974,8 +1573,13 @@ class EventManager:
 
             cb_deferreds.append(d)
 
+        def observe(result):
+            metrics.EVENT_SECONDS.observe(time.monotonic() - started, name)
+            return result
+
         dl = defer.DeferredList(cb_deferreds)
         dl.addCallback(self._reduce_callback_accepted_statuses)
+        dl.addBoth(observe)
         return dl
 
     @staticmethod
@@ -993,12 +1597,13 @@ class EventManager:
 
         return False
 
-    def _add_callback(self, event_name, callback):
+    def _add_callback(self, event_name, callback, plugin=None):
         """Adds a callback to the event's callback list and returns an ID.
 
         Keyword arguments:
           event_name -- Event name to add the callback to.
           callback -- The callback to add.
+          plugin -- Name of the plugin the callback belongs to, if any.
 
         Returns:
           string -- A callback ID to reference the callback with for removal.
@@ -1009,6 +1614,8 @@ class EventManager:
             callback_id = self._generate_id()
 
         self.registered_callbacks[event_name][callback_id] = callback
+        if plugin is not None:
+            self.callback_plugins[event_name][callback_id] = plugin
         self.logger.info(
             "Registered callback %s for event: %s" %
             (callback_id, event_name)
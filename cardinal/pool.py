@@ -0,0 +1,165 @@
+import logging
+import time
+
+from twisted.internet import defer, reactor, threads
+from twisted.python.threadpool import ThreadPool
+
+
+class ReactorProxy:
+    """Calls methods of an object on the reactor thread.
+
+    Handed to blocking handlers in place of CardinalBot, since Twisted isn't
+    thread-safe. Each method call waits for its result, so handlers can use
+    CardinalBot as usual. Other attributes are read directly.
+    """
+
+    def __init__(self, target, reactor):
+        """Creates a new proxy.
+
+        Keyword arguments:
+          target -- The object to proxy, e.g. an instance of CardinalBot.
+          reactor -- The reactor whose thread to call methods on.
+        """
+        self._target = target
+        self._reactor = reactor
+
+    def __getattr__(self, name):
+        value = getattr(self._target, name)
+        if not callable(value):
+            return value
+
+        def call(*args, **kwargs):
+            return threads.blockingCallFromThread(
+                self._reactor, value, *args, **kwargs)
+
+        return call
+
+
+class BlockingPool:
+    """Runs blocking plugin handlers in a bounded thread pool.
+
+    Each plugin may only have a few handlers running at once, so one slow
+    plugin can't take up every thread. Calls beyond the limit wait in line.
+    How long calls waited before they ran is kept per plugin in `stats`.
+
+    Threads can't be stopped, so cancelling a running call only stops
+    waiting for it. It keeps its plugin's slot until the thread returns.
+    Calls cancelled while waiting in line never run.
+    """
+
+    SLOW_QUEUE_WARNING = 1.0
+    """Seconds a call may wait for a thread before a warning is logged"""
+
+    @property
+    def reactor(self):
+        return getattr(self, '_reactor', reactor)
+
+    def __init__(self, max_threads=10, per_plugin=2):
+        """Creates a new pool. Threads are only started once needed.
+
+        Keyword arguments:
+          max_threads -- Maximum number of threads.
+          per_plugin -- Maximum number of calls a plugin can have running.
+        """
+        self.logger = logging.getLogger(__name__)
+        self.max_threads = max_threads
+        self.per_plugin = per_plugin
+
+        # Maps plugin names to the DeferredSemaphore limiting their calls,
+        # and to their stats
+        self._semaphores = {}
+        self.stats = {}
+
+        self._pool = None
+
+    def _get_pool(self):
+        if self._pool is None:
+            self._pool = ThreadPool(minthreads=0,
+                                    maxthreads=self.max_threads,
+                                    name='cardinal-blocking')
+            self._pool.start()
+            self.reactor.addSystemEventTrigger('during', 'shutdown',
+                                               self.stop)
+
+        return self._pool
+
+    def stop(self):
+        """Stops the pool's threads, waiting for running calls to finish."""
+        if self._pool is not None:
+            self._pool.stop()
+            self._pool = None
+
+    def run(self, plugin, f, cardinal, *args):
+        """Calls a plugin's handler in the pool.
+
+        Keyword arguments:
+          plugin -- Name of the plugin the handler belongs to.
+          f -- The handler.
+          cardinal -- The instance of CardinalBot, which the handler gets
+            wrapped in a `ReactorProxy`.
+          args -- Further arguments for the handler.
+
+        Returns:
+          Deferred -- Fires with the handler's result.
+        """
+        semaphore = self._semaphores.get(plugin)
+        if semaphore is None:
+            semaphore = self._semaphores[plugin] = defer.DeferredSemaphore(
+                self.per_plugin)
+            self.stats[plugin] = {
+                'calls': 0,
+                'pending': 0,
+                'queue_time': 0.0,
+                'max_queue_time': 0.0,
+            }
+        stats = self.stats[plugin]
+        stats['calls'] += 1
+        stats['pending'] += 1
+
+        proxy = ReactorProxy(cardinal, self.reactor)
+        queued_at = time.monotonic()
+        timing = {}
+
+        def call():
+            timing['queue_time'] = time.monotonic() - queued_at
+            return f(proxy, *args)
+
+        def finished(result):
+            stats['pending'] -= 1
+
+            queue_time = timing.get('queue_time', 0.0)
+            stats['queue_time'] += queue_time
+            stats['max_queue_time'] = max(stats['max_queue_time'],
+                                          queue_time)
+            if queue_time >= self.SLOW_QUEUE_WARNING:
+                self.logger.warning(
+                    "Blocking call of plugin %s waited %.2f seconds to run" %
+                    (plugin, queue_time))
+
+            return result
+
+        def release(result):
+            semaphore.release()
+            return result
+
+        def run(_):
+            thread_d = threads.deferToThreadPool(self.reactor,
+                                                 self._get_pool(), call)
+            thread_d.addBoth(release)
+            thread_d.addBoth(finished)
+
+            # Cancelling this doesn't reach the thread's Deferred, so the
+            # slot is only released once the thread returns
+            d = defer.Deferred()
+            thread_d.chainDeferred(d)
+            return d
+
+        def dropped(failure):
+            # Cancelled while waiting in line, so it never ran
+            finished(None)
+            return failure
+
+        d = semaphore.acquire()
+        d.addCallbacks(run, dropped)
+
+        return d
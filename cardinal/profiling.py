@@ -0,0 +1,177 @@
+import json
+import time
+from collections import deque
+
+from twisted.internet import defer
+from twisted.python.failure import Failure
+
+from cardinal.exceptions import EventRejectedMessage
+
+
+def percentile(samples, fraction):
+    """Returns the nearest-rank percentile of some samples.
+
+    Keyword arguments:
+      samples -- An iterable of numbers.
+      fraction -- The percentile, between 0 and 1.
+
+    Returns:
+      float -- The percentile, or None if there are no samples.
+    """
+    samples = sorted(samples)
+    if not samples:
+        return None
+
+    return samples[min(len(samples) - 1, int(fraction * len(samples)))]
+
+
+class HandlerStats:
+    """Timings and counts of calls to one command or event callback."""
+
+    SAMPLES = 1000
+    """How many of the most recent wall times percentiles are taken from"""
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.blocking_time = 0.0
+        self.max_blocking_time = 0.0
+        self.samples = deque(maxlen=self.SAMPLES)
+
+    def record(self, wall_time, blocking_time, error):
+        """Records a finished call.
+
+        Keyword arguments:
+          wall_time -- Seconds from the call until its result.
+          blocking_time -- Seconds the call ran on the reactor thread before
+            returning (or returning a Deferred).
+          error -- Whether the call failed.
+        """
+        self.calls += 1
+        if error:
+            self.errors += 1
+        self.total_time += wall_time
+        self.blocking_time += blocking_time
+        self.max_blocking_time = max(self.max_blocking_time, blocking_time)
+        self.samples.append(wall_time)
+
+    def to_dict(self):
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'total_time': self.total_time,
+            'p50': percentile(self.samples, 0.5),
+            'p99': percentile(self.samples, 0.99),
+            'blocking_time': self.blocking_time,
+            'max_blocking_time': self.max_blocking_time,
+        }
+
+
+class Profiler:
+    """Records how long each plugin's commands and callbacks take.
+
+    Wall time runs from a call until its Deferred fires, so it includes
+    waiting on the network or a thread. Blocking time is only the part spent
+    on the reactor thread, during which nothing else can happen.
+    """
+
+    def __init__(self):
+        # Maps plugin names to dicts mapping handler names to HandlerStats
+        self.stats = {}
+
+        # Plugin and handler name of the call running on the reactor thread
+        # right now, if any
+        self.current = None
+
+    def call(self, plugin, name, f, *args):
+        """Calls a plugin's command or callback and records how it went.
+
+        Keyword arguments:
+          plugin -- Name of the plugin.
+          name -- Name of the command or callback.
+          f -- The callable, which may return a Deferred.
+          args -- Arguments to call it with.
+
+        Returns:
+          Deferred -- The call's result.
+        """
+        stats = self.stats.setdefault(plugin, {})
+        if name not in stats:
+            stats[name] = HandlerStats()
+        handler_stats = stats[name]
+
+        previous, self.current = self.current, (plugin, name)
+        started = time.perf_counter()
+        try:
+            d = defer.maybeDeferred(f, *args)
+        finally:
+            self.current = previous
+        blocking_time = time.perf_counter() - started
+
+        def finished(result):
+            # Rejecting an event isn't an error
+            error = isinstance(result, Failure) and \
+                not result.check(EventRejectedMessage)
+            handler_stats.record(time.perf_counter() - started,
+                                 blocking_time,
+                                 error)
+            return result
+        d.addBoth(finished)
+
+        return d
+
+    def dump(self, plugin=None):
+        """Returns the recorded stats as plain data.
+
+        Keyword arguments:
+          plugin -- Only return the stats of this plugin.
+
+        Returns:
+          dict -- Maps plugin names to dicts mapping handler names to their
+            stats. Times are in seconds.
+        """
+        return {
+            name: {handler: stats.to_dict()
+                   for handler, stats in handlers.items()}
+            for name, handlers in self.stats.items()
+            if plugin is None or name == plugin
+        }
+
+    def write(self, path):
+        """Writes the recorded stats to a file as JSON.
+
+        Keyword arguments:
+          path -- Path of the file.
+        """
+        with open(path, 'w') as f:
+            json.dump(self.dump(), f, indent=2, sort_keys=True)
+
+    def top(self, key='total_time', limit=5, plugin=None):
+        """Returns the handlers ranked highest by one of their stats.
+
+        Handlers without a finished call yet, like one still running its
+        first call, are left out.
+
+        Keyword arguments:
+          key -- Name of the stat to rank by.
+          limit -- How many handlers to return.
+          plugin -- Only rank handlers of this plugin.
+
+        Returns:
+          list -- Tuples of plugin name, handler name, and stats dict.
+        """
+        handlers = [
+            (name, handler, stats)
+            for name, handler_stats in self.dump(plugin).items()
+            for handler, stats in handler_stats.items()
+            if stats['calls']
+        ]
+        handlers.sort(key=lambda handler: handler[2][key] or 0,
+                      reverse=True)
+
+        return handlers[:limit]
+
+    def reset(self):
+        """Forgets all recorded stats."""
+        self.stats = {}
@@ -0,0 +1,204 @@
+import logging
+import math
+import time
+
+from twisted.internet import protocol, reactor
+
+
+class Server:
+    """An address of the IRC network, and how connecting to it went."""
+
+    SMOOTHING = 0.3
+    """Weight of the latest connect time in the remembered average"""
+
+    def __init__(self, host, port, priority=0):
+        """Creates a new server.
+
+        Keyword arguments:
+          host -- Hostname or address.
+          port -- Port.
+          priority -- Servers with lower priorities are tried first.
+        """
+        self.host = host
+        self.port = port
+        self.priority = priority
+
+        # Average seconds connecting took, and failures since it last worked
+        self.connect_time = None
+        self.failures = 0
+
+    def __repr__(self):
+        return "%s:%s" % (self.host, self.port)
+
+    def connected(self, seconds):
+        """Remembers that connecting worked, and how long it took.
+
+        Keyword arguments:
+          seconds -- How long connecting took.
+        """
+        self.failures = 0
+        if self.connect_time is None:
+            self.connect_time = seconds
+        else:
+            self.connect_time += self.SMOOTHING * (seconds -
+                                                   self.connect_time)
+
+    def failed(self):
+        """Remembers that connecting, or staying connected, failed."""
+        self.failures += 1
+
+    def sort_key(self):
+        # Working servers before failing ones of the same priority, then the
+        # fastest first. Ones we haven't tried go after those known to work.
+        return (self.priority,
+                self.failures,
+                math.inf if self.connect_time is None else self.connect_time)
+
+
+class ServerList:
+    """The servers of a network, ordered by how they should be tried."""
+
+    def __init__(self, servers):
+        """Creates a new list.
+
+        Keyword arguments:
+          servers -- A list of (host, port) or (host, port, priority) tuples,
+            in the order to try them in, all else being equal.
+        """
+        self.servers = [Server(*server) for server in servers]
+
+    def __iter__(self):
+        return iter(self.servers)
+
+    def __len__(self):
+        return len(self.servers)
+
+    def ordered(self):
+        """Returns the servers in the order they should be tried.
+
+        Returns:
+          list -- `Server` instances.
+        """
+        return sorted(self.servers, key=Server.sort_key)
+
+
+class _Attempt(protocol.ClientFactory):
+    """Connects to one server on behalf of a `ConnectionRace`."""
+
+    def __init__(self, race, server):
+        self.race = race
+        self.server = server
+        self.connector = None
+        self.started = None
+
+    def buildProtocol(self, addr):
+        return self.race.attempt_connected(self, addr)
+
+    def clientConnectionFailed(self, connector, reason):
+        self.race.attempt_failed(self, reason)
+
+    def clientConnectionLost(self, connector, reason):
+        if self.race.winner is self:
+            self.race.factory.clientConnectionLost(connector, reason)
+
+
+class ConnectionRace:
+    """Connects to the first of a network's servers that answers.
+
+    Servers are tried in order, like Happy Eyeballs does for addresses: the
+    next attempt starts when the last one fails, or after a short delay if
+    it's still going. The first connection made wins and the other attempts
+    are stopped, so the bot only registers once.
+    """
+
+    @property
+    def reactor(self):
+        return getattr(self, '_reactor', reactor)
+
+    def __init__(self, factory, servers, connect, delay=0.25, _reactor=None):
+        """Creates a new race. Call start() to begin it.
+
+        Keyword arguments:
+          factory -- The `CardinalBotFactory` to connect.
+          servers -- The `Server`s to try, in order.
+          connect -- Callable starting a connection, like
+            `reactor.connectTCP`, given a host, port and factory.
+          delay -- Seconds to wait on an attempt before starting the next.
+        """
+        self.logger = logging.getLogger(__name__)
+        if _reactor is not None:
+            self._reactor = _reactor
+        self.factory = factory
+        self.servers = list(servers)
+        self.connect = connect
+        self.delay = delay
+
+        self.attempts = []
+        self.failed = 0
+        self.winner = None
+        self._next_call = None
+
+    def start(self):
+        """Starts connecting."""
+        self._attempt_next()
+
+    def _attempt_next(self):
+        if self._next_call is not None and self._next_call.active():
+            self._next_call.cancel()
+        self._next_call = None
+
+        if self.winner is not None or \
+                len(self.attempts) == len(self.servers):
+            return
+
+        server = self.servers[len(self.attempts)]
+        self.logger.info("Connecting to %s" % server)
+
+        attempt = _Attempt(self, server)
+        attempt.started = time.monotonic()
+        self.attempts.append(attempt)
+        attempt.connector = self.connect(server.host, server.port, attempt)
+
+        if len(self.attempts) < len(self.servers):
+            self._next_call = self.reactor.callLater(self.delay,
+                                                     self._attempt_next)
+
+    def attempt_connected(self, attempt, addr):
+        """Called when one of the attempts connects.
+
+        Returns:
+          CardinalBot -- The protocol, or None if another attempt won.
+        """
+        if self.winner is not None:
+            return None
+
+        self.winner = attempt
+        seconds = time.monotonic() - attempt.started
+        attempt.server.connected(seconds)
+        self.logger.info("Connected to %s in %.3f seconds" %
+                         (attempt.server, seconds))
+
+        if self._next_call is not None and self._next_call.active():
+            self._next_call.cancel()
+        for other in self.attempts:
+            if other is not attempt and \
+                    other.connector.state == 'connecting':
+                other.connector.stopConnecting()
+
+        return self.factory.buildProtocol(addr)
+
+    def attempt_failed(self, attempt, reason):
+        """Called when one of the attempts fails to connect."""
+        if self.winner is not None:
+            return
+
+        attempt.server.failed()
+        self.failed += 1
+        self.logger.info("Could not connect to %s (%s)" %
+                         (attempt.server, reason))
+
+        if len(self.attempts) < len(self.servers):
+            self._attempt_next()
+        elif self.failed == len(self.attempts):
+            # Every server failed, so back off before racing again
+            self.factory.clientConnectionFailed(attempt.connector, reason)
@@ -0,0 +1,217 @@
+import hashlib
+import logging
+import socket
+from bisect import bisect
+
+from twisted.internet import reactor
+from twisted.internet.task import LoopingCall
+from twisted.names import client, dns
+
+
+def statefulset_ordinal(hostname=None):
+    """Returns the ordinal of this pod in its Kubernetes StatefulSet.
+
+    Pods of a StatefulSet are named after it, followed by a dash and their
+    ordinal, e.g. cardinal-2.
+
+    Keyword arguments:
+      hostname -- Hostname to read the ordinal from, by default this host's.
+
+    Returns:
+      int -- The ordinal, or None if the hostname doesn't end with one.
+    """
+    if hostname is None:
+        hostname = socket.gethostname()
+
+    _, _, ordinal = hostname.split('.')[0].rpartition('-')
+    if not ordinal.isdigit():
+        return None
+
+    return int(ordinal)
+
+
+class HashRing:
+    """Consistent hashing of keys onto a number of shards.
+
+    Each shard is placed on the ring many times, and a key belongs to the
+    shard placed next after the key's own hash. When a shard is added or
+    removed, only the keys next to its places move, about 1/n of them.
+    """
+
+    POINTS = 100
+    """Places on the ring of each shard, evening out their share of keys"""
+
+    def __init__(self, count, points=POINTS):
+        """Creates a ring of shards 0 to count - 1.
+
+        Keyword arguments:
+          count -- Number of shards.
+          points -- Places on the ring of each shard.
+        """
+        ring = sorted(
+            (self._hash('%d-%d' % (shard, point)), shard)
+            for shard in range(count)
+            for point in range(points)
+        )
+        self._hashes = [hash_ for hash_, _ in ring]
+        self._shards = [shard for _, shard in ring]
+
+    @staticmethod
+    def _hash(key):
+        digest = hashlib.md5(key.encode('utf-8')).digest()
+        return int.from_bytes(digest[:8], 'big')
+
+    def shard(self, key):
+        """Returns the shard a key belongs to.
+
+        Keyword arguments:
+          key -- A string.
+
+        Returns:
+          int -- The shard.
+        """
+        index = bisect(self._hashes, self._hash(key)) % len(self._hashes)
+        return self._shards[index]
+
+
+class Shards:
+    """Splits a network's channels between replicas of the bot.
+
+    Each replica is a shard, and joins only the channels the hash ring gives
+    it, with a nick of its own. Shard 0 keeps the configured nick.
+    """
+
+    def __init__(self, shard, count=1):
+        """Creates a new split of channels.
+
+        Keyword arguments:
+          shard -- This replica's shard, e.g. its StatefulSet ordinal.
+          count -- Number of replicas.
+        """
+        self.shard = shard
+        self.count = None
+        self.ring = None
+        self.resize(count)
+
+    def resize(self, count):
+        """Changes the number of replicas, moving about 1/count channels.
+
+        Keyword arguments:
+          count -- Number of replicas. This shard is always counted, even
+            if replicas are still starting.
+        """
+        self.count = max(count, self.shard + 1)
+        self.ring = HashRing(self.count)
+
+    def owns(self, channel):
+        """Checks whether a channel belongs to this shard.
+
+        Keyword arguments:
+          channel -- Name of the channel.
+
+        Returns:
+          bool -- Whether it's this shard's.
+        """
+        return self.ring.shard(channel.lower()) == self.shard
+
+    def channels(self, channels):
+        """Filters a list of channels down to this shard's.
+
+        Keyword arguments:
+          channels -- Names of channels.
+
+        Returns:
+          list -- The channels belonging to this shard, in order.
+        """
+        return [channel for channel in channels if self.owns(channel)]
+
+    def nickname(self, nickname):
+        """Returns the nick this shard uses.
+
+        Keyword arguments:
+          nickname -- The configured nick.
+
+        Returns:
+          str -- The nick, suffixed with the shard unless it's shard 0.
+        """
+        if self.shard == 0:
+            return nickname
+        return "%s%d" % (nickname, self.shard)
+
+
+class ReplicaWatcher:
+    """Rebalances channels as the bot's StatefulSet is scaled.
+
+    The replicas are counted by looking up the StatefulSet's headless
+    Service, which has an address for each pod. The Service should publish
+    addresses of pods that aren't ready, so channels don't move whenever a
+    replica restarts.
+    """
+
+    @property
+    def reactor(self):
+        return getattr(self, '_reactor', reactor)
+
+    def __init__(self, factories, service, interval=30,
+                 lookup=client.lookupAddress):
+        """Creates a new watcher. Call start() to begin watching.
+
+        Keyword arguments:
+          factories -- The `CardinalBotFactory` of each network.
+          service -- DNS name of the headless Service.
+          interval -- Seconds between counting the replicas.
+          lookup -- Callable resolving a name's A records, like
+            `twisted.names.client.lookupAddress`.
+        """
+        self.logger = logging.getLogger(__name__)
+        self.factories = factories
+        self.service = service
+        self.interval = interval
+        self.lookup = lookup
+
+        self._looping_call = None
+
+    def start(self):
+        """Starts counting the replicas."""
+        self.logger.info("Counting replicas by looking up %s every %s "
+                         "seconds" % (self.service, self.interval))
+
+        self._looping_call = LoopingCall(self.count)
+        self._looping_call.clock = self.reactor
+        self._looping_call.start(self.interval)
+
+    def stop(self):
+        """Stops counting the replicas."""
+        if self._looping_call is not None and self._looping_call.running:
+            self._looping_call.stop()
+        self._looping_call = None
+
+    def count(self):
+        """Counts the replicas, and rebalances if that changed.
+
+        Returns:
+          Deferred -- Fires with the number of replicas, or None if they
+            couldn't be counted.
+        """
+        d = self.lookup(self.service)
+        d.addCallback(self._counted)
+        d.addErrback(self._failed)
+        return d
+
+    def _counted(self, result):
+        answers, _, _ = result
+        addresses = {answer.payload.dottedQuad() for answer in answers
+                     if answer.type == dns.A}
+        if not addresses:
+            self.logger.warning("No replicas found at %s" % self.service)
+            return None
+
+        for factory in self.factories:
+            factory.reshard(len(addresses))
+
+        return len(addresses)
+
+    def _failed(self, failure):
+        self.logger.warning("Couldn't count replicas at %s: %s" %
+                            (self.service, failure.getErrorMessage()))
+        return None
@@ -9,12 +9,16 @@ from twisted.internet import defer
 from twisted.internet.task import Clock
 from twisted.words.protocols.irc import ServerSupportedFeatures
 
-from cardinal import exceptions, plugins
+from cardinal import exceptions, metrics, plugins
 from cardinal.bot import (
     CardinalBot,
     CardinalBotFactory,
     user_info,
 )
+from cardinal.election import LeaderElection
+from cardinal.limits import CallLimits
+from cardinal.servers import ServerList
+from cardinal.sharding import Shards
 
 from .unittest_util import tempdir
 
@@ -34,6 +38,7 @@ class TestCardinalBot:
         self.factory.server_password = None
         self.factory.server_commands = []
         self.factory.channels = []
+        self.factory.owned_channels.return_value = []
         self.factory.plugins = []
         self.factory.blacklist = {}
         self.factory.booted = datetime.now()
@@ -42,7 +47,8 @@ class TestCardinalBot:
         self.event_manager = mock_event_manager.return_value
 
         self.plugin_manager = self.cardinal.plugin_manager = \
-            Mock(spec=plugins.PluginManager)
+            self.factory.plugin_manager = Mock(spec=plugins.PluginManager)
+        self.factory.plugins_loaded = False
 
         # Some built-in Twisted methods will check self.supported, which is
         # typically setup during connectionMade(). That method won't get called
@@ -71,6 +77,9 @@ class TestCardinalBot:
             call("irc.part", 3),
             call("irc.kick", 4),
             call("irc.quit", 2),
+            call("irc.signedon", 0),
+            call("leader.elected", 0),
+            call("leader.deposed", 0),
         ]
 
         assert self.cardinal._who_cache == {}
@@ -102,46 +111,74 @@ class TestCardinalBot:
         with pytest.raises(AttributeError):
             self.cardinal.storage_path = '/path/to/storage'
 
+    def test_is_leader(self):
+        # without an election, every replica leads
+        assert self.cardinal.is_leader is True
+
+        self.factory.election = Mock(spec=LeaderElection)
+        self.factory.election.is_leader = False
+        assert self.cardinal.is_leader is False
+
+        self.factory.election.is_leader = True
+        assert self.cardinal.is_leader is True
+
     @patch.object(CardinalBot, 'join')
     @patch.object(CardinalBot, 'msg')
     @patch.object(CardinalBot, 'send')
-    @patch('cardinal.bot.PluginManager', autospec=True)
-    def test_signedOn_sets_bot_mode_joins_and_instantiates_plugin_manager(
+    def test_signedOn_sets_bot_mode_joins_and_loads_plugins(
             self,
-            mock_plugin_manager,
             mock_send,
             mock_msg,
             mock_join,
     ):
-        # we want to make sure this is created
+        # we want to make sure this is set
         del self.cardinal.plugin_manager
 
         channels = ['#channel1', '#channel2']
-        self.factory.channels = channels
+        self.factory.owned_channels.return_value = channels
+        self.factory.last_reconnection_wait = 300
 
         self.cardinal.signedOn()
 
+        # the next reconnection is quick again
+        assert self.factory.last_reconnection_wait is None
+
         assert not mock_msg.called  # no nickserv password provided
         assert mock_join.mock_calls == [call(channel) for channel in channels]
         mock_send.assert_called_once_with("MODE {} +B".format(
             self.cardinal.nickname
         ))
 
-        mock_plugin_manager.assert_called_once_with(self.cardinal,
-                                                    self.factory.plugins,
-                                                    self.factory.blacklist)
-        assert isinstance(self.cardinal.plugin_manager, plugins.PluginManager)
+        assert self.cardinal.plugin_manager is self.factory.plugin_manager
+        self.plugin_manager.rebind.assert_called_once_with(self.cardinal)
+        self.plugin_manager.load_async.assert_called_once_with(
+            self.factory.plugins)
+        self.plugin_manager.load_async.return_value.addCallback \
+            .assert_called_once_with(self.factory._plugins_activated)
+        assert self.factory.plugins_loaded is True
+        assert self.cardinal.signed_on is True
 
         assert isinstance(self.cardinal.uptime, datetime)
         assert self.cardinal.booted == self.factory.booted
 
+        self.event_manager.fire.assert_called_once_with("irc.signedon")
+
+    @patch.object(CardinalBot, 'join')
+    @patch.object(CardinalBot, 'send')
+    def test_signedOn_reconnect_keeps_plugins(self, mock_send, mock_join):
+        self.factory.plugins_loaded = True
+
+        self.cardinal.signedOn()
+
+        assert self.cardinal.plugin_manager is self.factory.plugin_manager
+        self.plugin_manager.rebind.assert_called_once_with(self.cardinal)
+        assert not self.plugin_manager.load_async.called
+
     @patch.object(CardinalBot, 'join')
     @patch.object(CardinalBot, 'msg')
     @patch.object(CardinalBot, 'send')
-    @patch('cardinal.bot.PluginManager', autospec=True)
     def test_signedOn_messages_nickserv(
             self,
-            mock_plugin_manager,
             _mock_send,
             mock_msg,
             mock_join,
@@ -158,10 +195,8 @@ class TestCardinalBot:
 
     @patch.object(CardinalBot, 'msg')
     @patch.object(CardinalBot, 'send')
-    @patch('cardinal.bot.PluginManager', autospec=True)
     def test_signedOn_sends_server_commands(
             self,
-            mock_plugin_manager,
             mock_send,
             _mock_msg,
     ):
@@ -182,13 +217,100 @@ class TestCardinalBot:
         ])
 
     def test_joined(self):
-        self.cardinal.joined("#bots")
-        # This just logs, nothing to assert
+        assert self.cardinal.joined_channels == set()
+
+        self.cardinal.joined("#Bots")
+        self.cardinal.joined("#other")
+        assert self.cardinal.joined_channels == {"#bots", "#other"}
+
+        self.cardinal.left("#bots")
+        assert self.cardinal.joined_channels == {"#other"}
+
+        self.cardinal.kickedFrom("#Other", "nick", "bye")
+        assert self.cardinal.joined_channels == set()
+
+    @patch('cardinal.bot.time.monotonic')
+    def test_heartbeat_measures_rtt(self, monotonic):
+        self.factory.ping_interval = 60
+        self.factory.max_missed_pongs = 3
+        self.factory.reactor = clock = Clock()
+        self.cardinal.sendLine = Mock()
+        assert self.cardinal.heartbeatInterval == 60
+
+        monotonic.return_value = 100.0
+        self.cardinal.startHeartbeat()
+        clock.advance(60)
+        self.cardinal.sendLine.assert_called_once_with("PING :cardinal-1")
+
+        observed = metrics.SERVER_RTT.get(self.factory.network)
+        observed = observed['count'] if observed else 0
+
+        # PONGs for other PINGs are ignored
+        monotonic.return_value = 100.25
+        self.cardinal.irc_PONG('irc.example.com',
+                               ['irc.example.com', 'irc.example.com'])
+        assert self.cardinal.rtt is None
+
+        self.cardinal.irc_PONG('irc.example.com',
+                               ['irc.example.com', 'cardinal-1'])
+        assert self.cardinal.rtt == 0.25
+        assert self.cardinal._pings == {}
+        assert metrics.SERVER_RTT.get(self.factory.network)['count'] == \
+            observed + 1
+
+        self.cardinal.stopHeartbeat()
+
+    def test_heartbeat_reconnects_after_missed_pongs(self):
+        self.factory.ping_interval = 60
+        self.factory.max_missed_pongs = 2
+        self.factory.reactor = clock = Clock()
+        self.cardinal.sendLine = Mock()
+        self.cardinal.transport = Mock()
+        timeouts = metrics.PING_TIMEOUTS.get(self.factory.network)
+
+        self.cardinal.startHeartbeat()
+        clock.advance(60)
+        clock.advance(60)
+        assert self.cardinal.sendLine.mock_calls == [
+            call("PING :cardinal-1"),
+            call("PING :cardinal-2"),
+        ]
+        assert not self.cardinal.transport.abortConnection.called
+
+        # a late PONG for any of them shows the server is still there
+        self.cardinal.irc_PONG('irc.example.com',
+                               ['irc.example.com', 'cardinal-1'])
+        clock.advance(60)
+        clock.advance(60)
+        assert not self.cardinal.transport.abortConnection.called
+
+        clock.advance(60)
+        self.cardinal.transport.abortConnection.assert_called_once_with()
+        assert metrics.PING_TIMEOUTS.get(self.factory.network) == timeouts + 1
+        assert self.cardinal._heartbeat is None
+        assert clock.getDelayedCalls() == []
+
+    @patch('cardinal.bot.irc.IRCClient.connectionLost')
+    def test_connectionLost(self, mock_parent_connectionlost):
+        self.cardinal.signed_on = True
+        self.cardinal.joined_channels = {"#bots"}
+        self.cardinal._pings = {"cardinal-1": 100.0}
+
+        self.cardinal.connectionLost('reason')
+
+        assert self.cardinal.signed_on is False
+        assert self.cardinal.joined_channels == set()
+        assert self.cardinal._pings == {}
+        mock_parent_connectionlost.assert_called_once_with('reason')
 
     @patch('cardinal.bot.irc.IRCClient.lineReceived')
     def test_lineReceived(self, mock_parent_linereceived):
+        received = metrics.LINES_RECEIVED.get(self.factory.network, 'TEST')
+
         line = b':irc.example.com TEST :foobar foobar'
         self.cardinal.lineReceived(line)
+        assert metrics.LINES_RECEIVED.get(self.factory.network, 'TEST') == \
+            received + 1
         self.event_manager.fire.assert_called_once_with(
             'irc.raw',
             'TEST',
@@ -196,6 +318,22 @@ class TestCardinalBot:
         )
         mock_parent_linereceived.assert_called_once_with(line)
 
+    @patch('cardinal.bot.irc.IRCClient.lineReceived')
+    def test_lineReceived_counted_by_network(self, mock_parent_linereceived):
+        other = CardinalBot()
+        other.factory = Mock(spec=CardinalBotFactory)
+        other.factory.network = 'irc.othernet.test'
+        other.event_manager = Mock()
+        received = metrics.LINES_RECEIVED.get(self.factory.network, 'TEST')
+        received_other = metrics.LINES_RECEIVED.get('irc.othernet.test',
+                                                    'TEST')
+
+        other.lineReceived(b':irc.othernet.test TEST :foobar')
+        assert metrics.LINES_RECEIVED.get('irc.othernet.test', 'TEST') == \
+            received_other + 1
+        assert metrics.LINES_RECEIVED.get(self.factory.network, 'TEST') == \
+            received
+
     @patch('cardinal.bot.irc.IRCClient.lineReceived')
     def test_lineReceived_non_utf8(self, mock_parent_linereceived):
         line = b":irc-us-east-2.darkscience.net 332 Cardinal #pirates :\x031 \x0311,10[\x031]\x031,1\x1f\xc3\x82\xc2\xaf\x1f\x0313,6[\x031]\x031,1\x1f\xc3\x82\xc2\xaf\x1f\x0311,10[\x031]\x031,1\x1f\xc3\x82\xc2\xaf\x1f\x0313,6[\x031]\x031,1\x1f\xc3\x82\xc2\xaf\x1f\x0311,10[\x031]\x031,1\x1f\xc3\x82\xc2\xaf\x1f\x0313,6[\x031]\x031,1\x1f\xc3\x82\xc2\xaf\x1f\x0311,10[\x031]\x03\x0311,6\x030 Pirates Game! - Welcome aboard Dark Sails, Season 4, Mod: Pauper Privateers! - \x1dJoin wit\' !Pirates\x1d - \x0311\x1fwww.piratesirc.com\x1f \x0311,6\x0311,10[\x031]\x031,1\x1f\xc3\x82\xc2\xaf\x1f\x0313,6[\x031]\x031,1\x1f\xc3\x82\xc2"  # noqa: E501
@@ -565,6 +703,22 @@ class TestCardinalBot:
 
         sendLine_mock.assert_called_once_with(message)
 
+    @pytest.mark.parametrize("line,command", [
+        ('PRIVMSG #channel :hi', 'PRIVMSG'),
+        (b'PRIVMSG #channel :hi', 'PRIVMSG'),
+        (':prefix notice #channel :hi', 'NOTICE'),
+        ('QUIT', 'QUIT'),
+    ])
+    def test_sendLine_counted(self, line, command):
+        sent = metrics.LINES_SENT.get(self.factory.network, command)
+
+        with patch('cardinal.bot.irc.IRCClient.sendLine') as sendLine_mock:
+            self.cardinal.sendLine(line)
+
+        assert metrics.LINES_SENT.get(self.factory.network, command) == \
+            sent + 1
+        sendLine_mock.assert_called_once()
+
     def test_disconnect(self):
         with patch.object(self.cardinal, 'quit') as quit_mock:
             self.cardinal.disconnect()
@@ -615,10 +769,15 @@ class TestCardinalBot:
             self.factory.storage_path = os.path.dirname(database_path)
             db = self.cardinal.get_db('test', network_specific=False)
 
+            saves = metrics.DB_SECONDS.get('save')
+            saves = saves['count'] if saves else 0
+
             with db() as db1:
                 assert db1 == {}
                 db1['test'] = 'x'
 
+            assert metrics.DB_SECONDS.get('save')['count'] == saves + 1
+
             with db() as db2:
                 assert db1 == db2
 
@@ -675,6 +834,11 @@ class TestCardinalBot:
 
 class TestCardinalBotFactory:
     def setup_method(self):
+        self.plugin_manager_patcher = patch('cardinal.bot.PluginManager',
+                                            autospec=True)
+        self.mock_plugin_manager = self.plugin_manager_patcher.start()
+        self.mock_plugin_manager.return_value.limits = Mock(spec=CallLimits)
+
         self.factory = CardinalBotFactory(
             network='irc.testnet.test',
             server_password='s3rv3r_p4ssw0rd',
@@ -692,12 +856,15 @@ class TestCardinalBotFactory:
         )
 
     def teardown_method(self, method):
+        self.plugin_manager_patcher.stop()
+
         # remove signal handler set by the factory
         signal.signal(signal.SIGINT, signal.SIG_DFL)
         del self.factory
 
     def test_class_properties(self):
         assert CardinalBotFactory.protocol is CardinalBot
+        assert CardinalBotFactory.FIRST_RECONNECTION_WAIT == 1
         assert CardinalBotFactory.MINIMUM_RECONNECTION_WAIT == 10
         assert CardinalBotFactory.MAXIMUM_RECONNECTION_WAIT == 300
 
@@ -753,6 +920,125 @@ class TestCardinalBotFactory:
         assert factory.blacklist == blacklist
         assert factory.storage_path == storage
 
+        # Plugins are preloaded before connecting
+        self.mock_plugin_manager.assert_called_with(None, [], blacklist,
+                                                    lazy=False,
+                                                    isolated=None,
+                                                    blocking_threads=10,
+                                                    blocking_limit=2,
+                                                    timeout=None,
+                                                    max_in_flight=None,
+                                                    timeouts=None)
+        assert factory.plugin_manager is self.mock_plugin_manager.return_value
+        factory.plugin_manager.preload.assert_called_with(plugins)
+        assert factory.plugins_loaded is False
+        assert factory.plugins_ready is False
+        assert factory.ping_interval == 60
+        assert [(server.host, server.port) for server in factory.servers] \
+            == [(network.lower(), 6667)]
+        assert factory.ssl_context is None
+        assert factory.connection_attempt_delay == 0.25
+        assert factory.race is None
+        assert factory.max_missed_pongs == 3
+        assert factory.event_manager is None
+        assert factory.db_locks == {}
+        assert not factory.disconnected.called
+        assert factory.shards is None
+        assert factory.election is None
+        assert factory.owned_channels() == channels
+
+    def test_plugins_activated(self):
+        assert self.factory._plugins_activated(['failed']) == ['failed']
+        assert self.factory.plugins_ready is True
+
+    def test_buildProtocol_keeps_event_manager(self):
+        first = self.factory.buildProtocol(None)
+        assert isinstance(first, CardinalBot)
+        assert first.factory is self.factory
+        assert self.factory.event_manager is first.event_manager
+        assert first.event_manager.cardinal is first
+        assert first.event_manager.limits is self.factory.plugin_manager.limits
+
+        first.event_manager.register('test.event', 0)
+
+        # a reconnect gets the same EventManager, now passing the new instance
+        second = self.factory.buildProtocol(None)
+        assert second is not first
+        assert second.event_manager is first.event_manager
+        assert second.event_manager.cardinal is second
+        assert 'test.event' in second.event_manager.registered_events
+
+    def test_outbound_queue_metric(self):
+        factory = CardinalBotFactory('irc.othernet.test', None, [], [],
+                                     'Cardinal', None, 'cardinal', None, [],
+                                     {}, None)
+        queued = metrics.OUTBOUND_QUEUE.get()
+
+        # counts the queues of every network
+        self.factory.cardinal = Mock(_queue=['PRIVMSG #a :1'])
+        factory.cardinal = Mock(_queue=['PRIVMSG #b :1', 'PRIVMSG #b :2'])
+        assert metrics.OUTBOUND_QUEUE.get() == queued + 3
+
+    def test_buildProtocol_shares_db_locks(self):
+        db_locks = {}
+        factory = CardinalBotFactory('irc.othernet.test', None, [], [],
+                                     'Cardinal', None, 'cardinal', None, [],
+                                     {}, None, db_locks=db_locks)
+
+        assert self.factory.buildProtocol(None).db_locks is \
+            self.factory.db_locks
+        assert factory.buildProtocol(None).db_locks is db_locks
+
+    def test_sharded(self):
+        channels = ['#channel%d' % n for n in range(20)]
+        factories = [
+            CardinalBotFactory('irc.testnet.test', None, [], channels,
+                               'Cardinal', None, 'cardinal', None, [], {},
+                               None, shards=Shards(shard, 3))
+            for shard in range(3)
+        ]
+
+        # each shard has a nick of its own, and the channels are split
+        assert [factory.nickname for factory in factories] == \
+            ['Cardinal', 'Cardinal1', 'Cardinal2']
+        owned = [factory.owned_channels() for factory in factories]
+        assert sorted(sum(owned, [])) == sorted(channels)
+        assert all(owned)
+
+    def test_reshard(self):
+        channels = ['#channel%d' % n for n in range(20)]
+        self.factory.channels = channels
+        self.factory.shards = Shards(0, 1)
+        cardinal = self.factory.cardinal = Mock(spec=CardinalBot)
+        cardinal.signed_on = True
+
+        self.factory.reshard(1)
+        assert not cardinal.part.called
+
+        self.factory.reshard(2)
+        after = self.factory.owned_channels()
+        assert self.factory.shards.count == 2
+        assert 0 < len(after) < len(channels)
+        assert cardinal.part.mock_calls == [
+            call(channel, 'Rebalancing channels')
+            for channel in channels if channel not in after]
+        assert not cardinal.join.called
+
+        # scaling back in joins them again
+        cardinal.part.reset_mock()
+        self.factory.reshard(1)
+        assert self.factory.owned_channels() == channels
+        assert cardinal.join.mock_calls == [
+            call(channel) for channel in channels if channel not in after]
+        assert not cardinal.part.called
+
+    def test_reshard_not_signed_on(self):
+        self.factory.channels = ['#channel%d' % n for n in range(20)]
+        self.factory.shards = Shards(0, 1)
+
+        self.factory.reshard(2)
+        assert self.factory.shards.count == 2
+
     def test_sigint_handler(self):
         mock_cardinal = Mock(spec=CardinalBot)
         self.factory.cardinal = mock_cardinal
@@ -770,45 +1056,80 @@ class TestCardinalBotFactory:
         os.kill(os.getpid(), signal.SIGINT)
 
         assert self.factory.disconnect is True
+        assert self.factory.disconnected.called
+
+    def test_sigint_handler_chains_factories(self):
+        # e.g. one factory per network
+        factory = CardinalBotFactory('irc.othernet.test', None, [], [],
+                                     'Cardinal', None, 'cardinal', None, [],
+                                     {}, None)
+        assert signal.getsignal(signal.SIGINT) == factory._sigint
 
-    def test_reconnection(self):
+        mock_cardinal = Mock(spec=CardinalBot)
+        self.factory.cardinal = mock_cardinal
+
+        os.kill(os.getpid(), signal.SIGINT)
+
+        assert factory.disconnect is True
+        assert factory.disconnected.called
+        assert self.factory.disconnect is True
+        mock_cardinal.quit.assert_called_once_with('Received SIGINT.')
+
+    @patch('cardinal.bot.random.uniform')
+    def test_reconnection(self, uniform):
+        uniform.side_effect = lambda a, b: b
         assert self.factory.disconnect is False
 
         clock = Clock()
         mock_connector = Mock()
         self.factory._reactor = clock
+        self.factory.connect = Mock()
+        reconnects = metrics.RECONNECTS.get(self.factory.network, 'lost')
 
         self.factory.clientConnectionLost(
             mock_connector,
             'Called by unit test'
         )
 
+        # the first retry is almost immediate
+        assert metrics.RECONNECTS.get(self.factory.network, 'lost') == \
+            reconnects + 1
+        uniform.assert_called_once_with(
+            0, CardinalBotFactory.FIRST_RECONNECTION_WAIT)
         assert self.factory.last_reconnection_wait == \
-            CardinalBotFactory.MINIMUM_RECONNECTION_WAIT
+            CardinalBotFactory.FIRST_RECONNECTION_WAIT
         clock.advance(self.factory.last_reconnection_wait)
 
-        mock_connector.connect.assert_called_once()
+        self.factory.connect.assert_called_once_with()
 
-    def test_initial_connection_failed(self):
+    @patch('cardinal.bot.random.uniform')
+    def test_initial_connection_failed(self, uniform):
+        uniform.side_effect = lambda a, b: b
         assert self.factory.disconnect is False
         assert self.factory.last_reconnection_wait is None
 
         clock = Clock()
         mock_connector = Mock()
         self.factory._reactor = clock
+        self.factory.connect = Mock()
+        reconnects = metrics.RECONNECTS.get(self.factory.network, 'failed')
 
         self.factory.clientConnectionFailed(
             mock_connector,
             'Called by unit test'
         )
 
+        assert metrics.RECONNECTS.get(self.factory.network, 'failed') == \
+            reconnects + 1
         assert self.factory.last_reconnection_wait == \
-            CardinalBotFactory.MINIMUM_RECONNECTION_WAIT
+            CardinalBotFactory.FIRST_RECONNECTION_WAIT
         clock.advance(self.factory.last_reconnection_wait)
 
-        mock_connector.connect.assert_called_once()
+        self.factory.connect.assert_called_once_with()
 
-    def test_reconnection_failed(self):
+    @patch('cardinal.bot.random.uniform')
+    def test_reconnection_failed(self, uniform):
+        uniform.return_value = 25
         assert self.factory.disconnect is False
         self.factory.last_reconnection_wait = \
             CardinalBotFactory.MINIMUM_RECONNECTION_WAIT
@@ -816,25 +1137,29 @@ class TestCardinalBotFactory:
         clock = Clock()
         mock_connector = Mock()
         self.factory._reactor = clock
+        self.factory.connect = Mock()
 
         self.factory.clientConnectionFailed(
             mock_connector,
             'Called by unit test'
         )
 
-        # time should have doubled
-        assert self.factory.last_reconnection_wait == \
-            CardinalBotFactory.MINIMUM_RECONNECTION_WAIT * 2
+        # somewhere between the minimum and three times the last wait
+        uniform.assert_called_once_with(
+            CardinalBotFactory.MINIMUM_RECONNECTION_WAIT,
+            CardinalBotFactory.MINIMUM_RECONNECTION_WAIT * 3)
+        assert self.factory.last_reconnection_wait == 25
 
-        # make sure it's not called on original time
-        clock.advance(self.factory.MINIMUM_RECONNECTION_WAIT)
-        assert not mock_connector.connect.called
+        # make sure it's not called before then
+        clock.advance(24)
+        assert not self.factory.connect.called
 
-        # advance it one more time and it should be
-        clock.advance(self.factory.MINIMUM_RECONNECTION_WAIT)
-        mock_connector.connect.assert_called_once()
+        clock.advance(1)
+        self.factory.connect.assert_called_once_with()
 
-    def test_reconnection_failed_max_wait(self):
+    @patch('cardinal.bot.random.uniform')
+    def test_reconnection_failed_max_wait(self, uniform):
+        uniform.side_effect = lambda a, b: b
         assert self.factory.disconnect is False
         self.factory.last_reconnection_wait = \
             CardinalBotFactory.MAXIMUM_RECONNECTION_WAIT
@@ -842,6 +1167,7 @@ class TestCardinalBotFactory:
         clock = Clock()
         mock_connector = Mock()
         self.factory._reactor = clock
+        self.factory.connect = Mock()
 
         self.factory.clientConnectionFailed(
             mock_connector,
@@ -854,7 +1180,57 @@ class TestCardinalBotFactory:
 
         # advance it one more time and it should be
         clock.advance(self.factory.MAXIMUM_RECONNECTION_WAIT)
-        mock_connector.connect.assert_called_once()
+        self.factory.connect.assert_called_once_with()
+
+    def test_reconnection_waits_are_jittered(self):
+        waits = []
+        for _ in range(20):
+            waits.append(self.factory.next_reconnection_wait())
+
+        assert 0 <= waits[0] <= CardinalBotFactory.FIRST_RECONNECTION_WAIT
+        for last, wait in zip(waits, waits[1:]):
+            assert CardinalBotFactory.MINIMUM_RECONNECTION_WAIT <= wait <= \
+                min(CardinalBotFactory.MAXIMUM_RECONNECTION_WAIT,
+                    max(CardinalBotFactory.MINIMUM_RECONNECTION_WAIT,
+                        last * 3))
+        assert len(set(waits)) > 1
+
+    def test_reconnection_demotes_server_dropping_us(self):
+        self.factory._reactor = Clock()
+        self.factory.connect = Mock()
+        self.factory.race = Mock()
+        server = self.factory.race.winner.server
+
+        # after being signed on, it's tried first again
+        self.factory.clientConnectionLost(Mock(), 'unit test')
+        assert not server.failed.called
+
+        # but if it drops us again before we sign on, it isn't
+        self.factory.clientConnectionLost(Mock(), 'unit test')
+        server.failed.assert_called_once_with()
+
+    @pytest.mark.parametrize("ssl_context", [None, Mock()])
+    def test_connect(self, ssl_context):
+        self.factory.servers = ServerList([('irc.slow.test', 6667),
+                                           ('irc.fast.test', 6697)])
+        self.factory.servers.servers[1].connected(0.1)
+        self.factory.ssl_context = ssl_context
+        self.factory._reactor = reactor = Mock()
+
+        race = self.factory.connect()
+        assert self.factory.race is race
+        assert race.servers == self.factory.servers.ordered()
+        assert race.delay == 0.25
+
+        # the fastest server is tried first
+        if ssl_context is None:
+            reactor.connectTCP.assert_called_once_with(
+                'irc.fast.test', 6697, race.attempts[0])
+        else:
+            reactor.connectSSL.assert_called_once_with(
+                'irc.fast.test', 6697, race.attempts[0],
+                ssl_context.creator.return_value)
+            ssl_context.creator.assert_called_once_with('irc.fast.test')
 
     def test_bypass_reconnection(self):
         # Mark that we purposefully disconnected
@@ -864,4 +1240,6 @@ class TestCardinalBotFactory:
 
         self.factory.clientConnectionLost(None, 'Called by unit test')
 
-        self.factory._reactor.stop.assert_called_once()
+        # the entry point stops the reactor once every network is done
+        assert self.factory.disconnected.called
+        self.factory._reactor.stop.assert_not_called()
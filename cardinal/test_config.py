@@ -107,3 +107,24 @@ class TestConfigParser:
 
         # This was in the file but not the spec and should not appear in config
         assert 'ignored_string' not in self.config_parser.config
+
+    def test_load_overrides(self):
+        self.config_parser.load_config(
+            os.path.join(FIXTURE_DIRECTORY, 'config.json'))
+
+        # without any, there's just the config
+        assert self.config_parser.load_overrides('list', ['int']) == \
+            [self.config_parser.config]
+
+        self.config_parser.config['list'] = [
+            {'int': 4},
+            {'int': 'invalid', 'string': 'not allowed'},
+            'invalid',
+        ]
+        first, second = self.config_parser.load_overrides('list', ['int'])
+
+        assert first['int'] == 4
+        assert first['string'] == 'value'
+        assert second['int'] == 3
+        assert second['string'] == 'value'
+        assert self.config_parser.config['int'] == 3
@@ -27,6 +27,24 @@ def test_command_overwrites():
     assert foo.commands == ['foo']
 
 
+def test_command_blocking():
+    @decorators.command('foo', blocking=True)
+    def foo():
+        pass
+
+    @decorators.regex('^bar', blocking=True)
+    def bar():
+        pass
+
+    @decorators.command('baz')
+    def baz():
+        pass
+
+    assert foo.blocking is True
+    assert bar.blocking is True
+    assert not hasattr(baz, 'blocking')
+
+
 def test_command_function_wrap():
     # test that the decorator doesn't break the function
     @decorators.command('foo')
@@ -197,3 +215,51 @@ def test_event_exceptions(value):
         @decorators.event(value)
         def foo():
             pass
+
+
+def test_get_manifest():
+    class Plugin:
+        @decorators.command('foo')
+        def foo(self):
+            pass
+
+        @decorators.regex('bar')
+        @decorators.event('irc.privmsg')
+        def bar(self):
+            pass
+
+        @staticmethod
+        @decorators.event('irc.join')
+        def baz():
+            pass
+
+        @property
+        def broken(self):
+            raise Exception("Properties shouldn't be looked at")
+
+        def qux(self):
+            pass
+
+    manifest = decorators.get_manifest(Plugin)
+    assert manifest == (['bar', 'foo'], ['bar', 'baz'])
+
+    # cached per class
+    assert decorators.get_manifest(Plugin) is manifest
+
+
+def test_get_manifest_subclass_override():
+    class Plugin:
+        @decorators.command('foo')
+        def foo(self):
+            pass
+
+        @decorators.event('irc.join')
+        def bar(self):
+            pass
+
+    class SubPlugin(Plugin):
+        def foo(self):
+            pass
+
+    assert decorators.get_manifest(SubPlugin) == ([], ['bar'])
+    assert decorators.get_manifest(Plugin) == (['foo'], ['bar'])
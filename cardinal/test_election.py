@@ -0,0 +1,145 @@
+import os
+import time
+
+from mock import Mock, patch
+from twisted.internet.task import Clock
+
+from cardinal import metrics
+from cardinal.bot import CardinalBotFactory
+from cardinal.election import FileLease, LeaderElection
+from cardinal.plugins import EventManager
+from .unittest_util import tempdir
+
+
+class TestFileLease:
+    def test_acquire(self):
+        with tempdir('lease') as directory:
+            lease = FileLease(os.path.join(directory, 'leader'))
+            assert lease.holder() is None
+
+            assert lease.acquire('first', 15) is True
+            assert lease.holder() == 'first'
+            assert lease.acquire('second', 15) is False
+
+            # renewing
+            assert lease.acquire('first', 15) is True
+            assert lease.holder() == 'first'
+
+    def test_expired(self):
+        with tempdir('lease') as directory:
+            lease = FileLease(os.path.join(directory, 'leader'))
+            assert lease.acquire('first', 15) is True
+
+            with patch('cardinal.election.time.time',
+                       return_value=time.time() + 16):
+                assert lease.holder() is None
+                assert lease.acquire('second', 15) is True
+                assert lease.holder() == 'second'
+
+    def test_release(self):
+        with tempdir('lease') as directory:
+            lease = FileLease(os.path.join(directory, 'leader'))
+            lease.acquire('first', 15)
+
+            # only the holder can release it
+            lease.release('second')
+            assert lease.holder() == 'first'
+
+            lease.release('first')
+            assert lease.holder() is None
+            assert lease.acquire('second', 15) is True
+
+    def test_corrupt(self):
+        with tempdir('lease') as directory:
+            path = os.path.join(directory, 'leader')
+            with open(path, 'w') as f:
+                f.write('{not json')
+
+            lease = FileLease(path)
+            assert lease.holder() is None
+            assert lease.acquire('first', 15) is True
+
+
+class TestLeaderElection:
+    def setup_method(self):
+        self.factory = Mock(spec=CardinalBotFactory)
+        self.factory.event_manager = Mock(spec=EventManager)
+        self.lease = Mock(spec=FileLease)
+        self.election = LeaderElection([self.factory], self.lease,
+                                       identity='cardinal-0', duration=15)
+        self.election._reactor = self.clock = Clock()
+
+    def test_identity(self):
+        election = LeaderElection([], self.lease)
+        assert election.identity.endswith(':%d' % os.getpid())
+
+    def test_elected(self):
+        self.lease.acquire.return_value = True
+        assert self.election.is_leader is False
+
+        self.election.start()
+
+        self.lease.acquire.assert_called_once_with('cardinal-0', 15)
+        assert self.election.is_leader is True
+        assert metrics.LEADER.get() == 1
+        self.factory.event_manager.fire.assert_called_once_with(
+            'leader.elected')
+
+        # renewing doesn't tell plugins again
+        self.clock.advance(5)
+        assert self.lease.acquire.call_count == 2
+        self.factory.event_manager.fire.assert_called_once_with(
+            'leader.elected')
+
+    def test_standby(self):
+        self.lease.acquire.return_value = False
+
+        self.election.start()
+
+        assert self.election.is_leader is False
+        assert not self.factory.event_manager.fire.called
+
+        # takes over once the leader goes away
+        self.lease.acquire.return_value = True
+        self.clock.advance(5)
+        assert self.election.is_leader is True
+        self.factory.event_manager.fire.assert_called_once_with(
+            'leader.elected')
+
+    def test_deposed(self):
+        self.lease.acquire.return_value = True
+        self.election.start()
+
+        self.lease.acquire.side_effect = IOError
+        self.clock.advance(5)
+
+        assert self.election.is_leader is False
+        assert metrics.LEADER.get() == 0
+        self.factory.event_manager.fire.assert_called_with('leader.deposed')
+
+    def test_without_event_manager(self):
+        self.factory.event_manager = None
+        self.lease.acquire.return_value = True
+
+        self.election.renew()
+        assert self.election.is_leader is True
+
+    def test_stop(self):
+        self.lease.acquire.return_value = True
+        self.election.start()
+
+        self.election.stop()
+
+        self.lease.release.assert_called_once_with('cardinal-0')
+        assert self.election.is_leader is False
+        self.factory.event_manager.fire.assert_called_with('leader.deposed')
+
+        self.clock.advance(5)
+        assert self.lease.acquire.call_count == 1
+
+    def test_stop_standby(self):
+        self.lease.acquire.return_value = False
+        self.election.start()
+
+        self.election.stop()
+        assert not self.lease.release.called
@@ -0,0 +1,112 @@
+from mock import Mock, patch
+from twisted.web.test.requesthelper import DummyRequest
+
+from cardinal.bot import CardinalBot, CardinalBotFactory
+from cardinal.health import HealthChecks, HealthResource
+from cardinal.lag import LagMonitor
+from cardinal.plugins import PluginManager
+
+
+class TestHealthResource:
+    def render(self, check):
+        request = DummyRequest([b''])
+        body = HealthResource(check).render_GET(request)
+        return request.responseCode, body
+
+    def test_healthy(self):
+        code, body = self.render(lambda: [])
+        assert code in (None, 200)
+        assert body == b'ok\n'
+
+    def test_unhealthy(self):
+        code, body = self.render(lambda: ["not signed on", "plugins"])
+        assert code == 503
+        assert body == b'not signed on\nplugins\n'
+
+    def test_check_raises(self):
+        code, body = self.render(Mock(side_effect=Exception))
+        assert code == 503
+        assert body == b'health check failed\n'
+
+
+class TestHealthChecks:
+    def setup_method(self):
+        self.factory = Mock(spec=CardinalBotFactory)
+        self.factory.channels = ['#bots', '#Other', '#elsewhere']
+        self.factory.owned_channels.return_value = ['#bots', '#Other']
+        self.factory.plugins_ready = True
+        self.factory.plugin_manager = Mock(spec=PluginManager)
+        self.factory.plugin_manager.check_health.return_value = []
+
+        self.cardinal = self.factory.cardinal = Mock(spec=CardinalBot)
+        self.cardinal.signed_on = True
+        self.cardinal.joined_channels = {'#bots', '#other'}
+
+        self.monitor = LagMonitor([self.factory], interval=0.1,
+                                  threshold=0.5)
+        self.checks = HealthChecks([self.factory], self.monitor)
+
+    def test_ready(self):
+        assert self.checks.ready() == []
+
+    def test_not_signed_on(self):
+        self.factory.cardinal = None
+        assert self.checks.ready() == ["not signed on"]
+
+        self.factory.cardinal = self.cardinal
+        self.cardinal.signed_on = False
+        assert self.checks.ready() == ["not signed on"]
+
+    def test_not_in_channels(self):
+        self.cardinal.joined_channels = {'#bots'}
+        assert self.checks.ready() == ["not in channels: #Other"]
+
+    def test_plugins(self):
+        self.factory.plugins_ready = False
+        self.factory.plugin_manager.check_health.return_value = [
+            "subwatch: Reddit stream isn't running"]
+
+        assert self.checks.ready() == [
+            "plugins not loaded",
+            "subwatch: Reddit stream isn't running",
+        ]
+
+    def test_ready_networks(self):
+        other = Mock(spec=CardinalBotFactory)
+        other.network = 'irc.other.test'
+        other.cardinal = None
+        other.plugins_ready = True
+        other.plugin_manager = Mock(spec=PluginManager)
+        other.plugin_manager.check_health.return_value = []
+        self.factory.network = 'irc.example.test'
+        self.factory.plugins_ready = False
+        self.checks.factories.append(other)
+
+        assert self.checks.ready() == [
+            "irc.example.test: plugins not loaded",
+            "irc.other.test: not signed on",
+        ]
+
+    def test_live_without_monitor(self):
+        assert HealthChecks([self.factory]).live() == []
+        # not started yet
+        assert self.checks.live() == []
+
+    @patch('cardinal.health.time.monotonic')
+    def test_live(self, monotonic):
+        monotonic.return_value = 100.05
+        self.monitor.last_tick = 100.0
+        assert self.checks.live() == []
+
+        self.monitor.lag = 0.75
+        assert self.checks.live() == ["reactor lagged 0.750 seconds"]
+
+        self.monitor.lag = 0.0
+        monotonic.return_value = 101.0
+        assert self.checks.live() == [
+            "lag monitor last ran 1.000 seconds ago"]
+
+    def test_resources(self):
+        resources = self.checks.resources()
+        assert resources[b'healthz'].check == self.checks.live
+        assert resources[b'readyz'].check == self.checks.ready
@@ -0,0 +1,132 @@
+import threading
+
+from mock import Mock, patch
+from twisted.internet.task import Clock
+
+from cardinal import metrics
+from cardinal.lag import LagMonitor
+from cardinal.plugins import EventManager
+from cardinal.profiling import Profiler
+
+
+class TestLagMonitor:
+    def setup_method(self):
+        self.factory = Mock()
+        self.factory.plugin_manager.profiler = Profiler()
+        self.factory.event_manager = EventManager(Mock())
+
+        self.monitor = LagMonitor([self.factory], interval=0.1,
+                                  threshold=0.5)
+        self.monitor._reactor = self.clock = Clock()
+
+    def teardown_method(self):
+        self.monitor.stop()
+
+    @patch('cardinal.lag.time.monotonic')
+    def test_tick_measures_lag(self, monotonic):
+        monotonic.return_value = 100.0
+        self.monitor.start(watchdog=False)
+        observed = metrics.REACTOR_LAG.get()
+        observed = observed['count'] if observed else 0
+
+        monotonic.return_value = 100.1
+        self.clock.advance(0.1)
+        assert metrics.REACTOR_LAG.get()['count'] == observed + 1
+
+        with patch.object(self.monitor.logger, 'warning') as warning:
+            monotonic.return_value = 101.0
+            self.clock.advance(0.1)
+            warning.assert_called_once_with(
+                "Reactor was blocked for 0.800 seconds")
+
+    @patch('cardinal.lag.time.monotonic')
+    def test_check_logs_stall_once(self, monotonic):
+        monotonic.return_value = 100.0
+        self.monitor.start(watchdog=False)
+        stalls = metrics.REACTOR_STALLS.get()
+
+        monotonic.return_value = 100.5
+        assert self.monitor.check() is False
+
+        monotonic.return_value = 100.7
+        with patch.object(self.monitor.logger, 'warning') as warning:
+            assert self.monitor.check() is True
+            assert self.monitor.check() is False
+
+        message = warning.call_args[0][0]
+        assert message.startswith(
+            "Reactor has been blocked for 0.600 seconds, at:\n")
+        # the stack of the thread start() was called from
+        assert 'test_check_logs_stall_once' in message
+        assert metrics.REACTOR_STALLS.get() == stalls + 1
+
+        # once the reactor runs again, the next stall is logged too
+        self.monitor.tick()
+        monotonic.return_value = 101.5
+        assert self.monitor.check() is True
+
+    @patch('cardinal.lag.time.monotonic')
+    def test_blames_running_plugin(self, monotonic):
+        monotonic.return_value = 100.0
+        self.monitor.start(watchdog=False)
+        event_manager = self.factory.event_manager
+        event_manager.register('irc.raw', 2)
+        event_manager.limits = Mock()
+
+        messages = []
+
+        def callback(cardinal, command, line):
+            monotonic.return_value = 101.0
+            with patch.object(self.monitor.logger, 'warning') as warning:
+                self.monitor.check()
+            messages.append(warning.call_args[0][0])
+
+        def limited_call(plugin, f, *args):
+            return self.factory.plugin_manager.profiler.call(
+                plugin, 'callback', f, *args)
+        event_manager.limits.call.side_effect = limited_call
+
+        event_manager.register_callback('irc.raw', callback, plugin='slow')
+        event_manager.fire('irc.raw', 'PRIVMSG', 'line')
+
+        assert messages[0].startswith(
+            "Reactor has been blocked for 0.900 seconds running callback of "
+            "plugin slow, for event irc.raw, at:\n")
+        assert event_manager.firing is None
+        assert self.factory.plugin_manager.profiler.current is None
+        assert self.monitor.running() is None
+
+    def test_running_without_plugin(self):
+        self.factory.event_manager.firing = 'irc.join'
+        assert self.monitor.running() == "a callback for event irc.join"
+
+        self.factory.event_manager = None
+        self.factory.plugin_manager.profiler.current = ('foo', 'bar')
+        assert self.monitor.running() == "bar of plugin foo"
+
+    def test_running_on_network(self):
+        idle = Mock()
+        idle.plugin_manager = None
+        idle.event_manager = None
+        self.monitor.factories = [idle, self.factory]
+        self.factory.network = 'irc.example.com'
+
+        assert self.monitor.running() is None
+
+        self.factory.event_manager.firing = 'irc.join'
+        assert self.monitor.running() == \
+            "a callback for event irc.join on irc.example.com"
+
+    def test_watchdog_thread(self):
+        checked = threading.Event()
+        self.monitor.check = Mock(side_effect=lambda: checked.set())
+        self.monitor.interval = 0.01
+
+        self.monitor.start()
+        assert checked.wait(5)
+
+        watchdog = self.monitor._watchdog
+        assert watchdog.daemon
+        self.monitor.stop()
+        watchdog.join(5)
+        assert not watchdog.is_alive()
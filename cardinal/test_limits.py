@@ -0,0 +1,126 @@
+from twisted.internet import defer, error
+from twisted.internet.task import Clock
+
+from cardinal.exceptions import PluginBusyError
+from cardinal.limits import CallLimits
+
+
+class TestCallLimits:
+    def make_limits(self, **kwargs):
+        limits = CallLimits(**kwargs)
+        limits._reactor = self.clock = Clock()
+        return limits
+
+    def results(self, d):
+        results = []
+        d.addBoth(results.append)
+        return results
+
+    def test_unlimited(self):
+        limits = self.make_limits()
+        pending = defer.Deferred()
+
+        results = self.results(limits.call('plugin', lambda: pending))
+        self.clock.advance(10 ** 6)
+        assert results == []
+        assert limits.in_flight == {'plugin': 1}
+
+        pending.callback('done')
+        assert results == ['done']
+        assert limits.in_flight == {}
+
+    def test_synchronous_calls_not_tracked(self):
+        limits = self.make_limits(timeout=1, max_in_flight=1)
+
+        for _ in range(3):
+            assert self.results(limits.call('plugin', lambda x: x, 3)) == [3]
+        assert limits.in_flight == {}
+        assert self.clock.getDelayedCalls() == []
+
+    def test_timeout_cancels(self):
+        limits = self.make_limits(timeout=5)
+        cancelled = []
+        pending = defer.Deferred(cancelled.append)
+
+        results = self.results(limits.call('plugin', lambda: pending))
+        self.clock.advance(4)
+        assert results == []
+
+        self.clock.advance(1)
+        assert cancelled == [pending]
+        assert results[0].check(error.TimeoutError)
+        assert limits.in_flight == {}
+
+    def test_timeout_without_cancelling(self):
+        limits = self.make_limits(timeout=5)
+        cancelled = []
+        pending = defer.Deferred(cancelled.append)
+
+        results = self.results(limits.call('plugin', lambda: pending,
+                                           cancel=False))
+        self.clock.advance(5)
+        assert results[0].check(error.TimeoutError)
+
+        # still in flight until it finishes
+        assert cancelled == []
+        assert limits.in_flight == {'plugin': 1}
+
+        pending.errback(ValueError('late'))
+        assert limits.in_flight == {}
+        assert len(results) == 1
+
+    def test_finished_in_time_without_cancelling(self):
+        limits = self.make_limits(timeout=5)
+        pending = defer.Deferred()
+
+        results = self.results(limits.call('plugin', lambda: pending,
+                                           cancel=False))
+        pending.callback('done')
+        assert results == ['done']
+        assert limits.in_flight == {}
+        assert self.clock.getDelayedCalls() == []
+
+    def test_per_plugin_timeouts(self):
+        limits = self.make_limits(timeout=5, timeouts={'slow': 60})
+        assert limits.get_timeout('slow') == 60
+        assert limits.get_timeout('other') == 5
+
+        results = self.results(limits.call('slow', defer.Deferred))
+        self.clock.advance(5)
+        assert results == []
+        self.clock.advance(55)
+        assert results[0].check(error.TimeoutError)
+
+    def test_finished_in_time(self):
+        limits = self.make_limits(timeout=5)
+        pending = defer.Deferred()
+
+        results = self.results(limits.call('plugin', lambda: pending))
+        pending.callback('done')
+        assert results == ['done']
+        assert self.clock.getDelayedCalls() == []
+
+    def test_max_in_flight(self):
+        limits = self.make_limits(max_in_flight=2)
+        pending = [defer.Deferred() for _ in range(2)]
+
+        for d in pending:
+            limits.call('plugin', lambda d=d: d)
+
+        results = self.results(limits.call('plugin', defer.Deferred))
+        assert results[0].check(PluginBusyError)
+
+        # other plugins have their own limit
+        assert self.results(limits.call('other', defer.Deferred)) == []
+
+        pending[0].callback(None)
+        assert self.results(limits.call('plugin', lambda: 'ok')) == ['ok']
+
+    def test_errors_passed_on(self):
+        limits = self.make_limits(timeout=5)
+        pending = defer.Deferred()
+
+        results = self.results(limits.call('plugin', lambda: pending))
+        pending.errback(ValueError('boom'))
+        assert results[0].check(ValueError)
+        assert limits.in_flight == {}
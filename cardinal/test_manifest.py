@@ -0,0 +1,89 @@
+import os
+
+from cardinal.manifest import read_manifest
+
+from .unittest_util import tempdir
+
+DIR_PATH = os.path.dirname(os.path.realpath(__file__))
+FAKE_PLUGINS_PATH = os.path.join(DIR_PATH, 'fixtures', 'fake_plugins')
+
+
+def write_plugin(directory, source):
+    filename = os.path.join(directory, 'plugin.py')
+    with open(filename, 'w') as f:
+        f.write(source)
+    return filename
+
+
+def test_read_manifest():
+    manifest = read_manifest(
+        os.path.join(FAKE_PLUGINS_PATH, 'commands', 'plugin.py'))
+
+    assert manifest == {
+        'commands': [
+            {'method': 'command1', 'commands': ['command1', 'command1_alias']},
+            {'method': 'command2', 'commands': ['command2']},
+            {'method': 'regex_command', 'regex': '^regex'},
+        ],
+        'callbacks': [],
+    }
+
+
+def test_read_manifest_events_and_help():
+    with tempdir('cardinal_manifest') as directory:
+        filename = write_plugin(directory, """
+from cardinal import decorators
+from cardinal.decorators import command, event, help
+
+
+class Plugin:
+    @command('hello', blocking=True)
+    @help("Says hello.")
+    @decorators.help(["Syntax: .hello", "Really."])
+    def hello(self, cardinal, user, channel, msg):
+        pass
+
+    @event(['irc.join', 'irc.part'])
+    def on_join_or_part(self, cardinal, *args):
+        pass
+
+    def not_a_command(self):
+        pass
+""")
+
+        assert read_manifest(filename) == {
+            'commands': [{
+                'method': 'hello',
+                'commands': ['hello'],
+                'help': ["Says hello.", "Syntax: .hello", "Really."],
+                'blocking': True,
+            }],
+            'callbacks': [{
+                'method': 'on_join_or_part',
+                'event_names': ['irc.join', 'irc.part'],
+            }],
+        }
+
+
+def test_read_manifest_non_literal():
+    with tempdir('cardinal_manifest') as directory:
+        filename = write_plugin(directory, """
+import re
+from cardinal.decorators import regex
+
+EXPRESSION = re.compile('^foo')
+
+
+class Plugin:
+    @regex(EXPRESSION)
+    def foo(self, cardinal, user, channel, msg):
+        pass
+""")
+
+        assert read_manifest(filename) is None
+
+
+def test_read_manifest_invalid():
+    with tempdir('cardinal_manifest') as directory:
+        assert read_manifest(os.path.join(directory, 'plugin.py')) is None
+        assert read_manifest(write_plugin(directory, "def (")) is None
@@ -0,0 +1,93 @@
+import pytest
+from mock import Mock
+from twisted.web.test.requesthelper import DummyRequest
+
+from cardinal import metrics
+
+
+class TestMetrics:
+    def setup_method(self):
+        self.registry = metrics.Registry()
+
+    def test_counter(self):
+        counter = self.registry.counter('test_total', "Things counted.",
+                                        ['kind'])
+        counter.inc('a')
+        counter.inc('a')
+        counter.inc('b', amount=5)
+
+        assert counter.get('a') == 2
+        assert self.registry.render() == (
+            '# HELP test_total Things counted.\n'
+            '# TYPE test_total counter\n'
+            'test_total{kind="a"} 2.0\n'
+            'test_total{kind="b"} 5.0\n'
+        )
+
+    def test_wrong_labels(self):
+        counter = self.registry.counter('test_total', "Things.", ['kind'])
+        with pytest.raises(ValueError):
+            counter.inc()
+
+    def test_label_values_escaped(self):
+        counter = self.registry.counter('test_total', "Things.", ['kind'])
+        counter.inc('say "hi"\\\n')
+
+        assert 'test_total{kind="say \\"hi\\"\\\\\\n"} 1.0' in \
+            self.registry.render()
+
+    def test_gauge_function(self):
+        gauge = self.registry.gauge('test_queue', "Queued things.")
+        gauge.set_function(lambda: 3)
+        assert 'test_queue 3.0\n' in self.registry.render()
+
+        # a broken function doesn't break the rest
+        gauge.set_function(Mock(side_effect=Exception))
+        assert self.registry.render() == (
+            '# HELP test_queue Queued things.\n'
+            '# TYPE test_queue gauge\n'
+        )
+
+    def test_histogram(self):
+        histogram = self.registry.histogram(
+            'test_seconds', "Durations.", ['kind'], buckets=(0.1, 1.0))
+        histogram.observe(0.05, 'a')
+        histogram.observe(0.1, 'a')
+        histogram.observe(5, 'a')
+
+        assert histogram.get('a')['count'] == 3
+        assert self.registry.render() == (
+            '# HELP test_seconds Durations.\n'
+            '# TYPE test_seconds histogram\n'
+            'test_seconds_bucket{kind="a",le="0.1"} 2.0\n'
+            'test_seconds_bucket{kind="a",le="1.0"} 2.0\n'
+            'test_seconds_bucket{kind="a",le="+Inf"} 3.0\n'
+            'test_seconds_sum{kind="a"} 5.15\n'
+            'test_seconds_count{kind="a"} 3.0\n'
+        )
+
+    def test_resource(self):
+        self.registry.counter('test_total', "Things.").inc()
+
+        request = DummyRequest([b'metrics'])
+        body = metrics.MetricsResource(self.registry).render_GET(request)
+
+        assert body == self.registry.render().encode('utf-8')
+        assert request.responseHeaders.getRawHeaders(b'content-type') == \
+            [b'text/plain; version=0.0.4; charset=utf-8']
+
+    def test_listen(self):
+        reactor = Mock()
+        health = Mock()
+        port = metrics.listen(9100, '127.0.0.1', self.registry,
+                              resources={b'healthz': health},
+                              _reactor=reactor)
+
+        assert port is reactor.listenTCP.return_value
+        (port, site), kwargs = reactor.listenTCP.call_args
+        assert port == 9100
+        assert kwargs == {'interface': '127.0.0.1'}
+
+        root = site.resource
+        assert root.children[b'metrics'].registry is self.registry
+        assert root.children[b'healthz'] is health
@@ -1,15 +1,21 @@
+import importlib
 import inspect
+import linecache
 import logging
 import os
 import sys
+import time
 
 import pytest
-from twisted.internet.task import defer
+from twisted.internet.task import Clock, defer
 from mock import Mock, patch
 
-from cardinal import exceptions
+from cardinal import exceptions, metrics
 from cardinal.bot import CardinalBot
+from cardinal import decorators
 from cardinal.plugins import EventManager, PluginManager
+from cardinal.limits import CallLimits
+from cardinal.pool import BlockingPool
 
 from .unittest_util import tempdir
 
@@ -178,6 +184,53 @@ class TestPluginManager:
         # invalid json should be ignored
         assert self.plugin_manager.plugins[name]['config'] is None
 
+    @patch('cardinal.plugins.threads.deferToThread')
+    def test_load_async_prepares_in_threads(self, defer_to_thread):
+        pending = []
+
+        def deferToThread(f, *args):
+            d = defer.Deferred()
+            pending.append((d, f, args))
+            return d
+        defer_to_thread.side_effect = deferToThread
+
+        plugins = ['setup_one_argument', 'setup_two_arguments', 'valid']
+        d = self.plugin_manager.load_async(plugins + ['nonexistent'])
+
+        # every plugin is prepared at once
+        assert [f for _, f, _ in pending] == \
+            [self.plugin_manager._prepare_plugin] * 4
+        assert [args for _, _, args in pending] == \
+            [(plugin,) for plugin in plugins + ['nonexistent']]
+        assert not d.called
+
+        # plugins are activated in order, regardless of which is ready first
+        for deferred, f, args in reversed(pending[1:]):
+            try:
+                deferred.callback(f(*args))
+            except Exception:
+                deferred.errback()
+        assert self.plugin_manager.plugins == {}
+
+        deferred, f, args = pending[0]
+        deferred.callback(f(*args))
+        assert d.called
+        assert d.result == ['nonexistent']
+        assert list(self.plugin_manager.plugins.keys()) == plugins
+        assert self.plugin_manager.plugins['setup_two_arguments'][
+            'instance'].config == {'test': True}
+
+    @patch('cardinal.plugins.threads.deferToThread')
+    def test_load_async_activation_failed(self, defer_to_thread):
+        defer_to_thread.side_effect = \
+            lambda f, *args: defer.maybeDeferred(f, *args)
+
+        d = self.plugin_manager.load_async(
+            ['setup_too_many_arguments', 'valid'])
+
+        assert d.result == ['setup_too_many_arguments']
+        assert list(self.plugin_manager.plugins.keys()) == ['valid']
+
     def test_get_config_unloaded_plugin(self):
         name = 'nonexistent_plugin'
         with pytest.raises(exceptions.ConfigNotFoundError):
@@ -332,6 +385,62 @@ def setup():
             finally:
                 sys.path.pop(0)
 
+    def test_reload_picks_up_helper_modules(self):
+        with tempdir('cardinal_helper_fixtures') as fixture_dir:
+            plugins_dir = os.path.join(fixture_dir, 'helper_plugins')
+            plugin_dir = os.path.join(plugins_dir, 'helper')
+            os.makedirs(plugin_dir)
+            for path in (plugins_dir, plugin_dir):
+                with open(os.path.join(path, '__init__.py'), 'w') as f:
+                    pass
+            with open(os.path.join(plugin_dir, 'plugin.py'), 'w') as f:
+                f.write("""
+from .values import VALUE
+
+
+class TestHelperPlugin:
+    value = VALUE
+
+
+entrypoint = TestHelperPlugin
+""")
+            with open(os.path.join(plugin_dir, 'values.py'), 'w') as f:
+                f.write("from .constants import ONE\nVALUE = ONE\n")
+            with open(os.path.join(plugin_dir, 'constants.py'), 'w') as f:
+                f.write("ONE = 1\n")
+            with open(os.path.join(plugin_dir, 'test_plugin.py'), 'w') as f:
+                f.write("")
+
+            sys.path.insert(0, fixture_dir)
+            try:
+                plugin_manager = PluginManager(
+                    self.cardinal,
+                    ['helper'],
+                    self.blacklist,
+                    _plugin_module_import_prefix='helper_plugins',
+                    _plugin_module_directory=plugins_dir)
+                assert plugin_manager.plugins['helper']['instance'].value == 1
+                importlib.import_module('helper_plugins.helper.test_plugin')
+
+                # lines cached for other files are kept on reload
+                linecache.getline(__file__, 1)
+
+                # helpers of helpers too
+                with open(os.path.join(plugin_dir, 'constants.py'), 'w') as f:
+                    f.write("ONE = 2  # changed\n")
+                # modules the plugin doesn't import aren't reloaded
+                with open(os.path.join(plugin_dir, 'test_plugin.py'),
+                          'w') as f:
+                    f.write("raise Exception('reloaded')\n")
+                assert plugin_manager.load('helper') == []
+                assert plugin_manager.plugins['helper']['instance'].value == 2
+                assert __file__ in linecache.cache
+            finally:
+                sys.path.pop(0)
+                for name in list(sys.modules.keys()):
+                    if name.startswith('helper_plugins'):
+                        del sys.modules[name]
+
     @pytest.mark.parametrize("plugins", [
         12345,
         0.0,
@@ -411,6 +520,20 @@ def setup():
         # Our close() method will set module.called to True if called
         assert instance.called is False
 
+    def test_check_health(self):
+        self.assert_load_success(['valid', 'health_check'])
+        instance = self.plugin_manager.plugins['health_check']['instance']
+
+        assert self.plugin_manager.check_health() == []
+
+        instance.problem = "stream died"
+        assert self.plugin_manager.check_health() == [
+            "health_check: stream died"]
+
+        instance.problem = 'raise'
+        assert self.plugin_manager.check_health() == [
+            "health_check: health check failed"]
+
     def test_unload_all(self):
         self.assert_load_success([
             'valid',
@@ -454,6 +577,49 @@ def setup():
         self.event_manager.fire(event, message)
         assert instance.messages == [message, message]
 
+    def test_rebind_keeps_plugins(self):
+        name = 'event_callback'
+        self.assert_load_success(name, assert_callbacks_is_empty=False)
+        instance = self.plugin_manager.plugins[name]['instance']
+        callback_ids = self.plugin_manager.plugins[name]['callback_ids']
+
+        # a reconnect builds a new CardinalBot sharing the EventManager
+        new_cardinal = Mock(spec=CardinalBot)
+        new_cardinal.event_manager = self.event_manager
+        self.event_manager.cardinal = new_cardinal
+
+        self.plugin_manager.rebind(new_cardinal)
+
+        assert self.plugin_manager.cardinal is new_cardinal
+        assert self.plugin_manager.plugins[name]['instance'] is instance
+        assert self.plugin_manager.plugins[name]['callback_ids'] == \
+            callback_ids
+
+        self.event_manager.register('irc.raw', 1)
+        self.event_manager.fire('irc.raw', 'message')
+        assert instance.messages == ['message']
+        assert instance.cardinal is new_cardinal
+
+    @patch('cardinal.plugins.threads.deferToThread')
+    def test_preload(self, defer_to_thread):
+        defer_to_thread.side_effect = \
+            lambda f, *args: defer.maybeDeferred(f, *args)
+
+        self.plugin_manager.preload(['valid', 'nonexistent'])
+        self.plugin_manager.preload(['valid'])
+        assert defer_to_thread.call_count == 2
+        assert self.plugin_manager.plugins == {}
+
+        # loading uses what was preloaded rather than importing again
+        d = self.plugin_manager.load_async(['valid', 'nonexistent'])
+        assert defer_to_thread.call_count == 2
+        assert d.result == ['nonexistent']
+        assert list(self.plugin_manager.plugins.keys()) == ['valid']
+
+        # later loads import again, e.g. to pick up changes
+        self.plugin_manager.load_async(['valid'])
+        assert defer_to_thread.call_count == 3
+
     def test_event_callback_unregistered(self):
         name = 'event_callback'
         event = 'irc.raw'
@@ -526,6 +692,27 @@ def setup():
 
         assert commands == []
 
+    @defer.inlineCallbacks
+    def test_blocking_command_called_in_pool(self):
+        name = 'blocking_command'
+        self.assert_load_success(name, assert_commands_is_empty=False)
+        instance = self.plugin_manager.plugins[name]['instance']
+
+        blocking_pool = self.plugin_manager.blocking_pool = \
+            Mock(spec=BlockingPool)
+        blocking_pool.run.return_value = defer.succeed(None)
+
+        user = ('user', 'ident', 'vhost')
+        yield self.plugin_manager.call_command(user, '#channel', '.slow')
+        blocking_pool.run.assert_called_once_with(
+            name, instance.slow, self.cardinal, user, '#channel', '.slow')
+        assert instance.calls == []
+
+        # other commands still run on the reactor thread
+        yield self.plugin_manager.call_command(user, '#channel', '.fast')
+        assert blocking_pool.run.call_count == 1
+        assert instance.calls == [(self.cardinal, user, '#channel', '.fast')]
+
     @defer.inlineCallbacks
     def test_call_command_no_regex_match(self):
         yield self.plugin_manager.call_command(('nick', 'ident', 'host'),
@@ -610,6 +797,172 @@ def setup():
         assert instance.command1_calls == []
         assert instance.command2_calls == []
 
+    def test_command_timeout(self):
+        name = 'commands'
+        self.assert_load_success(name, assert_commands_is_empty=False)
+        cancelled = []
+        pending = defer.Deferred(cancelled.append)
+
+        @decorators.command('command1')
+        def command1(*args):
+            return pending
+        self.plugin_manager.plugins[name]['commands'][0] = command1
+
+        self.plugin_manager.limits = CallLimits(timeout=5)
+        self.plugin_manager.limits._reactor = clock = Clock()
+
+        d = self.plugin_manager.call_command(('user', 'ident', 'vhost'),
+                                             '#channel', '.command1')
+        assert self.plugin_manager.limits.in_flight == {name: 1}
+
+        clock.advance(5)
+        assert cancelled == [pending]
+        assert d.called
+        assert self.plugin_manager.limits.in_flight == {}
+
+    @defer.inlineCallbacks
+    def test_command_seconds_observed(self):
+        name = 'commands'
+        self.assert_load_success(name, assert_commands_is_empty=False)
+
+        @decorators.command('command1')
+        def slow_command(*args):
+            time.sleep(0.05)
+        self.plugin_manager.plugins[name]['commands'][0] = slow_command
+
+        yield self.plugin_manager.call_command(('user', 'ident', 'vhost'),
+                                               '#channel', '.command1')
+
+        observed = metrics.COMMAND_SECONDS.get(name, 'slow_command')
+        assert observed['count'] == 1
+        assert observed['sum'] >= 0.05
+
+    def test_plugin_callbacks_registered_with_plugin(self):
+        name = 'event_callback'
+        self.assert_load_success(name, assert_callbacks_is_empty=False)
+
+        # the limits are the factory's to hand the EventManager
+        assert self.event_manager.limits is None
+        callback_id = \
+            self.plugin_manager.plugins[name]['callback_ids']['irc.raw'][0]
+        assert self.event_manager.callback_plugins['irc.raw'] == \
+            {callback_id: name}
+
+    def make_lazy_plugin_manager(self):
+        return PluginManager(
+            self.cardinal,
+            [],
+            self.blacklist,
+            lazy=True,
+            _plugin_module_import_prefix='fake_plugins',
+            _plugin_module_directory=self.plugin_manager.plugins_directory,
+        )
+
+    @defer.inlineCallbacks
+    def test_lazy_plugin_activated_by_command(self):
+        name = 'commands'
+        plugin_manager = self.make_lazy_plugin_manager()
+
+        with patch.object(plugin_manager, '_prepare_plugin',
+                          wraps=plugin_manager._prepare_plugin) as prepare:
+            assert plugin_manager.load(name) == []
+            assert not prepare.called
+
+            # commands are known without importing the plugin
+            assert plugin_manager.plugins[name]['instance'] is None
+            commands = plugin_manager.plugins[name]['commands']
+            assert [command.__name__ for command in commands] == \
+                ['command1', 'command2', 'regex_command']
+            assert commands[0].commands == ['command1', 'command1_alias']
+            assert commands[2].regex == '^regex'
+
+            plugin_manager.blacklist(name, '#blacklisted')
+
+            user = ('user', 'ident', 'vhost')
+            message = '.command2 foobar'
+            yield plugin_manager.call_command(user, '#channel', message)
+            prepare.assert_called_once_with(name)
+
+            instance = plugin_manager.plugins[name]['instance']
+            assert instance.command2_calls == \
+                [(self.cardinal, user, '#channel', message)]
+            assert plugin_manager.plugins[name]['blacklist'] == \
+                ['#blacklisted']
+
+            # later calls go straight to the plugin
+            yield plugin_manager.call_command(user, '#channel', message)
+            assert prepare.call_count == 1
+            assert len(instance.command2_calls) == 2
+
+    def test_lazy_plugin_activated_by_event(self):
+        name = 'event_callback'
+        plugin_manager = self.make_lazy_plugin_manager()
+        self.event_manager.register('irc.raw', 1)
+
+        assert plugin_manager.load(name) == []
+        assert plugin_manager.plugins[name]['instance'] is None
+
+        self.event_manager.fire('irc.raw', 'message')
+        instance = plugin_manager.plugins[name]['instance']
+        assert instance.messages == ['message']
+        assert len(self.event_manager.registered_callbacks['irc.raw']) == 1
+
+        self.event_manager.fire('irc.raw', 'message')
+        assert instance.messages == ['message', 'message']
+
+    @defer.inlineCallbacks
+    def test_lazy_plugin_blocking_command_called_in_pool(self):
+        name = 'blocking_command'
+        plugin_manager = self.make_lazy_plugin_manager()
+        blocking_pool = plugin_manager.blocking_pool = \
+            Mock(spec=BlockingPool)
+        blocking_pool.run.return_value = defer.succeed(None)
+
+        assert plugin_manager.load(name) == []
+
+        # the plugin is activated on the reactor thread, the command isn't
+        user = ('user', 'ident', 'vhost')
+        yield plugin_manager.call_command(user, '#channel', '.slow')
+        instance = plugin_manager.plugins[name]['instance']
+        blocking_pool.run.assert_called_once_with(
+            name, instance.slow, self.cardinal, user, '#channel', '.slow')
+
+    def test_lazy_plugin_blocking_command_timeout(self):
+        name = 'blocking_command'
+        plugin_manager = self.make_lazy_plugin_manager()
+        plugin_manager.limits = CallLimits(timeout=5)
+        plugin_manager.limits._reactor = clock = Clock()
+        blocking_pool = plugin_manager.blocking_pool = \
+            Mock(spec=BlockingPool)
+        cancelled = []
+        running = blocking_pool.run.return_value = \
+            defer.Deferred(cancelled.append)
+
+        assert plugin_manager.load(name) == []
+
+        user = ('user', 'ident', 'vhost')
+        results = []
+        plugin_manager.call_command(user, '#channel', '.slow') \
+            .addBoth(results.append)
+        instance = plugin_manager.plugins[name]['instance']
+        blocking_pool.run.assert_called_once_with(
+            name, instance.slow, self.cardinal, user, '#channel', '.slow')
+
+        # the caller gives up, but the thread keeps its slot until it returns
+        clock.advance(5)
+        assert len(results) == 1
+        assert cancelled == []
+        assert plugin_manager.limits.in_flight == {name: 1}
+
+        running.callback(None)
+        assert plugin_manager.limits.in_flight == {}
+
+    def test_lazy_plugin_without_triggers_loaded(self):
+        plugin_manager = self.make_lazy_plugin_manager()
+
+        self.assert_load_success('valid', plugin_manager=plugin_manager)
+        assert plugin_manager.plugins['valid']['instance'] is not None
+
     @defer.inlineCallbacks
     def test_command_raises_exception_caught(self):
         name = 'command_raises_exception'
@@ -925,6 +1278,28 @@ class TestEventManager:
 
         self.event_manager.register_callback(name, callback)
 
+    def test_register_callback_caches_signature(self):
+        name = 'test_event'
+        self.event_manager.register(name, 1)
+
+        class Plugin:
+            def callback(self, cardinal, message):
+                pass
+
+        with patch.object(inspect, 'signature',
+                          wraps=inspect.signature) as signature:
+            self.assert_register_callback_success(name, Plugin().callback)
+            self.assert_register_callback_success(name, Plugin().callback)
+
+            # bound methods of the same function are only inspected once
+            assert signature.call_count == 1
+
+        # a cached signature is still checked against each event
+        self.event_manager.register('other_event', 2)
+        with pytest.raises(exceptions.EventCallbackError):
+            self.event_manager.register_callback('other_event',
+                                                 Plugin().callback)
+
     def test_remove_callback(self):
         name = 'test_event'
 
@@ -972,6 +1347,39 @@ class TestEventManager:
         assert accepted is True
         assert args == [self.cardinal]
 
+    def test_fire_plugin_callback_limited(self):
+        name = 'test_event'
+        self.assert_register_success(name)
+
+        cancelled = []
+        pending = defer.Deferred(cancelled.append)
+
+        # only callbacks belonging to a plugin are limited
+        self.event_manager.register_callback(
+            name, lambda cardinal: pending, 'plugin')
+        self.event_manager.limits = CallLimits(timeout=5)
+        self.event_manager.limits._reactor = clock = Clock()
+
+        results = []
+        self.event_manager.fire(name).addCallback(results.append)
+        assert results == []
+
+        clock.advance(5)
+        assert cancelled == [pending]
+        assert results == [False]
+
+    def test_remove_callback_forgets_plugin(self):
+        name = 'test_event'
+        self.assert_register_success(name)
+
+        callback_id = self.event_manager.register_callback(
+            name, self._callback, 'plugin')
+        assert self.event_manager.callback_plugins[name] == \
+            {callback_id: 'plugin'}
+
+        self.event_manager.remove_callback(name, callback_id)
+        assert self.event_manager.callback_plugins[name] == {}
+
     @defer.inlineCallbacks
     def test_fire_callback_rejects(self):
         args = []
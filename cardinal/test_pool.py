@@ -0,0 +1,203 @@
+import threading
+
+from mock import Mock, patch
+from twisted.internet import defer, error
+from twisted.internet.task import Clock
+from twisted.python.failure import Failure
+
+from cardinal.limits import CallLimits
+from cardinal.pool import BlockingPool, ReactorProxy
+
+
+class FakeThreadPool:
+    """Runs calls when told to, instead of in threads."""
+
+    def __init__(self):
+        self.calls = []
+
+    def callInThreadWithCallback(self, on_result, f, *args, **kwargs):
+        self.calls.append((on_result, f, args, kwargs))
+
+    def run_next(self):
+        on_result, f, args, kwargs = self.calls.pop(0)
+        try:
+            result = f(*args, **kwargs)
+        except Exception:
+            on_result(False, Failure())
+        else:
+            on_result(True, result)
+
+    def stop(self):
+        pass
+
+
+class FakeReactor:
+    def callFromThread(self, f, *args, **kwargs):
+        f(*args, **kwargs)
+
+
+class TestBlockingPool:
+    def setup_method(self):
+        self.pool = BlockingPool(max_threads=4, per_plugin=2)
+        self.pool._reactor = FakeReactor()
+        self.thread_pool = self.pool._pool = FakeThreadPool()
+        self.cardinal = Mock()
+
+    def test_runs_in_thread_pool(self):
+        handler = Mock(return_value='result')
+        d = self.pool.run('plugin', handler, self.cardinal, 'arg')
+
+        assert not handler.called
+        self.thread_pool.run_next()
+
+        proxy, arg = handler.call_args[0]
+        assert isinstance(proxy, ReactorProxy)
+        assert arg == 'arg'
+
+        results = []
+        d.addCallback(results.append)
+        assert results == ['result']
+
+    def test_per_plugin_limit(self):
+        for _ in range(3):
+            self.pool.run('slow', Mock(), self.cardinal)
+        self.pool.run('fast', Mock(), self.cardinal)
+
+        # the third call of the slow plugin waits for one to finish, the
+        # other plugin doesn't
+        assert len(self.thread_pool.calls) == 3
+        assert self.pool.stats['slow']['pending'] == 3
+
+        self.thread_pool.run_next()
+        assert len(self.thread_pool.calls) == 3
+
+        while self.thread_pool.calls:
+            self.thread_pool.run_next()
+        assert self.pool.stats['slow']['pending'] == 0
+        assert self.pool.stats['slow']['calls'] == 3
+        assert self.pool.stats['fast']['calls'] == 1
+
+    def test_cancelled_call_keeps_slot(self):
+        hung = [self.pool.run('slow', Mock(), self.cardinal)
+                for _ in range(2)]
+        queued = self.pool.run('slow', Mock(), self.cardinal)
+
+        failures = []
+        for d in hung:
+            d.addErrback(failures.append)
+            d.cancel()
+        assert [f.check(defer.CancelledError) for f in failures] == \
+            [defer.CancelledError] * 2
+
+        # the threads are still running, so the third call waits
+        assert len(self.thread_pool.calls) == 2
+        assert self.pool.stats['slow']['pending'] == 3
+
+        self.thread_pool.run_next()
+        assert len(self.thread_pool.calls) == 2
+
+        while self.thread_pool.calls:
+            self.thread_pool.run_next()
+        assert queued.called
+        assert self.pool.stats['slow']['pending'] == 0
+
+    def test_cancelled_while_queued(self):
+        for _ in range(2):
+            self.pool.run('slow', Mock(), self.cardinal)
+        handler = Mock()
+        d = self.pool.run('slow', handler, self.cardinal)
+
+        failures = []
+        d.addErrback(failures.append)
+        d.cancel()
+        assert failures[0].check(defer.CancelledError)
+        assert self.pool.stats['slow']['pending'] == 2
+
+        # it never runs
+        while self.thread_pool.calls:
+            self.thread_pool.run_next()
+        assert not handler.called
+
+    def test_timed_out_calls_keep_their_slots(self):
+        clock = Clock()
+        clock.callFromThread = lambda f, *args, **kwargs: f(*args, **kwargs)
+        self.pool._reactor = clock
+        limits = CallLimits(timeout=5)
+        limits._reactor = clock
+
+        hung = Mock()
+        for _ in range(5):
+            results = []
+            limits.call('hung', self.pool.run, 'hung', hung, self.cardinal,
+                        cancel=False).addBoth(results.append)
+            clock.advance(5)
+            assert results[0].check(error.TimeoutError)
+
+        # only the plugin's own two threads are taken, the rest wait in line
+        assert len(self.thread_pool.calls) == 2
+        assert limits.in_flight == {'hung': 5}
+        self.pool.run('other', Mock(), self.cardinal)
+        assert len(self.thread_pool.calls) == 3
+
+        while self.thread_pool.calls:
+            self.thread_pool.run_next()
+        assert hung.call_count == 5
+        assert limits.in_flight == {}
+        assert self.pool.stats['hung']['pending'] == 0
+
+    def test_errors_passed_on(self):
+        d = self.pool.run('plugin', Mock(side_effect=ValueError('boom')),
+                          self.cardinal)
+        self.thread_pool.run_next()
+
+        failures = []
+        d.addErrback(failures.append)
+        assert failures[0].check(ValueError)
+        assert self.pool.stats['plugin']['pending'] == 0
+
+    @patch('cardinal.pool.time.monotonic')
+    def test_queue_time(self, monotonic):
+        monotonic.return_value = 100.0
+        self.pool.run('plugin', Mock(), self.cardinal)
+        self.pool.run('plugin', Mock(), self.cardinal)
+
+        monotonic.return_value = 101.5
+        self.thread_pool.run_next()
+        monotonic.return_value = 102.0
+        self.thread_pool.run_next()
+
+        stats = self.pool.stats['plugin']
+        assert stats['queue_time'] == 3.5
+        assert stats['max_queue_time'] == 2.0
+
+    def test_pool_started_when_needed(self):
+        pool = BlockingPool(max_threads=3)
+        pool._reactor = Mock()
+
+        d = pool.run('plugin', lambda cardinal: threading.current_thread(),
+                     self.cardinal)
+        try:
+            assert pool._pool.max == 3
+            pool._reactor.addSystemEventTrigger.assert_called_once_with(
+                'during', 'shutdown', pool.stop)
+        finally:
+            pool.stop()
+        assert pool._pool is None
+        assert isinstance(d, defer.Deferred)
+
+
+def test_reactor_proxy():
+    target = Mock()
+    target.nickname = 'Cardinal'
+    target.sendMsg.return_value = 'sent'
+    reactor = Mock()
+
+    proxy = ReactorProxy(target, reactor)
+    assert proxy.nickname == 'Cardinal'
+
+    with patch('cardinal.pool.threads.blockingCallFromThread') as call:
+        call.return_value = 'sent'
+        assert proxy.sendMsg('#channel', 'hi') == 'sent'
+        call.assert_called_once_with(reactor, target.sendMsg,
+                                     '#channel', 'hi')
+    assert not target.sendMsg.called
@@ -0,0 +1,109 @@
+import json
+import os
+
+from mock import patch
+from twisted.internet import defer
+
+from cardinal.exceptions import EventRejectedMessage
+from cardinal.limits import CallLimits
+from cardinal.profiling import Profiler, percentile
+
+from .unittest_util import tempdir
+
+
+def test_percentile():
+    assert percentile([], 0.5) is None
+    assert percentile([3, 1, 2], 0.5) == 2
+    assert percentile(range(100), 0.99) == 99
+    assert percentile(range(1000), 0.99) == 990
+
+
+class TestProfiler:
+    def setup_method(self):
+        self.profiler = Profiler()
+
+    @patch('cardinal.profiling.time.perf_counter')
+    def test_records_calls(self, perf_counter):
+        pending = defer.Deferred()
+
+        def handler():
+            # spends a second on the reactor thread, then waits
+            perf_counter.return_value = 11.0
+            return pending
+
+        perf_counter.return_value = 10.0
+        self.profiler.call('plugin', 'handler', handler)
+        perf_counter.return_value = 14.0
+        pending.callback(None)
+
+        stats = self.profiler.dump()['plugin']['handler']
+        assert stats == {
+            'calls': 1,
+            'errors': 0,
+            'total_time': 4.0,
+            'p50': 4.0,
+            'p99': 4.0,
+            'blocking_time': 1.0,
+            'max_blocking_time': 1.0,
+        }
+
+    def test_counts_errors(self):
+        def fail():
+            raise ValueError()
+
+        def reject():
+            raise EventRejectedMessage()
+
+        for f in (fail, reject, lambda: None):
+            self.profiler.call('plugin', 'handler', f).addErrback(
+                lambda failure: None)
+
+        stats = self.profiler.dump()['plugin']['handler']
+        assert stats['calls'] == 3
+        assert stats['errors'] == 1
+
+    def test_passes_results_on(self):
+        results = []
+        self.profiler.call('plugin', 'handler', lambda x: x * 2, 2) \
+            .addCallback(results.append)
+        assert results == [4]
+
+    def test_top_and_filter(self):
+        for plugin, handler, time_ in (('a', 'slow', 3.0),
+                                       ('a', 'fast', 1.0),
+                                       ('b', 'medium', 2.0)):
+            self.profiler.call(plugin, handler, lambda: None)
+            self.profiler.stats[plugin][handler].total_time = time_
+
+        assert [(plugin, handler) for plugin, handler, _ in
+                self.profiler.top(limit=2)] == [('a', 'slow'), ('b', 'medium')]
+        assert [handler for _, handler, _ in
+                self.profiler.top(plugin='a')] == ['slow', 'fast']
+        assert list(self.profiler.dump('b').keys()) == ['b']
+
+        self.profiler.reset()
+        assert self.profiler.dump() == {}
+
+    def test_top_skips_running(self):
+        d = defer.Deferred()
+        self.profiler.call('plugin', 'running', lambda: d)
+        assert self.profiler.top() == []
+
+        d.callback(None)
+        assert [handler for _, handler, _ in self.profiler.top()] == \
+            ['running']
+
+    def test_write(self):
+        self.profiler.call('plugin', 'handler', lambda: None)
+
+        with tempdir('cardinal_profiling') as directory:
+            path = os.path.join(directory, 'profile.json')
+            self.profiler.write(path)
+            with open(path) as f:
+                assert json.load(f) == self.profiler.dump()
+
+    def test_used_by_limits(self):
+        limits = CallLimits(profiler=self.profiler)
+        limits.call('plugin', lambda: None, name='handler')
+
+        assert self.profiler.dump()['plugin']['handler']['calls'] == 1
@@ -0,0 +1,131 @@
+from mock import Mock
+from twisted.internet import error
+from twisted.internet.task import Clock
+
+from cardinal.servers import ConnectionRace, Server, ServerList
+
+
+class FakeConnector:
+    def __init__(self, host, port, factory):
+        self.host = host
+        self.port = port
+        self.factory = factory
+        self.state = 'connecting'
+
+    def succeed(self):
+        self.state = 'connected'
+        return self.factory.buildProtocol(None)
+
+    def fail(self, reason='refused'):
+        self.state = 'disconnected'
+        self.factory.clientConnectionFailed(self, reason)
+
+    def stopConnecting(self):
+        self.fail(error.UserError())
+
+
+class TestServerList:
+    def test_ordered(self):
+        servers = ServerList([
+            ('irc.untried.test', 6667),
+            ('irc.slow.test', 6667),
+            ('irc.fast.test', 6667),
+            ('irc.failing.test', 6667),
+            ('irc.backup.test', 6667, 1),
+        ])
+        untried, slow, fast, failing, backup = servers
+        slow.connected(2.0)
+        fast.connected(0.1)
+        failing.connected(0.01)
+        failing.failed()
+
+        assert servers.ordered() == [fast, slow, untried, failing, backup]
+        assert len(servers) == 5
+
+    def test_connect_time_remembered(self):
+        server = Server('irc.test', 6667)
+        server.connected(1.0)
+        server.failed()
+        server.connected(2.0)
+
+        assert server.failures == 0
+        assert server.connect_time == 1.0 + Server.SMOOTHING * 1.0
+        assert repr(server) == 'irc.test:6667'
+
+
+class TestConnectionRace:
+    def setup_method(self):
+        self.factory = Mock()
+        self.servers = [Server('irc.%d.test' % i, 6667) for i in range(3)]
+        self.connectors = []
+        self.clock = Clock()
+        self.race = ConnectionRace(self.factory, self.servers, self.connect,
+                                   delay=0.25, _reactor=self.clock)
+
+    def connect(self, host, port, factory):
+        connector = FakeConnector(host, port, factory)
+        self.connectors.append(connector)
+        return connector
+
+    def test_staggered_attempts(self):
+        self.race.start()
+        assert [c.host for c in self.connectors] == ['irc.0.test']
+
+        self.clock.advance(0.25)
+        assert len(self.connectors) == 2
+
+        # the later attempt wins, and the others are stopped
+        protocol = self.connectors[1].succeed()
+        assert protocol is self.factory.buildProtocol.return_value
+        assert self.race.winner.server is self.servers[1]
+        assert self.connectors[0].state == 'disconnected'
+        assert self.servers[1].connect_time is not None
+
+        # and no more are started
+        self.clock.advance(1)
+        assert len(self.connectors) == 2
+        assert not self.factory.clientConnectionFailed.called
+        assert self.servers[0].failures == 0
+
+    def test_late_connection_dropped(self):
+        self.race.start()
+        self.clock.advance(0.25)
+        first, second = self.connectors
+
+        first.succeed()
+        # connected before it could be stopped
+        second.state = 'connecting'
+        assert second.succeed() is None
+        self.factory.buildProtocol.assert_called_once_with(None)
+
+    def test_failure_starts_next_attempt(self):
+        self.race.start()
+        self.connectors[0].fail()
+
+        assert len(self.connectors) == 2
+        assert self.servers[0].failures == 1
+        assert not self.factory.clientConnectionFailed.called
+
+    def test_all_failed(self):
+        self.race.start()
+        self.clock.advance(0.25)
+        self.clock.advance(0.25)
+        assert len(self.connectors) == 3
+
+        for connector in self.connectors[:2]:
+            connector.fail()
+        assert not self.factory.clientConnectionFailed.called
+
+        self.connectors[2].fail('timeout')
+        self.factory.clientConnectionFailed.assert_called_once_with(
+            self.connectors[2], 'timeout')
+        assert [server.failures for server in self.servers] == [1, 1, 1]
+
+    def test_winner_connection_lost(self):
+        self.race.start()
+        connector = self.connectors[0]
+        connector.succeed()
+
+        connector.factory.clientConnectionLost(connector, 'reason')
+        self.factory.clientConnectionLost.assert_called_once_with(
+            connector, 'reason')
@@ -0,0 +1,128 @@
+from mock import Mock
+from twisted.internet import defer
+from twisted.internet.task import Clock
+from twisted.names import dns, error
+
+from cardinal.bot import CardinalBotFactory
+from cardinal.sharding import (
+    HashRing,
+    ReplicaWatcher,
+    Shards,
+    statefulset_ordinal,
+)
+
+
+def test_statefulset_ordinal():
+    assert statefulset_ordinal('cardinal-0') == 0
+    assert statefulset_ordinal('nuh-bot-sts-12') == 12
+    assert statefulset_ordinal('cardinal-2.cardinal.default.svc') == 2
+    assert statefulset_ordinal('cardinal') is None
+    assert statefulset_ordinal('cardinal-abc') is None
+
+
+class TestHashRing:
+    def test_deterministic(self):
+        keys = ['#channel%d' % n for n in range(100)]
+        assert [HashRing(4).shard(key) for key in keys] == \
+            [HashRing(4).shard(key) for key in keys]
+
+    def test_spread(self):
+        ring = HashRing(4)
+        counts = [0] * 4
+        for n in range(1000):
+            counts[ring.shard('#channel%d' % n)] += 1
+
+        assert all(150 < count < 350 for count in counts)
+
+    def test_consistent(self):
+        keys = ['#channel%d' % n for n in range(1000)]
+        before = HashRing(4)
+        after = HashRing(5)
+
+        moved = [key for key in keys if before.shard(key) != after.shard(key)]
+        # only keys moving to the new shard move, about a fifth of them
+        assert all(after.shard(key) == 4 for key in moved)
+        assert 100 < len(moved) < 300
+
+
+class TestShards:
+    def test_channels(self):
+        channels = ['#channel%d' % n for n in range(20)]
+        shards = [Shards(shard, 2) for shard in range(2)]
+
+        first, second = [shard.channels(channels) for shard in shards]
+        assert sorted(first + second) == sorted(channels)
+        assert not set(first) & set(second)
+
+    def test_case_insensitive(self):
+        shards = Shards(0, 2)
+        assert shards.owns('#Channel1') == shards.owns('#channel1')
+
+    def test_single(self):
+        channels = ['#channel%d' % n for n in range(20)]
+        assert Shards(0).channels(channels) == channels
+
+    def test_counts_own_shard(self):
+        shards = Shards(3, 2)
+        assert shards.count == 4
+
+    def test_nickname(self):
+        assert Shards(0, 3).nickname('Cardinal') == 'Cardinal'
+        assert Shards(2, 3).nickname('Cardinal') == 'Cardinal2'
+
+
+def a_record(address):
+    return dns.RRHeader(type=dns.A, payload=dns.Record_A(address))
+
+
+class TestReplicaWatcher:
+    def setup_method(self):
+        self.factory = Mock(spec=CardinalBotFactory)
+        self.lookup = Mock()
+        self.watcher = ReplicaWatcher([self.factory], 'cardinal-svc',
+                                      interval=30, lookup=self.lookup)
+        self.watcher._reactor = Clock()
+
+    def results(self, d):
+        results = []
+        d.addBoth(results.append)
+        return results
+
+    def test_count(self):
+        self.lookup.return_value = defer.succeed((
+            [a_record('10.0.0.1'), a_record('10.0.0.2'),
+             dns.RRHeader(type=dns.CNAME, payload=dns.Record_CNAME(b'x'))],
+            [], []))
+
+        d = self.watcher.count()
+
+        self.lookup.assert_called_once_with('cardinal-svc')
+        assert self.results(d) == [2]
+        self.factory.reshard.assert_called_once_with(2)
+
+    def test_count_none(self):
+        self.lookup.return_value = defer.succeed(([], [], []))
+
+        assert self.results(self.watcher.count()) == [None]
+        assert not self.factory.reshard.called
+
+    def test_count_fails(self):
+        self.lookup.return_value = defer.fail(
+            error.DNSNameError('cardinal-svc'))
+
+        assert self.results(self.watcher.count()) == [None]
+        assert not self.factory.reshard.called
+
+    def test_start_stop(self):
+        self.lookup.return_value = defer.succeed(
+            ([a_record('10.0.0.1')], [], []))
+
+        self.watcher.start()
+        assert self.lookup.call_count == 1
+
+        self.watcher._reactor.advance(30)
+        assert self.lookup.call_count == 2
+
+        self.watcher.stop()
+        self.watcher._reactor.advance(30)
+        assert self.lookup.call_count == 2
@@ -0,0 +1,135 @@
+import datetime
+import os
+
+import pytest
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+from OpenSSL._util import lib
+from twisted.internet import protocol, ssl
+from twisted.protocols.tls import TLSMemoryBIOFactory
+from twisted.test.iosim import connectedServerAndClient
+
+from cardinal.tls import TLSContexts, load_certificates
+from .unittest_util import tempdir
+
+
+def self_signed(hostname):
+    """Returns a key and self-signed certificate for a hostname, as PEM."""
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, hostname)])
+    now = datetime.datetime.utcnow()
+    certificate = x509.CertificateBuilder() \
+        .subject_name(name) \
+        .issuer_name(name) \
+        .public_key(key.public_key()) \
+        .serial_number(x509.random_serial_number()) \
+        .not_valid_before(now - datetime.timedelta(days=1)) \
+        .not_valid_after(now + datetime.timedelta(days=1)) \
+        .add_extension(x509.SubjectAlternativeName([x509.DNSName(hostname)]),
+                       critical=False) \
+        .add_extension(x509.BasicConstraints(ca=True, path_length=None),
+                       critical=True) \
+        .sign(key, hashes.SHA256())
+
+    return (
+        key.private_bytes(serialization.Encoding.PEM,
+                          serialization.PrivateFormat.TraditionalOpenSSL,
+                          serialization.NoEncryption()),
+        certificate.public_bytes(serialization.Encoding.PEM),
+    )
+
+
+def session_reused(client):
+    return bool(lib.SSL_session_reused(client.getHandle()._ssl))
+
+
+class Greeter(protocol.Protocol):
+    def connectionMade(self):
+        self.transport.write(b'hello\r\n')
+
+
+class TestTLSContexts:
+    def setup_method(self):
+        key, self.certificate = self_signed('irc.test')
+        server = ssl.PrivateCertificate.loadPEM(self.certificate + key)
+        self.server_options = ssl.CertificateOptions(
+            privateKey=server.privateKey.original,
+            certificate=server.original,
+            enableSessions=True,
+            enableSessionTickets=True,
+        )
+
+    def connect(self, creator):
+        server_factory = TLSMemoryBIOFactory(
+            self.server_options, False,
+            protocol.Factory.forProtocol(Greeter))
+        client_factory = TLSMemoryBIOFactory(
+            creator, True,
+            protocol.Factory.forProtocol(protocol.Protocol))
+
+        client, server, pump = connectedServerAndClient(
+            lambda: server_factory.buildProtocol(None),
+            lambda: client_factory.buildProtocol(None))
+        pump.flush()
+
+        return client
+
+    def test_load_certificates(self):
+        with tempdir('tls') as directory:
+            path = os.path.join(directory, 'ca.pem')
+            with open(path, 'wb') as f:
+                f.write(self.certificate + self_signed('other.test')[1])
+
+            certificates = load_certificates(path)
+
+        assert [certificate.getSubject().commonName
+                for certificate in certificates] == [b'irc.test',
+                                                     b'other.test']
+
+    def test_creator_is_kept(self):
+        contexts = TLSContexts()
+        assert contexts.creator('irc.test') is contexts.creator('irc.test')
+        assert contexts.creator('irc.test') is not \
+            contexts.creator('other.test')
+
+    @pytest.mark.parametrize("verify", [True, False])
+    def test_resumes_session(self, verify):
+        with tempdir('tls') as directory:
+            path = os.path.join(directory, 'ca.pem')
+            with open(path, 'wb') as f:
+                f.write(self.certificate)
+
+            contexts = TLSContexts(verify=verify, ca_certs=path)
+
+        creator = contexts.creator('irc.test')
+
+        first = self.connect(creator)
+        assert first.getHandle().get_finished() is not None
+        assert not session_reused(first)
+        assert not first.disconnected
+
+        second = self.connect(creator)
+        assert session_reused(second)
+        assert creator.session is not None
+
+    def test_verifies_certificate(self):
+        # the self-signed certificate isn't trusted by the platform
+        client = self.connect(TLSContexts().creator('irc.test'))
+        assert client.disconnected
+
+    def test_verifies_hostname(self):
+        with tempdir('tls') as directory:
+            path = os.path.join(directory, 'ca.pem')
+            with open(path, 'wb') as f:
+                f.write(self.certificate)
+
+            contexts = TLSContexts(ca_certs=path)
+
+        client = self.connect(contexts.creator('irc.other.test'))
+        assert client.disconnected
+
+        # resumed sessions are checked all the same
+        client = self.connect(contexts.creator('irc.other.test'))
+        assert client.disconnected
@@ -16,6 +16,19 @@ def test_is_action(message, expected):
     assert util.is_action(message) == expected
 
 
+@pytest.mark.parametrize('server,expected', (
+    ('irc.example.com', ('irc.example.com', 6667, 0)),
+    ('irc.example.com:6697', ('irc.example.com', 6697, 0)),
+    ('irc.example.com:', ('irc.example.com:', 6667, 0)),
+    ('2001:db8::1', ('2001:db8::1', 6667, 0)),
+    ({'host': 'irc.example.com'}, ('irc.example.com', 6667, 0)),
+    ({'host': 'irc.example.com', 'port': 6697, 'priority': 1},
+     ('irc.example.com', 6697, 1)),
+))
+def test_parse_server(server, expected):
+    assert util.parse_server(server, 6667) == expected
+
+
 @pytest.mark.parametrize('nick,message,expected', (
     ('Cardinal', '\x01ACTION tests\x01', '* Cardinal tests'),
     ('Cardinal', '\x01ACTION tests', '* Cardinal tests'),
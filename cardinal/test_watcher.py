@@ -0,0 +1,118 @@
+import os
+
+from mock import Mock
+from twisted.internet.task import Clock
+
+from cardinal.plugins import PluginManager
+from cardinal.watcher import PluginWatcher
+
+from .unittest_util import tempdir
+
+
+class TestPluginWatcher:
+    def write(self, path, content):
+        with open(path, 'w') as f:
+            f.write(content)
+
+        # Make sure the change is visible even on filesystems with coarse
+        # timestamps
+        st = os.stat(path)
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+
+    def make_plugin(self, plugins_dir, name):
+        plugin_dir = os.path.join(plugins_dir, name)
+        os.mkdir(plugin_dir)
+        self.write(os.path.join(plugin_dir, '__init__.py'), '')
+        self.write(os.path.join(plugin_dir, 'plugin.py'), 'x = 1\n')
+        return plugin_dir
+
+    def make_watcher(self, plugins_dir, plugins):
+        plugin_manager = Mock(spec=PluginManager)
+        plugin_manager.plugins_directory = plugins_dir
+        plugin_manager.plugins = {name: {} for name in plugins}
+        plugin_manager.load.return_value = []
+        return PluginWatcher(plugin_manager), plugin_manager
+
+    def test_reloads_only_changed_plugins(self):
+        with tempdir('cardinal_watcher') as plugins_dir:
+            foo_dir = self.make_plugin(plugins_dir, 'foo')
+            self.make_plugin(plugins_dir, 'bar')
+            watcher, plugin_manager = self.make_watcher(plugins_dir,
+                                                        ['foo', 'bar'])
+
+            # nothing is reloaded when first seen
+            assert watcher.check() == []
+            assert watcher.check() == []
+
+            self.write(os.path.join(foo_dir, 'plugin.py'), 'x = 2\n')
+            assert watcher.check() == ['foo']
+            plugin_manager.load.assert_called_once_with('foo')
+
+            # helper modules and configs count too
+            self.write(os.path.join(foo_dir, 'config.json'), '{}')
+            assert watcher.check() == ['foo']
+
+            # compiled files don't
+            os.mkdir(os.path.join(foo_dir, '__pycache__'))
+            self.write(os.path.join(foo_dir, '__pycache__', 'plugin.py'), '')
+            assert watcher.check() == []
+
+    def test_touched_without_changes_not_reloaded(self):
+        with tempdir('cardinal_watcher') as plugins_dir:
+            foo_dir = self.make_plugin(plugins_dir, 'foo')
+            watcher, plugin_manager = self.make_watcher(plugins_dir, ['foo'])
+
+            watcher.check()
+            self.write(os.path.join(foo_dir, 'plugin.py'), 'x = 1\n')
+            assert watcher.check() == []
+            assert not plugin_manager.load.called
+
+    def test_failed_reload_retried_once_fixed(self):
+        with tempdir('cardinal_watcher') as plugins_dir:
+            foo_dir = self.make_plugin(plugins_dir, 'foo')
+            watcher, plugin_manager = self.make_watcher(plugins_dir, ['foo'])
+            watcher.check()
+
+            # a failed load leaves the plugin unloaded
+            def load(plugin):
+                del plugin_manager.plugins[plugin]
+                return [plugin]
+            plugin_manager.load.side_effect = load
+
+            self.write(os.path.join(foo_dir, 'plugin.py'), 'x = (\n')
+            assert watcher.check() == []
+
+            plugin_manager.load.side_effect = None
+            self.write(os.path.join(foo_dir, 'plugin.py'), 'x = 3\n')
+            assert watcher.check() == ['foo']
+            assert plugin_manager.load.call_count == 2
+
+    def test_unloaded_plugins_forgotten(self):
+        with tempdir('cardinal_watcher') as plugins_dir:
+            foo_dir = self.make_plugin(plugins_dir, 'foo')
+            watcher, plugin_manager = self.make_watcher(plugins_dir, ['foo'])
+            watcher.check()
+
+            del plugin_manager.plugins['foo']
+            self.write(os.path.join(foo_dir, 'plugin.py'), 'x = 2\n')
+            assert watcher.check() == []
+            assert not plugin_manager.load.called
+
+    def test_start_polls_on_interval(self):
+        with tempdir('cardinal_watcher') as plugins_dir:
+            foo_dir = self.make_plugin(plugins_dir, 'foo')
+            watcher, plugin_manager = self.make_watcher(plugins_dir, ['foo'])
+
+            clock = Clock()
+            watcher._reactor = clock
+            watcher.start()
+
+            self.write(os.path.join(foo_dir, 'plugin.py'), 'x = 2\n')
+            assert not plugin_manager.load.called
+            clock.advance(watcher.interval)
+            plugin_manager.load.assert_called_once_with('foo')
+
+            watcher.stop()
+            self.write(os.path.join(foo_dir, 'plugin.py'), 'x = 3\n')
+            clock.advance(watcher.interval)
+            assert plugin_manager.load.call_count == 1
@@ -0,0 +1,304 @@
+import os
+import sys
+
+import pytest
+from mock import Mock
+from twisted.internet import defer
+from twisted.internet.task import Clock
+from twisted.python.failure import Failure
+from twisted.internet.error import ProcessTerminated
+from twisted.internet.testing import StringTransport
+
+from cardinal.bot import CardinalBot, user_info
+from cardinal.exceptions import PluginError
+from cardinal.plugins import EventManager, PluginManager
+from cardinal.worker import (
+    PluginWorker,
+    WorkerCardinal,
+    WorkerServer,
+    decode,
+    encode,
+)
+
+FIXTURE_PATH = os.path.join(
+    os.path.dirname(os.path.realpath(__file__)),
+    'fixtures',
+)
+FAKE_PLUGINS_PATH = os.path.join(FIXTURE_PATH, 'fake_plugins')
+sys.path.insert(0, FIXTURE_PATH)
+
+
+def test_encode_decode_users():
+    user = user_info('nick', 'user', 'vhost')
+    message = decode(encode({'args': (user, '#channel', {'nested': [user]})}))
+
+    assert message == {'args': [user, '#channel', {'nested': [user]}]}
+    assert isinstance(message['args'][0], user_info)
+    assert b'\n' not in encode({'message': 'multiple\nlines'})
+
+
+class FakeProcessTransport(StringTransport):
+    def __init__(self):
+        super().__init__()
+        self.stdin_closed = False
+        self.signals = []
+
+    def closeStdin(self):
+        self.stdin_closed = True
+
+    def signalProcess(self, signal):
+        self.signals.append(signal)
+
+
+class TestPluginWorker:
+    def setup_method(self):
+        self.cardinal = Mock(spec=CardinalBot)
+        self.cardinal.nickname = 'Cardinal'
+        self.cardinal.network = 'irc.test'
+        self.cardinal.storage_path = '/storage'
+
+        self.plugin_manager = Mock(spec=PluginManager)
+        self.plugin_manager.cardinal = self.cardinal
+        self.plugin_manager._plugin_module_import_prefix = 'fake_plugins'
+        self.plugin_manager.plugins_directory = FAKE_PLUGINS_PATH
+
+        self.clock = Clock()
+        self.clock.spawnProcess = Mock(side_effect=self._spawn)
+        self.transports = []
+
+        self.worker = PluginWorker(self.plugin_manager, 'worker')
+        self.worker._reactor = self.clock
+        self.worker.start()
+
+    def _spawn(self, protocol, executable, args, env):
+        transport = FakeProcessTransport()
+        self.transports.append(transport)
+        protocol.makeConnection(transport)
+        return transport
+
+    def reply(self, message):
+        self.worker.outReceived(encode(message) + b'\n')
+
+    def sent(self):
+        return [decode(line) for line in
+                self.transports[-1].value().splitlines()]
+
+    def end(self):
+        self.worker.processEnded(Failure(ProcessTerminated(1)))
+
+    def test_start(self):
+        (_, executable, args), kwargs = self.clock.spawnProcess.call_args
+        assert args[1:] == ['-m', 'cardinal.worker', 'worker',
+                            'fake_plugins', FAKE_PLUGINS_PATH]
+        assert FIXTURE_PATH in kwargs['env']['PYTHONPATH']
+
+    def test_call(self):
+        user = user_info('nick', 'user', 'vhost')
+        d = self.worker.call('echo', user, '#channel', '.echo hi')
+
+        assert self.sent() == [{
+            'id': 1,
+            'call': 'echo',
+            'args': [user, '#channel', '.echo hi'],
+            'state': {
+                'nickname': 'Cardinal',
+                'network': 'irc.test',
+                'storage_path': '/storage',
+            },
+        }]
+        assert not d.called
+
+        # split across reads
+        line = encode({'id': 1, 'result': '.echo hi'}) + b'\n'
+        self.worker.outReceived(line[:5])
+        assert not d.called
+        self.worker.outReceived(line[5:])
+        assert self.successResultOf(d) == '.echo hi'
+
+    def test_call_error(self):
+        d = self.worker.call('fail')
+        self.reply({'id': 1, 'error': 'Failed on purpose'})
+
+        failure = self.failureResultOf(d, PluginError)
+        assert failure.getErrorMessage() == 'Failed on purpose'
+
+    def test_call_cancelled(self):
+        d = self.worker.call('echo')
+        d.cancel()
+
+        self.failureResultOf(d, defer.CancelledError)
+        assert self.worker._pending == {}
+
+        # a late reply is ignored
+        self.reply({'id': 1, 'result': 'too late'})
+
+    def test_forwards_cardinal_methods(self):
+        self.reply({'cardinal': 'sendMsg', 'args': ['#channel', 'hello']})
+        self.cardinal.sendMsg.assert_called_once_with('#channel', 'hello')
+
+        # only methods that are meant to be forwarded
+        self.reply({'cardinal': 'disconnect', 'args': []})
+        assert not self.cardinal.disconnect.called
+
+    def test_forwards_to_current_cardinal(self):
+        self.plugin_manager.cardinal = Mock(spec=CardinalBot)
+        self.reply({'cardinal': 'sendMsg', 'args': ['#channel', 'hello']})
+
+        assert not self.cardinal.sendMsg.called
+        self.plugin_manager.cardinal.sendMsg.assert_called_once_with(
+            '#channel', 'hello')
+
+    def test_restarts_after_exit(self):
+        d = self.worker.call('echo')
+        self.reply({'ready': True})
+        assert self.worker.ready
+
+        self.end()
+        self.failureResultOf(d, PluginError)
+        assert not self.worker.ready
+        self.failureResultOf(self.worker.call('echo'), PluginError)
+
+        self.clock.advance(PluginWorker.RESTART_DELAY)
+        assert len(self.transports) == 2
+
+        # backs off while the worker keeps exiting
+        self.end()
+        self.clock.advance(PluginWorker.RESTART_DELAY)
+        assert len(self.transports) == 2
+        self.clock.advance(PluginWorker.RESTART_DELAY)
+        assert len(self.transports) == 3
+
+        # until it's ready again
+        self.reply({'ready': True})
+        self.end()
+        self.clock.advance(PluginWorker.RESTART_DELAY)
+        assert len(self.transports) == 4
+
+    def test_health_check(self):
+        assert self.worker.health_check() == \
+            "worker process isn't running"
+
+        self.reply({'ready': True})
+        assert self.worker.health_check() is None
+
+        self.end()
+        assert self.worker.health_check() == \
+            "worker process isn't running"
+
+    def test_close(self):
+        self.worker.close()
+        assert self.transports[0].stdin_closed
+        self.failureResultOf(self.worker.call('echo'), PluginError)
+
+        # killed if it doesn't exit in time
+        self.clock.advance(PluginWorker.CLOSE_TIMEOUT)
+        assert self.transports[0].signals == ['KILL']
+
+        # and not restarted
+        self.end()
+        self.clock.advance(PluginWorker.MAXIMUM_RESTART_DELAY)
+        assert len(self.transports) == 1
+
+    def test_close_cancels_kill(self):
+        self.worker.close()
+        self.end()
+        self.clock.advance(PluginWorker.CLOSE_TIMEOUT)
+        assert self.transports[0].signals == []
+
+    def successResultOf(self, d):
+        results = []
+        d.addBoth(results.append)
+        assert len(results) == 1 and not isinstance(results[0], Failure)
+        return results[0]
+
+    def failureResultOf(self, d, *types):
+        results = []
+        d.addBoth(results.append)
+        assert len(results) == 1 and isinstance(results[0], Failure)
+        assert results[0].check(*types)
+        return results[0]
+
+
+class TestWorkerServer:
+    def setup_method(self):
+        self.server = WorkerServer('worker', 'fake_plugins',
+                                   FAKE_PLUGINS_PATH)
+        self.transport = StringTransport()
+        self.server.makeConnection(self.transport)
+
+    def received(self):
+        lines = [decode(line) for line in self.transport.value().splitlines()]
+        self.transport.clear()
+        return lines
+
+    def call(self, method, *args):
+        self.server.dataReceived(encode({
+            'id': 1,
+            'call': method,
+            'args': args,
+            'state': {'nickname': 'Cardinal'},
+        }) + b'\n')
+
+    def test_ready(self):
+        assert self.received() == [{'ready': True}]
+        assert 'worker' in self.server.plugin_manager.plugins
+
+    def test_call(self):
+        self.received()
+        user = user_info('nick', 'user', 'vhost')
+        self.call('echo', user, '#channel', '.echo hi')
+
+        assert self.received() == [
+            {'cardinal': 'sendMsg',
+             'args': ['#channel', 'nick said: .echo hi']},
+            {'id': 1, 'result': '.echo hi'},
+        ]
+        assert self.server.cardinal.nickname == 'Cardinal'
+
+    def test_call_error(self):
+        self.received()
+        self.call('fail', None, '#channel', '.fail')
+
+        assert self.received() == [{'id': 1, 'error': 'Failed on purpose'}]
+
+    def test_call_missing_method(self):
+        self.received()
+        self.call('nonexistent')
+
+        assert self.received() == [{
+            'id': 1,
+            'error': "'TestWorkerPlugin' object has no attribute "
+                     "'nonexistent'",
+        }]
+        assert not self.transport.disconnecting
+
+    def test_load_failure_closes(self):
+        server = WorkerServer('nonexistent', 'fake_plugins',
+                              FAKE_PLUGINS_PATH)
+        transport = StringTransport()
+        server.makeConnection(transport)
+
+        assert transport.value() == b''
+        assert transport.disconnecting
+
+    def test_closes_plugin(self):
+        instance = self.server.plugin_manager.plugins['worker']['instance']
+        self.server._reactor = Mock()
+        self.server.connectionLost(None)
+
+        assert instance.closed
+        self.server._reactor.stop.assert_called_once_with()
+        assert self.server.plugin_manager.plugins == {}
+
+
+def test_worker_cardinal():
+    messages = []
+    cardinal = WorkerCardinal(messages.append)
+
+    cardinal.sendMsg('#channel', 'hello')
+    assert messages == [{'cardinal': 'sendMsg',
+                         'args': ('#channel', 'hello')}]
+
+    assert isinstance(cardinal.event_manager, EventManager)
+    with pytest.raises(AttributeError):
+        cardinal.disconnect
@@ -0,0 +1,142 @@
+import logging
+
+from OpenSSL import SSL
+from twisted.internet import ssl
+from twisted.internet.interfaces import IOpenSSLClientConnectionCreator
+from zope.interface import implementer
+
+MODERN_CIPHERS = 'ECDHE+AESGCM:ECDHE+CHACHA20:DHE+AESGCM:DHE+CHACHA20'
+"""TLS 1.2 ciphers with forward secrecy and AEAD. TLS 1.3 ones are fixed."""
+
+
+def load_certificates(path):
+    """Loads the certificates in a PEM file, e.g. of a private CA.
+
+    Keyword arguments:
+      path -- Path to the file.
+
+    Returns:
+      list -- `twisted.internet.ssl.Certificate` instances.
+    """
+    with open(path, 'rb') as f:
+        pem = f.read()
+
+    end = b'-----END CERTIFICATE-----'
+    return [ssl.Certificate.loadPEM(block + end)
+            for block in pem.split(end) if block.strip()]
+
+
+@implementer(IOpenSSLClientConnectionCreator)
+class _UnverifiedClientTLS:
+    """Creates connections which don't verify the server's certificate."""
+
+    def __init__(self, hostname, context):
+        self._hostname = hostname.encode('idna')
+        self._context = context
+
+    def clientConnectionForTLS(self, tlsProtocol):
+        connection = SSL.Connection(self._context, None)
+        connection.set_app_data(tlsProtocol)
+        connection.set_tlsext_host_name(self._hostname)
+        return connection
+
+
+@implementer(IOpenSSLClientConnectionCreator)
+class _ResumingClientTLS:
+    """Resumes the TLS session of the last connection to a server.
+
+    The session is read from the last connection when the next one is
+    made, so it includes any tickets the server sent after the handshake,
+    as TLS 1.3 servers do.
+    """
+
+    def __init__(self, hostname, creator):
+        self.logger = logging.getLogger(__name__)
+        self.hostname = hostname
+        self.creator = creator
+
+        self.session = None
+        self._last_connection = None
+
+    def clientConnectionForTLS(self, tlsProtocol):
+        last = self._last_connection
+        # Only a connection that finished its handshake has a session worth
+        # resuming
+        if last is not None and last.get_finished() is not None:
+            self.session = last.get_session()
+
+        connection = self.creator.clientConnectionForTLS(tlsProtocol)
+        if self.session is not None:
+            self.logger.debug("Resuming TLS session with %s" % self.hostname)
+            connection.set_session(self.session)
+
+        self._last_connection = connection
+        return connection
+
+
+class TLSContexts:
+    """TLS settings of a network, and a context for each of its servers.
+
+    Contexts are built once per server and kept across reconnects, along
+    with the server's last session, so reconnecting resumes the session
+    rather than doing a full handshake.
+    """
+
+    def __init__(self, verify=True, ca_certs=None, ciphers=MODERN_CIPHERS):
+        """Creates new TLS settings.
+
+        Keyword arguments:
+          verify -- Whether to verify servers' certificates and hostnames.
+          ca_certs -- Path to a PEM file of certificates to trust, instead of
+            the platform's.
+          ciphers -- OpenSSL cipher string of TLS 1.2 ciphers to allow.
+        """
+        self.logger = logging.getLogger(__name__)
+        self.verify = verify
+        self.ciphers = ciphers
+
+        if ca_certs is None:
+            self.trust_root = ssl.platformTrust()
+        else:
+            self.trust_root = ssl.trustRootFromCertificates(
+                load_certificates(ca_certs))
+
+        # Maps hostnames to their connection creators
+        self._creators = {}
+
+    def _certificate_options(self):
+        return dict(
+            acceptableCiphers=ssl.AcceptableCiphers.fromOpenSSLCipherString(
+                self.ciphers),
+            raiseMinimumTo=ssl.TLSVersion.TLSv1_2,
+            enableSessions=True,
+            enableSessionTickets=True,
+        )
+
+    def creator(self, hostname):
+        """Returns what to connect to a server over TLS with.
+
+        Keyword arguments:
+          hostname -- The server's hostname, which its certificate must be
+            valid for.
+
+        Returns:
+          IOpenSSLClientConnectionCreator -- Pass it to `connectSSL()`.
+        """
+        if hostname not in self._creators:
+            if self.verify:
+                creator = ssl.optionsForClientTLS(
+                    hostname,
+                    trustRoot=self.trust_root,
+                    extraCertificateOptions=self._certificate_options())
+            else:
+                self.logger.warning(
+                    "Not verifying the certificate of %s" % hostname)
+                options = ssl.CertificateOptions(
+                    verify=False, **self._certificate_options())
+                creator = _UnverifiedClientTLS(hostname,
+                                               options.getContext())
+
+            self._creators[hostname] = _ResumingClientTLS(hostname, creator)
+
+        return self._creators[hostname]
@@ -32,6 +32,26 @@ def sleep(secs):
     return deferLater(reactor, secs, lambda: None)
 
 
+def parse_server(server, default_port):
+    """Parses a server from the config.
+
+    Servers are given as "host" or "host:port" strings, or as dicts with a
+    host and optionally a port and priority (lower is tried first).
+
+    e.g. "irc.example.com:6697" -> ("irc.example.com", 6697, 0)
+    """
+    if isinstance(server, dict):
+        return (server['host'],
+                server.get('port', default_port),
+                server.get('priority', 0))
+
+    host, sep, port = server.rpartition(':')
+    if not sep or not port.isdigit() or ':' in host:
+        return server, default_port, 0
+
+    return host, int(port), 0
+
+
 def strip_formatting(line):
     """Removes mIRC control code formatting"""
     return re.sub(r"(?:\x03\d\d?,\d\d?|\x03\d\d?|[\x01-\x1f])", "", line)
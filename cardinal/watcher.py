@@ -0,0 +1,152 @@
+import hashlib
+import logging
+import os
+
+from twisted.internet import reactor
+from twisted.internet.task import LoopingCall
+
+
+class PluginWatcher:
+    """Reloads plugins whose files have changed on disk.
+
+    Files are polled with stat(), which is cheap and works everywhere. Only
+    when a file's size or modification time changes is the plugin's content
+    hashed, and the plugin is only reloaded if the hash differs from the one
+    its loaded code was read from. Plugins that haven't changed keep their
+    live instances.
+    """
+
+    WATCHED_EXTENSIONS = ('.py', '.json')
+    """Files in a plugin's directory which trigger a reload when changed"""
+
+    @property
+    def reactor(self):
+        return getattr(self, '_reactor', reactor)
+
+    def __init__(self, plugin_manager, interval=2.0):
+        """Creates a new watcher for plugins loaded by a PluginManager.
+
+        Keyword arguments:
+          plugin_manager -- The `PluginManager` whose plugins to watch.
+          interval -- Seconds between checking plugin files for changes.
+        """
+        self.logger = logging.getLogger(__name__)
+        self.plugin_manager = plugin_manager
+        self.interval = interval
+
+        # Maps plugin names to the stat() results and content hash of their
+        # files when they were last checked
+        self._stats = {}
+        self._hashes = {}
+
+        # Plugins that failed to reload are unloaded, but still watched so
+        # they're loaded again once they're fixed
+        self._failed = set()
+
+        self._looping_call = None
+
+    def start(self):
+        """Starts polling for changes."""
+        self.logger.info("Watching plugins for changes every %s seconds" %
+                         self.interval)
+
+        self._looping_call = LoopingCall(self.check)
+        self._looping_call.clock = self.reactor
+        self._looping_call.start(self.interval)
+
+    def stop(self):
+        """Stops polling for changes."""
+        if self._looping_call is not None and self._looping_call.running:
+            self._looping_call.stop()
+        self._looping_call = None
+
+    def _plugin_files(self, plugin):
+        """Returns the watched files of a plugin, sorted.
+
+        Keyword arguments:
+          plugin -- Name of the plugin.
+
+        Returns:
+          list -- Paths of the plugin's watched files.
+        """
+        directory = os.path.join(self.plugin_manager.plugins_directory,
+                                 plugin)
+
+        files = []
+        for root, dirs, filenames in os.walk(directory):
+            dirs[:] = [d for d in dirs if d != '__pycache__']
+            for filename in filenames:
+                if filename.endswith(self.WATCHED_EXTENSIONS):
+                    files.append(os.path.join(root, filename))
+
+        return sorted(files)
+
+    def _stat(self, files):
+        stats = {}
+        for file_ in files:
+            try:
+                st = os.stat(file_)
+            except OSError:
+                continue
+            stats[file_] = (st.st_mtime_ns, st.st_size)
+
+        return stats
+
+    def _hash(self, files):
+        digest = hashlib.sha256()
+        for file_ in files:
+            try:
+                with open(file_, 'rb') as f:
+                    content = f.read()
+            except OSError:
+                continue
+            digest.update(file_.encode('utf-8'))
+            digest.update(b'\0')
+            digest.update(content)
+            digest.update(b'\0')
+
+        return digest.hexdigest()
+
+    def check(self):
+        """Checks loaded plugins for changes and reloads those that changed.
+
+        Returns:
+          list -- Names of the plugins that were reloaded.
+        """
+        reloaded = []
+
+        watched = set(self.plugin_manager.plugins.keys()) | self._failed
+        for plugin in sorted(watched):
+            files = self._plugin_files(plugin)
+            stats = self._stat(files)
+            if stats == self._stats.get(plugin):
+                continue
+            self._stats[plugin] = stats
+
+            # First time we've seen the plugin, just remember it
+            content_hash = self._hash(files)
+            if plugin not in self._hashes:
+                self._hashes[plugin] = content_hash
+                continue
+
+            # Touched, but the content is the same
+            if content_hash == self._hashes[plugin]:
+                continue
+            self._hashes[plugin] = content_hash
+
+            self.logger.info("Plugin changed on disk, reloading: %s" % plugin)
+            if self.plugin_manager.load(plugin):
+                self.logger.warning("Failed to reload changed plugin: %s" %
+                                    plugin)
+                self._failed.add(plugin)
+            else:
+                self._failed.discard(plugin)
+                reloaded.append(plugin)
+
+        # Forget plugins which were unloaded
+        for plugin in list(self._hashes.keys()):
+            if plugin not in watched:
+                del self._hashes[plugin]
+                self._stats.pop(plugin, None)
+
+        return reloaded
@@ -0,0 +1,379 @@
+"""Runs plugins in child processes.
+
+Each isolated plugin is imported and instantiated in its own worker process,
+so a CPU-heavy or blocking plugin doesn't stall the reactor (and can use
+another core), and a crash only takes down its worker.
+
+The parent and a worker exchange one JSON object per line over the worker's
+stdin and stdout:
+
+  parent -> worker
+    {"id": 1, "call": "method", "args": [...], "state": {...}}
+
+  worker -> parent
+    {"ready": true}
+    {"id": 1, "result": ...} or {"id": 1, "error": "..."}
+    {"cardinal": "sendMsg", "args": [...]}
+
+The worker is closed by closing its stdin. Its logging goes to stderr, which
+the parent logs.
+"""
+import json
+import logging
+import os
+import sys
+
+from twisted.internet import defer, protocol, reactor
+from twisted.protocols.basic import LineReceiver
+
+from cardinal.bot import CardinalBot, user_info
+from cardinal.exceptions import PluginError
+from cardinal.plugins import EventManager, PluginManager
+
+FORWARDED_METHODS = (
+    'sendMsg',
+    'send',
+    'msg',
+    'notice',
+    'describe',
+    'join',
+    'leave',
+    'kick',
+    'topic',
+    'mode',
+    'setNick',
+)
+"""Methods of CardinalBot a plugin in a worker can call"""
+
+FORWARDED_STATE = ('nickname', 'network', 'storage_path')
+"""Attributes of CardinalBot sent to a worker along with each call"""
+
+
+def encode(value):
+    """Encodes a value for sending to or from a worker.
+
+    Keyword arguments:
+      value -- Arguments of a call or its result.
+
+    Returns:
+      bytes -- A line of JSON, without the delimiter.
+    """
+    def convert(value):
+        if isinstance(value, user_info):
+            return {'__user__': list(value)}
+        if isinstance(value, (list, tuple)):
+            return [convert(item) for item in value]
+        if isinstance(value, dict):
+            return {key: convert(item) for key, item in value.items()}
+        return value
+
+    return json.dumps(convert(value), default=repr).encode('utf-8')
+
+
+def decode(line):
+    """Decodes a line encoded with encode().
+
+    Keyword arguments:
+      line -- A line of JSON, without the delimiter.
+
+    Returns:
+      object -- The decoded value. Users are turned back into `user_info`.
+    """
+    def object_hook(obj):
+        if list(obj.keys()) == ['__user__']:
+            return user_info(*obj['__user__'])
+        return obj
+
+    return json.loads(line.decode('utf-8'), object_hook=object_hook)
+
+
+class PluginWorker(protocol.ProcessProtocol):
+    """Runs a plugin in a child process and forwards calls to it.
+
+    Stands in for the plugin's instance in `PluginManager`. Calls made before
+    the worker is ready are buffered by the pipe. If the worker dies, calls
+    waiting on it fail and it's restarted after a delay.
+    """
+
+    RESTART_DELAY = 1.0
+    """Seconds to wait before restarting a worker which exited"""
+
+    MAXIMUM_RESTART_DELAY = 60.0
+    """Maximum seconds to wait, when a worker keeps exiting"""
+
+    CLOSE_TIMEOUT = 5.0
+    """Seconds a worker gets to close its plugin before it's killed"""
+
+    @property
+    def reactor(self):
+        return getattr(self, '_reactor', reactor)
+
+    def __init__(self, plugin_manager, plugin):
+        """Creates a worker for a plugin. Call start() to spawn it.
+
+        Keyword arguments:
+          plugin_manager -- The `PluginManager` the plugin is loaded by.
+          plugin -- Name of the plugin.
+        """
+        self.logger = logging.getLogger(__name__)
+        self.plugin_manager = plugin_manager
+        self.plugin = plugin
+
+        self.ready = False
+        self._buffer = b''
+        self._next_id = 0
+        self._pending = {}
+
+        self._closing = False
+        self._restart_delay = self.RESTART_DELAY
+        self._restart_call = None
+        self._kill_call = None
+
+    def start(self):
+        """Spawns the worker process."""
+        self.logger.info("Starting worker for plugin: %s" % self.plugin)
+
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(sys.path)
+        self.reactor.spawnProcess(self, sys.executable, [
+            sys.executable, '-m', 'cardinal.worker',
+            self.plugin,
+            self.plugin_manager._plugin_module_import_prefix,
+            self.plugin_manager.plugins_directory,
+        ], env=env)
+
+    def call(self, method, *args):
+        """Calls a method of the plugin in the worker.
+
+        Keyword arguments:
+          method -- Name of the plugin's method.
+          args -- Arguments after the instance of CardinalBot.
+
+        Returns:
+          Deferred -- Fires with the method's result, or fails with a
+            PluginError if it raised or the worker exited.
+        """
+        if self.transport is None or self._closing:
+            return defer.fail(PluginError(
+                "Worker for plugin %s isn't running" % self.plugin))
+
+        self._next_id += 1
+        call_id = self._next_id
+        # Cancelled calls (e.g. timed out ones) are forgotten, even if the
+        # worker never replies
+        d = self._pending[call_id] = defer.Deferred(
+            lambda _: self._pending.pop(call_id, None))
+
+        cardinal = self.plugin_manager.cardinal
+        self.transport.write(encode({
+            'id': self._next_id,
+            'call': method,
+            'args': args,
+            'state': {attr: getattr(cardinal, attr, None)
+                      for attr in FORWARDED_STATE},
+        }) + b'\n')
+
+        return d
+
+    def close(self):
+        """Closes the worker, giving it a chance to close its plugin."""
+        self._closing = True
+
+        if self._restart_call is not None and self._restart_call.active():
+            self._restart_call.cancel()
+        if self.transport is not None:
+            self.transport.closeStdin()
+            self._kill_call = self.reactor.callLater(
+                self.CLOSE_TIMEOUT, self._kill)
+
+    def health_check(self):
+        if not self.ready:
+            return "worker process isn't running"
+        return None
+
+    def _kill(self):
+        if self.transport is not None:
+            self.transport.signalProcess('KILL')
+
+    def outReceived(self, data):
+        lines = (self._buffer + data).split(b'\n')
+        self._buffer = lines.pop()
+
+        for line in lines:
+            try:
+                message = decode(line)
+            except ValueError:
+                self.logger.warning("Invalid message from worker %s: %r" %
+                                    (self.plugin, line))
+                continue
+
+            self._handle(message)
+
+    def errReceived(self, data):
+        for line in data.decode('utf-8', 'replace').splitlines():
+            self.logger.info("[%s] %s" % (self.plugin, line))
+
+    def _handle(self, message):
+        if message.get('ready'):
+            self.logger.info("Worker for plugin %s is ready" % self.plugin)
+            self.ready = True
+            self._restart_delay = self.RESTART_DELAY
+        elif 'cardinal' in message:
+            method = message['cardinal']
+            if method not in FORWARDED_METHODS:
+                self.logger.warning("Worker %s called unknown method: %s" %
+                                    (self.plugin, method))
+                return
+
+            getattr(self.plugin_manager.cardinal, method)(*message['args'])
+        elif message.get('id') in self._pending:
+            d = self._pending.pop(message['id'])
+            if 'error' in message:
+                d.errback(PluginError(message['error']))
+            else:
+                d.callback(message.get('result'))
+
+    def processEnded(self, reason):
+        self.transport = None
+        self.ready = False
+        self._buffer = b''
+
+        if self._kill_call is not None and self._kill_call.active():
+            self._kill_call.cancel()
+
+        pending, self._pending = self._pending, {}
+        for d in pending.values():
+            d.errback(PluginError(
+                "Worker for plugin %s exited" % self.plugin))
+
+        if self._closing:
+            self.logger.info("Worker for plugin %s closed" % self.plugin)
+            return
+
+        self.logger.error(
+            "Worker for plugin %s exited, restarting in %s seconds: %s" %
+            (self.plugin, self._restart_delay, reason.getErrorMessage()))
+        self._restart_call = self.reactor.callLater(self._restart_delay,
+                                                    self.start)
+        self._restart_delay = min(self._restart_delay * 2,
+                                  self.MAXIMUM_RESTART_DELAY)
+
+
+class WorkerCardinal:
+    """Stands in for CardinalBot inside a worker process.
+
+    Calls to `FORWARDED_METHODS` are sent to the parent, and the attributes in
+    `FORWARDED_STATE` are updated with each call. Databases are opened
+    directly, like CardinalBot does.
+    """
+
+    get_db = CardinalBot.get_db
+
+    def __init__(self, write):
+        """Creates a new stand-in.
+
+        Keyword arguments:
+          write -- Callable sending a message to the parent.
+        """
+        self._write = write
+        self.event_manager = EventManager(self)
+        self.db_locks = {}
+
+        for attr in FORWARDED_STATE:
+            setattr(self, attr, None)
+
+    def __getattr__(self, name):
+        if name not in FORWARDED_METHODS:
+            raise AttributeError(name)
+
+        def forward(*args):
+            self._write({'cardinal': name, 'args': args})
+
+        return forward
+
+
+class WorkerServer(LineReceiver):
+    """Serves calls from the parent to a plugin, inside a worker process."""
+
+    delimiter = b'\n'
+    MAX_LENGTH = 2 ** 24
+
+    @property
+    def reactor(self):
+        return getattr(self, '_reactor', reactor)
+
+    def __init__(self, plugin, import_prefix, plugins_directory):
+        self.logger = logging.getLogger(__name__)
+        self.plugin = plugin
+        self.cardinal = WorkerCardinal(self.write)
+        self.plugin_manager = PluginManager(
+            self.cardinal,
+            [],
+            {},
+            _plugin_module_import_prefix=import_prefix,
+            _plugin_module_directory=plugins_directory,
+        )
+
+    def write(self, message):
+        self.sendLine(encode(message))
+
+    def connectionMade(self):
+        if self.plugin_manager.load(self.plugin):
+            self.logger.error("Couldn't load plugin: %s" % self.plugin)
+            self.transport.loseConnection()
+            return
+
+        self.write({'ready': True})
+
+    def lineReceived(self, line):
+        message = decode(line)
+        for attr, value in message['state'].items():
+            setattr(self.cardinal, attr, value)
+
+        instance = self.plugin_manager.plugins[self.plugin]['instance']
+
+        # Looked up within the call, so a missing method is replied to as an
+        # error rather than killing the worker
+        def call():
+            return getattr(instance, message['call'])(self.cardinal,
+                                                      *message['args'])
+        d = defer.maybeDeferred(call)
+
+        def callback(result):
+            self.write({'id': message['id'], 'result': result})
+
+        def errback(failure):
+            self.logger.error("Unhandled error in %s: %s" %
+                              (message['call'], failure))
+            self.write({'id': message['id'],
+                        'error': failure.getErrorMessage()})
+
+        d.addCallbacks(callback, errback)
+
+    def connectionLost(self, reason):
+        self.plugin_manager.unload_all()
+        if self.reactor.running:
+            self.reactor.stop()
+
+
+def main(argv):
+    """Entrypoint of a worker process.
+
+    Keyword arguments:
+      argv -- The plugin's name, import prefix and plugins directory.
+    """
+    from twisted.internet import stdio
+
+    logging.basicConfig(
+        stream=sys.stderr,
+        level=logging.INFO,
+        format='%(levelname)s %(name)s: %(message)s',
+    )
+
+    plugin, import_prefix, plugins_directory = argv
+    stdio.StandardIO(WorkerServer(plugin, import_prefix, plugins_directory))
+    reactor.run()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
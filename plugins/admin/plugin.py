@@ -1,4 +1,5 @@
 import logging
+import os
 
 from cardinal.bot import user_info
 from cardinal.decorators import command, help
@@ -200,6 +201,46 @@ class AdminPlugin:
             cardinal.sendMsg(channel, "Wasn't in blacklist: %s." %
                                       ', '.join(sorted(not_blacklisted)))
 
+    @command('profile')
+    @help("Shows the commands and event callbacks which took the longest, "
+          "dumps every timing to profile.json in the storage directory, or "
+          "resets them. (admin only)")
+    @help("Syntax: .profile [plugin|dump|reset]")
+    def profile(self, cardinal, user, channel, msg):
+        if not self.is_admin(user):
+            return
+
+        profiler = cardinal.plugin_manager.profiler
+        args = msg.split()
+        args.pop(0)
+
+        if args == ['dump']:
+            path = os.path.join(cardinal.storage_path, 'profile.json')
+            profiler.write(path)
+            cardinal.sendMsg(channel, "Wrote profile to %s." % path)
+            return
+
+        if args == ['reset']:
+            profiler.reset()
+            cardinal.sendMsg(channel, "Profile reset.")
+            return
+
+        plugin = args[0] if args else None
+        top = profiler.top(plugin=plugin)
+        if not top:
+            cardinal.sendMsg(channel, "Nothing profiled yet.")
+            return
+
+        for name, handler, stats in top:
+            cardinal.sendMsg(
+                channel,
+                "%s.%s: %d calls, %d errors, %.2fs total, p50 %.1fms, "
+                "p99 %.1fms, %.1fms blocking (max %.1fms)" % (
+                    name, handler, stats['calls'], stats['errors'],
+                    stats['total_time'], stats['p50'] * 1000,
+                    stats['p99'] * 1000, stats['blocking_time'] * 1000,
+                    stats['max_blocking_time'] * 1000))
+
     @command('join')
     @help("Joins selected channels. (admin only)")
     @help("Syntax: .join <channel [channel ...]>")
@@ -1,4 +1,10 @@
-from cardinal.bot import user_info
+from mock import Mock
+from twisted.internet import defer
+
+from cardinal.bot import CardinalBot, user_info
+from cardinal.limits import CallLimits
+from cardinal.plugins import PluginManager
+from cardinal.profiling import Profiler
 from plugins.admin.plugin import AdminPlugin
 
 
@@ -69,3 +75,55 @@ class TestAdminPlugin:
         assert plugin.is_admin(user_info('bad_nick', 'user', 'vhost')) is False
         assert plugin.is_admin(user_info('nick', 'bad_user', 'vhost')) is False
         assert plugin.is_admin(user_info('nick', 'user', 'bad_vhost')) is False
+
+    def test_profile(self):
+        plugin = AdminPlugin(None, {'admins': [{'nick': 'nick'}]})
+        admin = user_info('nick', 'user', 'vhost')
+
+        cardinal = Mock(spec=CardinalBot)
+        cardinal.plugin_manager = Mock(spec=PluginManager)
+        profiler = cardinal.plugin_manager.profiler = Profiler()
+
+        plugin.profile(cardinal, admin, '#channel', '.profile')
+        cardinal.sendMsg.assert_called_once_with('#channel',
+                                                 "Nothing profiled yet.")
+
+        profiler.call('urls', 'get_title', lambda: None)
+        cardinal.sendMsg.reset_mock()
+        plugin.profile(cardinal, admin, '#channel', '.profile urls')
+        message = cardinal.sendMsg.call_args[0][1]
+        assert message.startswith("urls.get_title: 1 calls, 0 errors")
+
+        # only for admins
+        cardinal.sendMsg.reset_mock()
+        plugin.profile(cardinal, user_info('bad_nick', 'user', 'vhost'),
+                       '#channel', '.profile reset')
+        assert not cardinal.sendMsg.called
+
+        plugin.profile(cardinal, admin, '#channel', '.profile reset')
+        assert profiler.dump() == {}
+
+    def test_profile_while_running(self):
+        plugin = AdminPlugin(None, {'admins': [{'nick': 'nick'}]})
+        admin = user_info('nick', 'user', 'vhost')
+
+        cardinal = Mock(spec=CardinalBot)
+        cardinal.plugin_manager = Mock(spec=PluginManager)
+        profiler = cardinal.plugin_manager.profiler = Profiler()
+        limits = CallLimits(profiler=profiler)
+
+        # neither a call that hasn't finished, nor the running .profile
+        # itself, have timings to show yet
+        limits.call('urls', lambda: defer.Deferred(), name='get_title')
+        results = []
+        limits.call('admin', plugin.profile, cardinal, admin,
+                    '#channel', '.profile').addBoth(results.append)
+
+        assert results == [None]
+        cardinal.sendMsg.assert_called_once_with('#channel',
+                                                 "Nothing profiled yet.")
+
+        limits.call('admin', plugin.profile, cardinal, admin,
+                    '#channel', '.profile')
+        message = cardinal.sendMsg.call_args[0][1]
+        assert message.startswith("admin.profile: 1 calls, 0 errors")
@@ -0,0 +1,182 @@
+import json
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+log = logging.getLogger(__name__)
+
+
+def to_base36(number: int) -> str:
+    digits = "0123456789abcdefghijklmnopqrstuvwxyz"
+    encoded = ""
+    while True:
+        number, digit = divmod(number, 36)
+        encoded = digits[digit] + encoded
+        if number == 0:
+            return encoded
+
+
+class FakeReddit:
+    """ Local stand-in for the parts of Reddit's API that subwatch uses
+
+    Serves the OAuth token endpoint and `r/<a+b+c>/new` listings (including `after` pagination) over HTTP, so a
+    `PrawHandler` can be pointed at it with the `oauth_url` and `reddit_url` praw settings. Tests and the load
+    harness script it by posting submissions, injecting errors and setting the rate limit budget it reports.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, window: int = 600, budget: int = 600) -> None:
+        self._lock = threading.Lock()
+        self._submissions: List[Dict[str, Any]] = []
+        self._next_id = 36 ** 4
+        self._errors: List[int] = []
+        self._error_until = 0.0
+        self._window = window
+        self._budget = budget
+        self._window_started = time.monotonic()
+        self._used = 0
+        self.requests = 0
+        self.created: Dict[str, float] = {}
+
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def praw_kwargs(self) -> Dict[str, Any]:
+        """ Settings pointing praw (e.g. `PrawHandler(reddit_kwargs=...)`) at this server """
+        return {"oauth_url": self.url, "reddit_url": self.url}
+
+    def start(self) -> 'FakeReddit':
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def post(self, subreddit: str = "test", title: Optional[str] = None, author: str = "author",
+             created_utc: Optional[float] = None) -> str:
+        """ Adds a submission to the listings and returns its ID """
+        with self._lock:
+            submission_id = to_base36(self._next_id)
+            self._next_id += 1
+            self._submissions.append({
+                "id": submission_id,
+                "name": f"t3_{submission_id}",
+                "title": title or f"Submission {submission_id}",
+                "author": author,
+                "subreddit": subreddit,
+                "created_utc": time.time() if created_utc is None else created_utc,
+                "permalink": f"/r/{subreddit}/comments/{submission_id}/",
+                "url": f"https://example.com/{submission_id}",
+            })
+            self.created[submission_id] = time.monotonic()
+        return submission_id
+
+    def fail_next(self, count: int = 1, status: int = 503) -> None:
+        """ Makes the next `count` listing requests fail with `status` """
+        with self._lock:
+            self._errors.extend([status] * count)
+
+    def fail_for(self, seconds: float) -> None:
+        """ Makes every listing request fail with a 503 for the next `seconds` (an outage) """
+        with self._lock:
+            self._error_until = time.monotonic() + seconds
+
+    def set_budget(self, budget: int, window: Optional[int] = None) -> None:
+        """ Resets the rate limit window with a new request budget """
+        with self._lock:
+            self._budget = budget
+            self._window = window if window is not None else self._window
+            self._window_started = time.monotonic()
+            self._used = 0
+
+    def _rate_limit_headers(self) -> Dict[str, str]:
+        now = time.monotonic()
+        if now - self._window_started >= self._window:
+            self._window_started = now
+            self._used = 0
+        self._used += 1
+        return {
+            "x-ratelimit-remaining": f"{max(0, self._budget - self._used):.1f}",
+            "x-ratelimit-used": str(self._used),
+            "x-ratelimit-reset": str(int(self._window - (now - self._window_started))),
+        }
+
+    def _listing(self, subreddits: List[str], limit: int, after: Optional[str]) -> Dict[str, Any]:
+        wanted = {subreddit.lower() for subreddit in subreddits}
+        matching = [submission for submission in reversed(self._submissions)
+                    if submission["subreddit"].lower() in wanted]
+        if after:
+            names = [submission["name"] for submission in matching]
+            matching = matching[names.index(after) + 1:] if after in names else []
+        page = matching[:limit]
+        return {
+            "kind": "Listing",
+            "data": {
+                "after": page[-1]["name"] if len(matching) > limit else None,
+                "before": None,
+                "children": [{"kind": "t3", "data": dict(submission)} for submission in page],
+            },
+        }
+
+    def _respond(self, path: str, query: Dict[str, List[str]]) -> Tuple[int, Dict[str, str], Dict[str, Any]]:
+        with self._lock:
+            self.requests += 1
+            if path == "/api/v1/access_token":
+                return 200, {}, {"access_token": "fake-token", "token_type": "bearer", "expires_in": 3600,
+                                 "scope": "*"}
+
+            headers = self._rate_limit_headers()
+            if self._errors:
+                return self._errors.pop(0), headers, {"message": "Injected error"}
+            if time.monotonic() < self._error_until:
+                return 503, headers, {"message": "Injected outage"}
+            if self._used > self._budget:
+                headers["retry-after"] = headers["x-ratelimit-reset"]
+                return 429, headers, {"message": "Too Many Requests"}
+
+            parts = path.strip("/").split("/")
+            if len(parts) != 3 or parts[0] != "r" or parts[2] != "new":
+                return 404, headers, {"message": "Not Found"}
+            limit = min(100, int(query.get("limit", ["25"])[0]))
+            after = query.get("after", [None])[0]
+            return 200, headers, self._listing(parts[1].split("+"), limit, after)
+
+    def _handler_class(self) -> type:
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _serve(self) -> None:
+                length = int(self.headers.get("content-length", 0))
+                if length:
+                    self.rfile.read(length)
+                url = urlparse(self.path)
+                status, headers, body = fake._respond(url.path, parse_qs(url.query))
+                payload = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("content-type", "application/json")
+                self.send_header("content-length", str(len(payload)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            do_GET = _serve
+            do_POST = _serve
+
+            def log_message(self, format: str, *args: Any) -> None:
+                log.debug(format % args)
+
+        return Handler
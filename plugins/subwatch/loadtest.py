@@ -0,0 +1,157 @@
+""" Drives SubWatchPlugin and PrawHandler against a FakeReddit and reports how they keep up
+
+Run from the repository root, e.g.:
+
+    python -m plugins.subwatch.loadtest --rate 50 --duration 10 --outage 2
+"""
+import argparse
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, List, Optional
+
+from .fake_reddit import FakeReddit
+from .pacing import RateLimitPacer
+from .plugin import PrawHandler, SubWatchPlugin
+
+log = logging.getLogger(__name__)
+
+
+class RecordingCardinal:
+    """ Just enough of CardinalBot for SubWatchPlugin: records announcements and keeps the DB in memory """
+
+    # A single replica, so it always leads
+    is_leader = True
+
+    def __init__(self) -> None:
+        self.messages: List[Dict[str, Any]] = []
+        self._db: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def sendMsg(self, channel: str, message: str, length: Optional[int] = None) -> None:
+        with self._lock:
+            self.messages.append({"time": time.monotonic(), "channel": channel, "message": message})
+
+    def get_db(self, name: str, network_specific: bool = True, default: Optional[dict] = None):
+        database = self._db.setdefault(name, dict(default or {}))
+
+        @contextmanager
+        def db():
+            yield database
+
+        return db
+
+
+@dataclass
+class Report:
+    posted: int
+    announced: int
+    requests: int
+    throughput: float
+    latency_p50: Optional[float]
+    latency_p99: Optional[float]
+    recovery_time: Optional[float]
+
+
+def percentile(values: List[float], fraction: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def run(rate: float = 20.0, duration: float = 5.0, subreddits: int = 3, outage: float = 0.0,
+        poll_interval: float = 0.1, budget: int = 600, window: int = 600, settle: float = 10.0) -> Report:
+    """ Posts `rate` submissions per second for `duration` seconds, optionally with an outage halfway through
+
+    Latency is measured from a submission being posted to it being announced. Recovery time is measured from the
+    end of the outage to the first announcement after it. `budget` requests are allowed per `window` seconds, like
+    Reddit's rate limit, so with the defaults polling is paced to Reddit's real budget.
+    """
+    fake = FakeReddit(budget=budget, window=window).start()
+    cardinal = RecordingCardinal()
+    names = [f"sub{i}" for i in range(subreddits)]
+    praw_handler = PrawHandler(
+        reddit_kwargs=dict(fake.praw_kwargs, client_id="loadtest", client_secret="loadtest"),
+        pacer=RateLimitPacer(min_interval=poll_interval, base_backoff=poll_interval, max_backoff=1.0))
+    plugin = SubWatchPlugin(cardinal, {
+        "subreddits": {name: f"#{name}" for name in names},
+        # Measure the watcher, not the flood protection
+        "digest_threshold": 10 ** 6,
+        "announce_rate": 10 ** 6,
+        "announce_burst": 10 ** 6,
+    }, praw_handler)
+
+    try:
+        plugin.trigger_init(cardinal, None, None, None)
+        # Wait for the token request and the first listing, which the watcher skips, before posting anything
+        while fake.requests < 2:
+            time.sleep(poll_interval / 10)
+
+        posted = 0
+        outage_end = None
+        started = time.monotonic()
+        while time.monotonic() - started < duration:
+            if outage and outage_end is None and time.monotonic() - started >= duration / 2:
+                fake.fail_for(outage)
+                outage_end = time.monotonic() + outage
+            fake.post(subreddit=names[posted % len(names)])
+            posted += 1
+            time.sleep(1 / rate)
+        finished = time.monotonic()
+
+        # Wait for the watcher to catch up, giving up once it has announced nothing new for `settle` seconds
+        announced, progressed = 0, time.monotonic()
+        while len(cardinal.messages) < posted and time.monotonic() - progressed < settle:
+            if len(cardinal.messages) > announced:
+                announced, progressed = len(cardinal.messages), time.monotonic()
+            time.sleep(poll_interval)
+    finally:
+        plugin.close(cardinal)
+        fake.stop()
+
+    latencies = []
+    for message in cardinal.messages:
+        submission_id = message["message"].rsplit("/", 1)[-1]
+        if submission_id in fake.created:
+            latencies.append(message["time"] - fake.created[submission_id])
+
+    recovery_time = None
+    if outage_end is not None:
+        after_outage = [message["time"] for message in cardinal.messages if message["time"] >= outage_end]
+        if after_outage:
+            recovery_time = min(after_outage) - outage_end
+
+    return Report(
+        posted=posted,
+        announced=len(cardinal.messages),
+        requests=fake.requests,
+        throughput=len(cardinal.messages) / max(finished - started, 1e-9),
+        latency_p50=percentile(latencies, 0.5),
+        latency_p99=percentile(latencies, 0.99),
+        recovery_time=recovery_time,
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Load test subwatch against a local fake Reddit")
+    parser.add_argument("--rate", type=float, default=20.0, help="submissions posted per second")
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds to post for")
+    parser.add_argument("--subreddits", type=int, default=3, help="number of watched subreddits")
+    parser.add_argument("--outage", type=float, default=0.0, help="seconds of injected 503s halfway through")
+    parser.add_argument("--poll-interval", type=float, default=0.1, help="minimum seconds between polls")
+    parser.add_argument("--budget", type=int, default=600, help="requests allowed per rate limit window")
+    parser.add_argument("--window", type=int, default=600, help="seconds per rate limit window")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    report = run(rate=args.rate, duration=args.duration, subreddits=args.subreddits, outage=args.outage,
+                 poll_interval=args.poll_interval, budget=args.budget, window=args.window)
+    print(json.dumps(asdict(report), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+import logging
+import random
+import threading
+import time
+from typing import Callable, Mapping, Optional
+
+import prawcore
+
+log = logging.getLogger(__name__)
+
+
+class RateLimitPacer:
+    """ Paces Reddit polling from the `X-Ratelimit-*` response headers and backs off after errors
+
+    Reddit allows a fixed number of requests per rate limit window. Rather than polling as fast as possible until the
+    budget runs out (or at a fixed, conservative interval), the remaining requests are spread over the time left in
+    the window. Only `budget` of them are spent on polling, leaving room for any other API calls.
+    """
+
+    def __init__(self,
+                 min_interval: float = 2.0,
+                 budget: float = 0.5,
+                 base_backoff: float = 1.0,
+                 max_backoff: float = 300.0,
+                 clock: Callable[[], float] = time.monotonic,
+                 sleep: Optional[Callable[[float], None]] = None,
+                 rng: Callable[[], float] = random.random) -> None:
+        self._min_interval = min_interval
+        self._budget = budget
+        self._base_backoff = base_backoff
+        self._max_backoff = max_backoff
+        self._clock = clock
+        # A real sleep can be woken up early by wait(), a fake one given by tests can't
+        self._interruptible = sleep is None
+        self.sleep = sleep or time.sleep
+        self._rng = rng
+
+        self.remaining: Optional[float] = None
+        self.used: Optional[int] = None
+        self.reset_at: Optional[float] = None
+        self._failures = 0
+
+    def update(self, headers: Mapping[str, str]) -> None:
+        """ Records the rate limit state from a response's headers """
+        if "x-ratelimit-remaining" not in headers:
+            return
+        try:
+            self.remaining = float(headers["x-ratelimit-remaining"])
+            self.used = int(headers.get("x-ratelimit-used", 0))
+            self.reset_at = self._clock() + float(headers["x-ratelimit-reset"])
+        except (KeyError, ValueError):
+            log.warning(f"Ignoring malformed rate limit headers: {dict(headers)}")
+
+    def poll_delay(self) -> float:
+        """ Seconds to wait before the next poll """
+        if self.remaining is None or self.reset_at is None:
+            return self._min_interval
+        window = max(0.0, self.reset_at - self._clock())
+        if self.remaining < 1:
+            return max(window, self._min_interval)
+        return max(self._min_interval, window / (self.remaining * self._budget))
+
+    def wait(self, seconds: float, stopped: Optional[threading.Event] = None) -> bool:
+        """ Sleeps for `seconds`, waking up early if `stopped` is set meanwhile, and returns whether it is """
+        if stopped is not None and self._interruptible:
+            return stopped.wait(seconds)
+        self.sleep(seconds)
+        return stopped is not None and stopped.is_set()
+
+    def success(self) -> None:
+        self._failures = 0
+
+    def failure(self, exc: Optional[Exception] = None) -> float:
+        """ Records a failed request and returns how long to back off for
+
+        Uses exponential backoff with full jitter, or the server's Retry-After when it sent one.
+        """
+        retry_after = self._retry_after(exc)
+        if retry_after is not None:
+            self._failures += 1
+            return retry_after
+
+        delay = min(self._max_backoff, self._base_backoff * 2 ** self._failures)
+        self._failures += 1
+        return delay * self._rng()
+
+    @staticmethod
+    def _retry_after(exc: Optional[Exception]) -> Optional[float]:
+        response = getattr(exc, "response", None)
+        if response is None:
+            return None
+        try:
+            return float(response.headers["retry-after"])
+        except (AttributeError, KeyError, TypeError, ValueError):
+            return None
+
+
+class PacedRequestor(prawcore.Requestor):
+    """ Requestor that feeds every response's rate limit headers to a `RateLimitPacer`
+
+    Passed to praw through its `requestor_class`/`requestor_kwargs` settings.
+    """
+
+    def __init__(self, *args, pacer: RateLimitPacer, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._pacer = pacer
+
+    def request(self, *args, **kwargs):
+        response = super().request(*args, **kwargs)
+        self._pacer.update(response.headers)
+        return response
+
+
+class TokenBucket:
+    """ Blocking token bucket limiting how fast messages are sent
+
+    Allows bursts of up to `burst` messages, refilling at `rate` messages per second. Safe to share between threads,
+    e.g. a watcher winding down and the one that replaced it.
+    """
+
+    def __init__(self,
+                 rate: float,
+                 burst: int,
+                 clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], None] = time.sleep) -> None:
+        self._rate = rate
+        self._burst = burst
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = float(burst)
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = self._clock()
+        self._tokens = min(self._burst, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+
+    def acquire(self) -> None:
+        """ Takes a token, waiting for one to become available if necessary """
+        # Waiting while holding the lock queues up other threads behind us, rather than both taking the next token
+        with self._lock:
+            self._refill()
+            if self._tokens < 1:
+                self._sleep((1 - self._tokens) / self._rate)
+                self._refill()
+            self._tokens -= 1
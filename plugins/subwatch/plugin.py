@@ -3,14 +3,17 @@ import os
 import sys
 import threading
 import time
+from collections import deque
 from dataclasses import dataclass
-from typing import Generator, Any
+from typing import Any, Deque, Dict, Generator, List, Optional, Union
 
 import praw
 import prawcore
 
 from cardinal.bot import CardinalBot
 from cardinal.decorators import command, help, event
+from .pacing import PacedRequestor, RateLimitPacer, TokenBucket
+from .seen import SeenIndex, submission_id_key
 
 log = logging.getLogger(__name__)
 
@@ -21,44 +24,119 @@ class Submission:
     author: str
     id: str
     title: str
+    subreddit: str = ""
 
 
 class PrawHandler:
-    def __init__(self) -> None:
+    def __init__(self, reddit_kwargs: Optional[Dict[str, Any]] = None,
+                 pacer: Optional[RateLimitPacer] = None) -> None:
         self._client_id = os.environ.get("REDDIT_API_CLIENT_ID")
         self._client_secret = os.environ.get("REDDIT_API_CLIENT_SECRET")
         self._client_user = os.environ.get("REDDIT_API_CLIENT_USER")
         self._version = "0.0.1"
-        self._reddit = praw.Reddit(
-            client_id=self._client_id,
-            client_secret=self._client_secret,
-            user_agent=f"{sys.platform}:{self._client_id}:{self._version} (by u/{self._client_user})"
-        )
+        self._reddit_kwargs = reddit_kwargs or {}
+        self._reddit: Optional[praw.Reddit] = None
+        self.pacer = pacer or RateLimitPacer()
         self._short_base_url = "https://redd.it/"
 
-    def stream_new_submissions(self, subreddit_name: str, skip_existing: bool = True) -> \
-            Generator[Submission, Any, None]:
-        subreddit = self._reddit.subreddit(subreddit_name)
-        for submission in subreddit.stream.submissions(skip_existing=skip_existing):
-            max_age_seconds = 60 * 60
-            if int(time.time()) - int(submission.created_utc) > max_age_seconds:
-                log.warning(f"Got submission {submission.id} created at {submission.created_utc}")
-                log.warning(f"Ignoring due to it being older than max age seconds ({max_age_seconds})")
-                continue
-            url = self._short_base_url + submission.id
-            yield Submission(url=url, author=submission.author.name, id=submission.id, title=submission.title)
+    @property
+    def reddit(self) -> praw.Reddit:
+        # Created on first use and then kept for good: its session keeps the HTTP connections to Reddit alive and its
+        # authorizer caches the OAuth token, both of which would be lost by building a new client after an error.
+        if self._reddit is None:
+            kwargs = dict(
+                client_id=self._client_id,
+                client_secret=self._client_secret,
+                user_agent=f"{sys.platform}:{self._client_id}:{self._version} (by u/{self._client_user})",
+                requestor_class=PacedRequestor,
+                requestor_kwargs={"pacer": self.pacer},
+            )
+            kwargs.update(self._reddit_kwargs)
+            self._reddit = praw.Reddit(**kwargs)
+        return self._reddit
+
+    def _subreddit(self, subreddit_names: Union[str, List[str]]) -> Any:
+        # Reddit serves the combined listing of several subreddits as r/a+b+c, so a single stream (and a
+        # single request per poll) covers every watched subreddit.
+        if not isinstance(subreddit_names, str):
+            subreddit_names = "+".join(subreddit_names)
+        return self.reddit.subreddit(subreddit_names)
+
+    @staticmethod
+    def _newer_than(subreddit: Any, since_id: str, oldest_created: int) -> List[Any]:
+        """ Pages through the listing (100 submissions per request) until `since_id` or the age limit, oldest first """
+        since = submission_id_key(since_id)
+        newer = []
+        for submission in subreddit.new(limit=None):
+            if submission_id_key(submission.id) <= since or int(submission.created_utc) < oldest_created:
+                break
+            newer.append(submission)
+        newer.reverse()
+        return newer
+
+    def fetch_backlog(self, subreddit_names: Union[str, List[str]], since_id: str,
+                      max_age_seconds: int) -> List[Submission]:
+        """ Returns every submission newer than `since_id` (and younger than `max_age_seconds`), oldest first """
+        backlog = self._newer_than(self._subreddit(subreddit_names), since_id, int(time.time()) - max_age_seconds)
+        self.pacer.success()
+        return [self._to_submission(submission) for submission in backlog]
+
+    def stream_new_submissions(self, subreddit_names: Union[str, List[str]], skip_existing: bool = True,
+                               max_age_seconds: int = 60 * 60,
+                               stopped: Optional[threading.Event] = None) -> Generator[Submission, Any, None]:
+        """ Polls for new submissions and yields them, oldest first, until `stopped` is set """
+        subreddit = self._subreddit(subreddit_names)
+        page_size = 100
+        recent: Deque[str] = deque(maxlen=300)
+        newest: Optional[str] = None
+        while stopped is None or not stopped.is_set():
+            listing = list(subreddit.new(limit=page_size))
+            fresh = [submission for submission in reversed(listing) if submission.id not in recent]
+            if newest is not None and len(fresh) == len(listing) == page_size:
+                # None of the page was seen before, so more was posted since the last poll than a page holds (e.g.
+                # while prawcore retried through an outage). Page back to the newest submission seen instead.
+                fresh = [submission for submission in
+                         self._newer_than(subreddit, newest, int(time.time()) - max_age_seconds)
+                         if submission.id not in recent]
+            self.pacer.success()
+            recent.extend(submission.id for submission in fresh)
+            for submission in fresh:
+                if newest is None or submission_id_key(submission.id) > submission_id_key(newest):
+                    newest = submission.id
+            if skip_existing:
+                skip_existing = False
+            else:
+                for submission in fresh:
+                    if int(time.time()) - int(submission.created_utc) > max_age_seconds:
+                        log.warning(f"Got submission {submission.id} created at {submission.created_utc}")
+                        log.warning(f"Ignoring due to it being older than max age seconds ({max_age_seconds})")
+                        continue
+                    yield self._to_submission(submission)
+            self.pacer.wait(self.pacer.poll_delay(), stopped)
+
+    def _to_submission(self, submission: Any) -> Submission:
+        url = self._short_base_url + submission.id
+        return Submission(url=url, author=submission.author.name, id=submission.id, title=submission.title,
+                          subreddit=submission.subreddit.display_name)
 
 
 class SubWatchPlugin(object):
     def __init__(self, cardinal: CardinalBot, config, praw_handler: PrawHandler = PrawHandler()) -> None:
         self._sub_watch_started = False
         self._cardinal = cardinal
-        self._updated_cardinal: CardinalBot = cardinal
-        default_channel = "##bot-testing"
-        self._channel = os.environ.get("CHANNEL", default_channel)
-        if self._channel == default_channel:
-            log.warning(f"Using default channel: {default_channel}")
-        self._thread: threading.Thread
+        # Maps lower-cased subreddit names to the channels their submissions are announced in
+        self._routes = self._load_routes(config)
+        config = config or {}
+        # Kept across elections: a deposed watcher may still be announcing, and sharing the index (and its lock) keeps
+        # its writes from racing the next watcher's
+        self._seen = SeenIndex(cardinal.get_db, config.get("seen_capacity", 1000))
+        self._max_age = config.get("max_age", 60 * 60)
+        self._max_backlog_age = config.get("max_backlog_age", 24 * 60 * 60)
+        self._digest_threshold = config.get("digest_threshold", 5)
+        self._announcements = TokenBucket(rate=config.get("announce_rate", 0.5),
+                                          burst=config.get("announce_burst", 5))
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
         self._praw_handler = praw_handler
 
     @staticmethod
@@ -66,7 +144,43 @@ class SubWatchPlugin(object):
         return SubWatchPlugin(cardinal, config, praw_handler)
 
     def close(self, cardinal: CardinalBot) -> None:
-        pass
+        # The watcher thread notices this before announcing anything else
+        self._stopped.set()
+
+    def health_check(self) -> Optional[str]:
+        # Watching only starts once asked to (and elected), so not watching yet is fine
+        if self._thread is not None and not self._stopped.is_set() and not self._thread.is_alive():
+            return "Reddit stream isn't running"
+        return None
+
+    @staticmethod
+    def _load_routes(config: Optional[Dict[str, Any]]) -> Dict[str, List[str]]:
+        """ Builds the subreddit -> channels mapping from the plugin config, falling back to the environment """
+        subreddits = (config or {}).get("subreddits")
+        if not subreddits:
+            default_sub = "test"
+            default_channel = "##bot-testing"
+            subreddit = os.environ.get("SUBREDDIT", default_sub)
+            channel = os.environ.get("CHANNEL", default_channel)
+            if subreddit == default_sub:
+                log.warning(f"Using default sub: r/{default_sub}")
+            if channel == default_channel:
+                log.warning(f"Using default channel: {default_channel}")
+            subreddits = {subreddit: channel}
+
+        routes: Dict[str, List[str]] = {}
+        for subreddit, channels in subreddits.items():
+            if isinstance(channels, str):
+                channels = [channels]
+            routes.setdefault(subreddit.lower(), [])
+            for channel in channels:
+                if channel not in routes[subreddit.lower()]:
+                    routes[subreddit.lower()].append(channel)
+        return routes
+
+    @property
+    def _channels(self) -> List[str]:
+        return sorted({channel for channels in self._routes.values() for channel in channels})
 
     @command(['dbgnb'])
     def debug_msg_nb(self, cardinal: CardinalBot, user, channel: str, msg) -> None:
@@ -74,51 +188,144 @@ class SubWatchPlugin(object):
         nick, ident, vhost = user
         # Send with passed-in object
         cardinal.sendMsg(channel, f"({nick}) debug 1 {time.time()}")
-        # Send with original member variable object
-        self._cardinal.sendMsg(self._channel, f"({nick}) debug 2 {time.time()}")
-        # Send with updated original member variable object
-        self._updated_cardinal.sendMsg(self._channel, f"({nick}) debug 3 {time.time()}")
+        for watched_channel in self._channels:
+            # Send with member variable object
+            self._cardinal.sendMsg(watched_channel, f"({nick}) debug 2 {time.time()}")
+
+    @event('irc.signedon')
+    def event_signedon(self, cardinal: CardinalBot) -> None:
+        # The plugin outlives the connection it was created on, announce through the current one
+        self._cardinal = cardinal
+
+    @event('leader.elected')
+    def event_elected(self, cardinal: CardinalBot) -> None:
+        # Another replica was announcing until now, take over from where the seen index says it got to
+        if self._sub_watch_started and (self._thread is None or self._stopped.is_set()):
+            self._seen.reload()
+            self._start_sub_watch()
+
+    @event('leader.deposed')
+    def event_deposed(self, cardinal: CardinalBot) -> None:
+        # Another replica announces from now on, stand by in case it goes away
+        if self._thread is not None and not self._stopped.is_set():
+            log.info("No longer leader, standing by")
+            self._stopped.set()
 
     @event('irc.privmsg')
     def event_privmsg(self, cardinal: CardinalBot, user, channel: str, msg: str) -> None:
         if msg == "snbsw":
             log.debug("EVENT: event_privmsg got command snbsw")
-            self.trigger_init(cardinal, user, self._channel, msg)
+            self.trigger_init(cardinal, user, channel, msg)
 
     @event('irc.notice')
     def event_notice(self, cardinal: CardinalBot, user, channel: str, msg: str) -> None:
-        self.trigger_init(cardinal, user, self._channel, msg)
+        self.trigger_init(cardinal, user, channel, msg)
 
     @command(['snbsw'])
     @help("Start sub watch")
     def trigger_init(self, cardinal: CardinalBot, user, channel, msg) -> None:
         if not self._sub_watch_started:
             self._sub_watch_started = True
-            self._updated_cardinal = cardinal
-            self._start_sub_watch()
+            self._cardinal = cardinal
+            if cardinal.is_leader:
+                self._start_sub_watch()
+            else:
+                log.info("Not the leader, standing by to watch")
 
     def _start_sub_watch(self) -> None:
-        default_sub = "test"
-        subreddit = os.environ.get("SUBREDDIT", default_sub)
-        if subreddit == default_sub:
-            log.warning(f"Using default sub: r/{default_sub}")
-        self._thread = threading.Thread(target=self._listen_reddit, args=(subreddit,))
+        subreddits = sorted(self._routes)
+        log.info(f"Watching r/{'+'.join(subreddits)}")
+        # A thread stopped on being deposed may still be winding down, so each gets its own event
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._listen_reddit, args=(subreddits, self._stopped), daemon=True)
         self._thread.start()
 
-    def _listen_reddit(self, subreddit: str) -> None:
-        while True:
+    def _channels_for(self, submission: Submission) -> List[str]:
+        channels = self._routes.get(submission.subreddit.lower())
+        if channels is None:
+            # Only happens when the submission doesn't say where it came from, e.g. a single watched sub
+            channels = self._channels
+        return channels
+
+    def _send(self, channel: str, message: str) -> None:
+        # Paced, so a burst of submissions (e.g. a recovered backlog) doesn't flood the channel
+        self._announcements.acquire()
+        self._cardinal.sendMsg(channel=channel, message=message)
+
+    def _announce(self, submission: Submission) -> None:
+        message = f"New post by {submission.author}: {submission.title} - {submission.url}"
+        log.info(message)
+        for channel in self._channels_for(submission):
+            self._send(channel, message)
+        self._seen.add(submission.id)
+
+    def _catch_up(self, subreddits: List[str], stopped: threading.Event) -> None:
+        """ Announces what was posted since the last announced submission, e.g. while the bot was down
+
+        Stops early once `stopped` is set, without marking any of the backlog seen, so whoever watches next catches up
+        on all of it again rather than skipping what wasn't announced.
+        """
+        backlog = [submission for submission in
+                   self._praw_handler.fetch_backlog(subreddits, self._seen.last_id, self._max_backlog_age)
+                   if self._seen.is_new(submission.id)]
+        if not backlog:
+            return
+        log.info(f"Catching up on {len(backlog)} submissions since {self._seen.last_id}")
+
+        by_channel: Dict[str, List[Submission]] = {}
+        for submission in backlog:
+            for channel in self._channels_for(submission):
+                by_channel.setdefault(channel, []).append(submission)
+
+        for channel, submissions in by_channel.items():
+            if len(submissions) > self._digest_threshold:
+                messages = [self._digest(submissions)]
+            else:
+                messages = [f"New post by {submission.author}: {submission.title} - {submission.url}"
+                            for submission in submissions]
+            for message in messages:
+                if stopped.is_set():
+                    return
+                self._send(channel, message)
+        self._seen.update(submission.id for submission in backlog)
+
+    def _digest(self, submissions: List[Submission]) -> str:
+        subreddits = sorted({f"r/{submission.subreddit}" for submission in submissions if submission.subreddit})
+        where = f" in {', '.join(subreddits)}" if subreddits else ""
+        latest = submissions[-self._digest_threshold:]
+        message = f"{len(submissions)} new posts{where} while I was away, latest: " + \
+            " ".join(submission.url for submission in reversed(latest))
+        if len(submissions) > len(latest):
+            message += f" (and {len(submissions) - len(latest)} more)"
+        return message
+
+    def _listen_reddit(self, subreddits: List[str], stopped: Optional[threading.Event] = None) -> None:
+        stopped = stopped or self._stopped
+        while not stopped.is_set():
             try:
-                for submission in self._praw_handler.stream_new_submissions(subreddit):
-                    print(f"New post by {submission.author}: {submission.title} - {submission.url}")
-                    self._cardinal.sendMsg(
-                        channel=self._channel,
-                        message=f"New post by {submission.author}: {submission.title} - {submission.url}")
+                if self._seen.last_id is not None:
+                    self._catch_up(subreddits, stopped)
+                    if stopped.is_set():
+                        return
+                # With a persisted index there is no need to skip what is already listed: anything announced before
+                # a restart is recognized, and anything posted while we were away gets announced.
+                skip_existing = self._seen.last_id is None
+                for submission in self._praw_handler.stream_new_submissions(subreddits, skip_existing=skip_existing,
+                                                                            max_age_seconds=self._max_age,
+                                                                            stopped=stopped):
+                    if stopped.is_set():
+                        return
+                    if not self._seen.is_new(submission.id):
+                        log.debug(f"Already announced {submission.id}, skipping")
+                        continue
+                    self._announce(submission)
                 return
             except (prawcore.exceptions.ServerError, prawcore.exceptions.RequestException,
-                    prawcore.exceptions.ResponseException):
-                log.exception("Reddit API call failed, restarting...")
-                self._praw_handler = PrawHandler()
-                self._cardinal = self._updated_cardinal
+                    prawcore.exceptions.ResponseException) as exc:
+                # Keep the client (and with it the token and connections), just give Reddit some room
+                delay = self._praw_handler.pacer.failure(exc)
+                log.exception(f"Reddit API call failed, restarting in {delay:.1f} seconds...")
+                self._praw_handler.pacer.wait(delay, stopped)
 
 
 entrypoint = SubWatchPlugin
@@ -0,0 +1,99 @@
+import logging
+import threading
+from collections import deque
+from typing import Callable, Deque, Iterable, Optional, Set
+
+log = logging.getLogger(__name__)
+
+
+def submission_id_key(submission_id: str) -> int:
+    """ Reddit IDs are base 36 counters, so newer submissions have larger keys """
+    return int(submission_id, 36)
+
+
+class SeenIndex:
+    """ Bounded record of the most recently announced submission IDs, persisted through `CardinalBot.get_db`
+
+    Only the newest `capacity` IDs are kept. That is plenty to recognize everything Reddit can still return in a
+    `new` listing (which is capped at 1000 items), while memory and the database file stay constant in size.
+
+    Safe to share between threads: reads, updates and saves all happen under one lock, so only one thread at a time
+    touches the database.
+    """
+
+    DB_NAME = "subwatch_seen"
+
+    def __init__(self, get_db: Callable, capacity: int = 1000) -> None:
+        self._db = get_db(self.DB_NAME)
+        self._capacity = capacity
+        self._ring: Deque[str] = deque(maxlen=capacity)
+        self._members: Set[str] = set()
+        self._last_id: Optional[str] = None
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self) -> None:
+        with self._db() as db:
+            seen = db.get("seen", [])
+        # Oldest first, so the ring evicts in the same order it did before the restart
+        for submission_id in seen[-self._capacity:]:
+            self._append(submission_id)
+        log.info(f"Loaded {len(self._ring)} seen submission IDs")
+
+    def reload(self) -> None:
+        """ Reads the index from the database again, e.g. after another replica announced for a while """
+        with self._lock:
+            self._ring.clear()
+            self._members.clear()
+            self._last_id = None
+            self._load()
+
+    def _append(self, submission_id: str) -> None:
+        if submission_id in self._members:
+            return
+        if len(self._ring) == self._capacity:
+            self._members.discard(self._ring[0])
+        self._ring.append(submission_id)
+        self._members.add(submission_id)
+        if self._last_id is None or submission_id_key(submission_id) > submission_id_key(self._last_id):
+            self._last_id = submission_id
+
+    def _save(self) -> None:
+        # Called with the lock held
+        with self._db() as db:
+            db["seen"] = list(self._ring)
+
+    def __contains__(self, submission_id: str) -> bool:
+        with self._lock:
+            return submission_id in self._members
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._ring)
+
+    @property
+    def last_id(self) -> Optional[str]:
+        """ The newest submission ID that has been seen, if any """
+        with self._lock:
+            return self._last_id
+
+    def is_new(self, submission_id: str) -> bool:
+        """ Whether a submission is newer than everything announced so far
+
+        Checking against the newest ID as well as the ring keeps submissions that were skipped rather than announced
+        (e.g. the listing that was current when watching first started) from being announced on a restart.
+        """
+        with self._lock:
+            if submission_id in self._members:
+                return False
+            return self._last_id is None or submission_id_key(submission_id) > submission_id_key(self._last_id)
+
+    def add(self, submission_id: str) -> None:
+        self.update([submission_id])
+
+    def update(self, submission_ids: Iterable[str]) -> None:
+        """ Marks submissions as seen and persists the index once for the whole batch """
+        with self._lock:
+            for submission_id in submission_ids:
+                self._append(submission_id)
+            self._save()
@@ -1,12 +1,23 @@
+import time
+from itertools import islice
+from types import SimpleNamespace
 from unittest.mock import MagicMock, call
 
+import prawcore
+
 from cardinal.bot import CardinalBot
+from cardinal.unittest_util import get_mock_db
+from plugins.subwatch import loadtest
+from plugins.subwatch.fake_reddit import FakeReddit, to_base36
+from plugins.subwatch.pacing import RateLimitPacer, TokenBucket
 from plugins.subwatch.plugin import PrawHandler, SubWatchPlugin, Submission
+from plugins.subwatch.seen import SeenIndex
 
 
 def test_subwatch():
     cardinal = CardinalBot()
     cardinal.sendMsg = MagicMock()
+    cardinal.get_db, _ = get_mock_db()
 
     praw_handler = PrawHandler()
     praw_handler.stream_new_submissions = MagicMock()
@@ -16,12 +27,491 @@ def test_subwatch():
 
     subwatch = SubWatchPlugin.create(cardinal, {}, praw_handler)
     subwatch.trigger_init(cardinal, "", "##bot-testing", "")
+    subwatch._thread.join()
 
     calls = [call(channel="##bot-testing", message="New post by author1: title1 - url1"),
              call(channel="##bot-testing", message="New post by author2: title2 - url2")]
     cardinal.sendMsg.assert_has_calls(calls)
 
 
+def test_subwatch_health_check():
+    cardinal = CardinalBot()
+    cardinal.sendMsg = MagicMock()
+    cardinal.get_db, _ = get_mock_db()
+
+    praw_handler = PrawHandler()
+    praw_handler.stream_new_submissions = MagicMock()
+    praw_handler.stream_new_submissions.return_value = iter([])
+
+    subwatch = SubWatchPlugin.create(cardinal, {}, praw_handler)
+    # Not watching until asked to is fine
+    assert subwatch.health_check() is None
+
+    subwatch.trigger_init(cardinal, "", "##bot-testing", "")
+    subwatch._thread.join()
+    assert subwatch.health_check() == "Reddit stream isn't running"
+
+    # Unless it was stopped on purpose
+    subwatch.close(cardinal)
+    assert subwatch.health_check() is None
+
+
+def test_subwatch_stands_by_unless_leader():
+    cardinal = CardinalBot()
+    cardinal.factory = SimpleNamespace(election=SimpleNamespace(is_leader=False))
+    cardinal.sendMsg = MagicMock()
+    cardinal.get_db, _ = get_mock_db()
+
+    praw_handler = PrawHandler()
+    praw_handler.stream_new_submissions = MagicMock()
+    praw_handler.stream_new_submissions.return_value = (s for s in [Submission("url1", "author1", "id1", "title1")])
+
+    subwatch = SubWatchPlugin.create(cardinal, {}, praw_handler)
+    subwatch.trigger_init(cardinal, "", "##bot-testing", "")
+    assert subwatch._thread is None
+    assert subwatch.health_check() is None
+
+    # Takes over once elected
+    cardinal.factory.election.is_leader = True
+    subwatch.event_elected(cardinal)
+    subwatch._thread.join()
+    cardinal.sendMsg.assert_called_once_with(channel="##bot-testing", message="New post by author1: title1 - url1")
+
+    # And stands by again once deposed
+    subwatch.event_deposed(cardinal)
+    assert subwatch._stopped.is_set()
+    assert subwatch.health_check() is None
+
+
+def test_subwatch_keeps_seen_index_across_elections():
+    cardinal = CardinalBot()
+    cardinal.factory = SimpleNamespace(election=SimpleNamespace(is_leader=True))
+    cardinal.sendMsg = MagicMock()
+    cardinal.get_db, db = get_mock_db()
+
+    praw_handler = PrawHandler()
+    praw_handler.stream_new_submissions = MagicMock(return_value=iter([]))
+    praw_handler.fetch_backlog = MagicMock(return_value=[])
+
+    subwatch = SubWatchPlugin.create(cardinal, {}, praw_handler)
+    seen = subwatch._seen
+    subwatch.trigger_init(cardinal, "", "##bot-testing", "")
+    subwatch._thread.join()
+    subwatch.event_deposed(cardinal)
+
+    # Another replica announced meanwhile
+    db["seen"] = ["id1", "id2"]
+    subwatch.event_elected(cardinal)
+    subwatch._thread.join()
+
+    assert subwatch._seen is seen
+    assert seen.last_id == "id2"
+    praw_handler.fetch_backlog.assert_called_once_with(["test"], "id2", 24 * 60 * 60)
+
+
+def test_subwatch_stops_polling_once_deposed():
+    cardinal = CardinalBot()
+    cardinal.sendMsg = MagicMock()
+    cardinal.get_db, _ = get_mock_db()
+
+    # Nothing new is ever posted, and polls are a minute apart
+    praw_handler = PrawHandler(pacer=RateLimitPacer(min_interval=60))
+    praw_handler._reddit = MagicMock()
+    praw_handler._reddit.subreddit.return_value.new.return_value = []
+
+    subwatch = SubWatchPlugin.create(cardinal, {}, praw_handler)
+    subwatch.trigger_init(cardinal, "", "##bot-testing", "")
+    subwatch.event_deposed(cardinal)
+    subwatch._thread.join(timeout=5)
+    assert not subwatch._thread.is_alive()
+
+
+def test_subwatch_stops_catching_up_once_deposed():
+    cardinal = CardinalBot()
+    cardinal.get_db, db = get_mock_db()
+    db["seen"] = ["a10"]
+
+    praw_handler = PrawHandler()
+    praw_handler.fetch_backlog = MagicMock(return_value=[
+        Submission(f"url{i}", "author", f"a{i}", f"title{i}") for i in range(11, 14)
+    ])
+    praw_handler.stream_new_submissions = MagicMock()
+
+    subwatch = SubWatchPlugin.create(cardinal, {}, praw_handler)
+    # Deposed while announcing the first submission
+    cardinal.sendMsg = MagicMock(side_effect=lambda **kwargs: subwatch.event_deposed(cardinal))
+    subwatch.trigger_init(cardinal, "", "##bot-testing", "")
+    subwatch._thread.join()
+
+    cardinal.sendMsg.assert_called_once_with(channel="##bot-testing", message="New post by author: title11 - url11")
+    praw_handler.stream_new_submissions.assert_not_called()
+    # Whoever leads next catches up on all of it
+    assert subwatch._seen.last_id == "a10"
+
+
+def test_subwatch_announces_through_current_connection():
+    cardinal = CardinalBot()
+    cardinal.sendMsg = MagicMock()
+    cardinal.get_db, _ = get_mock_db()
+    reconnected = CardinalBot()
+    reconnected.sendMsg = MagicMock()
+    reconnected.get_db, _ = get_mock_db()
+
+    praw_handler = PrawHandler()
+    praw_handler.stream_new_submissions = MagicMock()
+    praw_handler.stream_new_submissions.return_value = (s for s in [Submission("url1", "author1", "id1", "title1")])
+
+    subwatch = SubWatchPlugin.create(cardinal, {}, praw_handler)
+    # The plugin is kept when the bot reconnects, and told about the new CardinalBot
+    subwatch.event_signedon(reconnected)
+    subwatch.trigger_init(reconnected, "", "##bot-testing", "")
+    subwatch._thread.join()
+
+    cardinal.sendMsg.assert_not_called()
+    reconnected.sendMsg.assert_called_once_with(channel="##bot-testing", message="New post by author1: title1 - url1")
+
+
+def test_subwatch_routes_multiple_subreddits():
+    cardinal = CardinalBot()
+    cardinal.sendMsg = MagicMock()
+    cardinal.get_db, _ = get_mock_db()
+
+    praw_handler = PrawHandler()
+    praw_handler.stream_new_submissions = MagicMock()
+    submissions = [Submission("url1", "author1", "id1", "title1", "Linux"),
+                   Submission("url2", "author2", "id2", "title2", "archlinux"),
+                   Submission("url3", "author3", "id3", "title3", "linuxmasterrace")]
+    praw_handler.stream_new_submissions.return_value = (s for s in submissions)
+
+    subwatch = SubWatchPlugin.create(cardinal, {"subreddits": {
+        "linuxmasterrace": ["#linuxmasterrace"],
+        "linux": ["#linux", "#bots"],
+        "archlinux": "#bots",
+    }}, praw_handler)
+    subwatch.trigger_init(cardinal, "", "#bots", "")
+    subwatch._thread.join()
+
+    # One stream for all subreddits
+    praw_handler.stream_new_submissions.assert_called_once_with(["archlinux", "linux", "linuxmasterrace"],
+                                                                skip_existing=True, max_age_seconds=3600,
+                                                                stopped=subwatch._stopped)
+    assert cardinal.sendMsg.mock_calls == [
+        call(channel="#linux", message="New post by author1: title1 - url1"),
+        call(channel="#bots", message="New post by author1: title1 - url1"),
+        call(channel="#bots", message="New post by author2: title2 - url2"),
+        call(channel="#linuxmasterrace", message="New post by author3: title3 - url3"),
+    ]
+
+
+def test_subwatch_skips_seen_submissions():
+    cardinal = CardinalBot()
+    cardinal.sendMsg = MagicMock()
+    cardinal.get_db, db = get_mock_db()
+    db["seen"] = ["id2"]
+
+    praw_handler = PrawHandler()
+    praw_handler.fetch_backlog = MagicMock(return_value=[])
+    praw_handler.stream_new_submissions = MagicMock()
+    submissions = [Submission("url1", "author1", "id1", "title1"),
+                   Submission("url2", "author2", "id2", "title2"),
+                   Submission("url3", "author3", "id3", "title3")]
+    praw_handler.stream_new_submissions.return_value = (s for s in submissions)
+
+    subwatch = SubWatchPlugin.create(cardinal, {}, praw_handler)
+    subwatch.trigger_init(cardinal, "", "##bot-testing", "")
+    subwatch._thread.join()
+
+    # Resuming from the index, so the existing listing isn't skipped
+    praw_handler.fetch_backlog.assert_called_once_with(["test"], "id2", 24 * 60 * 60)
+    praw_handler.stream_new_submissions.assert_called_once_with(["test"], skip_existing=False, max_age_seconds=3600,
+                                                                stopped=subwatch._stopped)
+    assert cardinal.sendMsg.mock_calls == [
+        call(channel="##bot-testing", message="New post by author3: title3 - url3"),
+    ]
+    assert db["seen"] == ["id2", "id3"]
+
+
+def test_seen_index_persists():
+    get_db, db = get_mock_db()
+
+    seen = SeenIndex(get_db)
+    assert len(seen) == 0
+    assert seen.last_id is None
+    assert seen.is_new("abc")
+
+    seen.update(["abc", "abe", "abd"])
+    assert db["seen"] == ["abc", "abe", "abd"]
+    assert seen.last_id == "abe"
+
+    seen = SeenIndex(get_db)
+    assert len(seen) == 3
+    assert "abd" in seen
+    assert seen.last_id == "abe"
+    assert not seen.is_new("abd")
+    # older than the newest announced submission
+    assert not seen.is_new("abb")
+    assert seen.is_new("abf")
+
+
+def test_seen_index_is_bounded():
+    get_db, db = get_mock_db()
+
+    seen = SeenIndex(get_db, capacity=3)
+    for submission_id in ["a1", "a2", "a3", "a4", "a5"]:
+        seen.add(submission_id)
+
+    assert len(seen) == 3
+    assert "a2" not in seen
+    assert "a5" in seen
+    assert db["seen"] == ["a3", "a4", "a5"]
+    assert not seen.is_new("a2")
+
+
+def test_subwatch_catches_up_on_backlog():
+    cardinal = CardinalBot()
+    cardinal.sendMsg = MagicMock()
+    cardinal.get_db, db = get_mock_db()
+    db["seen"] = ["a10"]
+
+    praw_handler = PrawHandler()
+    praw_handler.fetch_backlog = MagicMock(return_value=[
+        Submission(f"url{i}", "author", f"a{i}", f"title{i}", "linux" if i % 2 else "archlinux")
+        for i in range(11, 19)
+    ])
+    praw_handler.stream_new_submissions = MagicMock(return_value=iter([
+        # already announced during catch-up
+        Submission("url18", "author", "a18", "title18", "archlinux"),
+        Submission("url19", "author", "a19", "title19", "linux"),
+    ]))
+
+    subwatch = SubWatchPlugin.create(cardinal, {
+        "subreddits": {"linux": ["#linux", "#bots"], "archlinux": "#bots"},
+        "announce_burst": 100,
+        "digest_threshold": 4,
+    }, praw_handler)
+    sleeps = []
+    subwatch._announcements = TokenBucket(rate=0.5, burst=100, sleep=sleeps.append)
+    subwatch.trigger_init(cardinal, "", "#bots", "")
+    subwatch._thread.join()
+
+    assert cardinal.sendMsg.mock_calls == [
+        # 4 posts aren't enough for a digest
+        call(channel="#linux", message="New post by author: title11 - url11"),
+        call(channel="#linux", message="New post by author: title13 - url13"),
+        call(channel="#linux", message="New post by author: title15 - url15"),
+        call(channel="#linux", message="New post by author: title17 - url17"),
+        call(channel="#bots", message="8 new posts in r/archlinux, r/linux while I was away, latest: "
+                                      "url18 url17 url16 url15 (and 4 more)"),
+        call(channel="#linux", message="New post by author: title19 - url19"),
+        call(channel="#bots", message="New post by author: title19 - url19"),
+    ]
+    assert sleeps == []
+    assert subwatch._seen.last_id == "a19"
+    assert len(subwatch._seen) == 10
+
+
+def test_praw_handler_fetches_backlog():
+    now = time.time()
+    praw_handler = PrawHandler()
+    praw_handler._reddit = MagicMock()
+    listing = praw_handler._reddit.subreddit.return_value.new
+    listing.return_value = iter([make_praw_submission("a5", now), make_praw_submission("a4", now),
+                                 make_praw_submission("a3", now - 7200), make_praw_submission("a2", now)])
+
+    backlog = praw_handler.fetch_backlog(["test"], "a2", 24 * 60 * 60)
+    listing.assert_called_once_with(limit=None)
+    assert [submission.id for submission in backlog] == ["a3", "a4", "a5"]
+
+    listing.return_value = iter([make_praw_submission("a5", now), make_praw_submission("a4", now),
+                                 make_praw_submission("a3", now - 7200), make_praw_submission("a2", now)])
+    backlog = praw_handler.fetch_backlog(["test"], "a2", 60 * 60)
+    assert [submission.id for submission in backlog] == ["a4", "a5"]
+
+
+def test_token_bucket():
+    now = [0.0]
+    sleeps = []
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        now[0] += seconds
+
+    bucket = TokenBucket(rate=0.5, burst=2, clock=lambda: now[0], sleep=sleep)
+    for _ in range(4):
+        bucket.acquire()
+    assert sleeps == [2.0, 2.0]
+
+    now[0] += 60
+    bucket.acquire()
+    bucket.acquire()
+    assert sleeps == [2.0, 2.0]
+
+
+def make_praw_submission(submission_id, created_utc, subreddit="test"):
+    return SimpleNamespace(id=submission_id, created_utc=created_utc, title=f"title {submission_id}",
+                           author=SimpleNamespace(name="author"),
+                           subreddit=SimpleNamespace(display_name=subreddit))
+
+
+def test_praw_handler_polls_listing_and_paces():
+    now = time.time()
+    sleeps = []
+    pacer = RateLimitPacer(sleep=sleeps.append)
+    praw_handler = PrawHandler(pacer=pacer)
+    praw_handler._reddit = MagicMock()
+    listing = praw_handler._reddit.subreddit.return_value.new
+    # Listings are newest first
+    listing.side_effect = [
+        [make_praw_submission("a2", now), make_praw_submission("a1", now)],
+        [make_praw_submission("a4", now), make_praw_submission("a3", now - 7200),
+         make_praw_submission("a2", now), make_praw_submission("a1", now)],
+        [make_praw_submission("a5", now), make_praw_submission("a4", now)],
+    ]
+
+    stream = praw_handler.stream_new_submissions(["test", "linux"])
+    submissions = list(islice(stream, 2))
+
+    praw_handler._reddit.subreddit.assert_called_once_with("test+linux")
+    # existing listing is skipped, a3 is too old
+    assert [submission.id for submission in submissions] == ["a4", "a5"]
+    assert submissions[0].url == "https://redd.it/a4"
+    assert submissions[0].subreddit == "test"
+    # waited between polls
+    assert sleeps == [2.0, 2.0]
+
+
+def test_rate_limit_pacer_spreads_remaining_budget():
+    now = [1000.0]
+    pacer = RateLimitPacer(min_interval=1.0, budget=0.5, clock=lambda: now[0])
+    assert pacer.poll_delay() == 1.0
+
+    pacer.update({"x-ratelimit-remaining": "100.0", "x-ratelimit-used": "500", "x-ratelimit-reset": "400"})
+    assert pacer.poll_delay() == 8.0
+
+    # plenty of budget left, poll at the minimum interval
+    pacer.update({"x-ratelimit-remaining": "590.0", "x-ratelimit-used": "10", "x-ratelimit-reset": "200"})
+    assert pacer.poll_delay() == 1.0
+
+    # out of budget, wait for the window to reset
+    pacer.update({"x-ratelimit-remaining": "0", "x-ratelimit-used": "600", "x-ratelimit-reset": "42"})
+    assert pacer.poll_delay() == 42.0
+    now[0] += 40
+    assert pacer.poll_delay() == 2.0
+
+    # responses without rate limit headers don't reset the state
+    pacer.update({})
+    assert pacer.remaining == 0
+
+
+def test_rate_limit_pacer_backs_off():
+    pacer = RateLimitPacer(base_backoff=1.0, max_backoff=10.0, rng=lambda: 1.0)
+    assert [pacer.failure() for _ in range(6)] == [1.0, 2.0, 4.0, 8.0, 10.0, 10.0]
+
+    pacer.success()
+    assert pacer.failure() == 1.0
+
+    response = SimpleNamespace(headers={"retry-after": "30"})
+    assert pacer.failure(SimpleNamespace(response=response)) == 30.0
+
+
+def test_subwatch_keeps_client_after_errors():
+    cardinal = CardinalBot()
+    cardinal.sendMsg = MagicMock()
+    cardinal.get_db, _ = get_mock_db()
+
+    sleeps = []
+    praw_handler = PrawHandler(pacer=RateLimitPacer(sleep=sleeps.append, rng=lambda: 1.0))
+    praw_handler.stream_new_submissions = MagicMock()
+
+    def failing_stream():
+        raise prawcore.exceptions.RequestException(Exception("timed out"), (), {})
+        yield
+
+    praw_handler.stream_new_submissions.side_effect = [
+        failing_stream(),
+        failing_stream(),
+        (s for s in [Submission("url1", "author1", "id1", "title1")]),
+    ]
+
+    subwatch = SubWatchPlugin.create(cardinal, {}, praw_handler)
+    subwatch.trigger_init(cardinal, "", "##bot-testing", "")
+    subwatch._thread.join()
+
+    assert subwatch._praw_handler is praw_handler
+    assert sleeps == [1.0, 2.0]
+    cardinal.sendMsg.assert_called_once_with(channel="##bot-testing", message="New post by author1: title1 - url1")
+
+
+def test_praw_handler_fills_gap_between_polls():
+    now = time.time()
+    praw_handler = PrawHandler(pacer=RateLimitPacer(sleep=lambda seconds: None))
+    praw_handler._reddit = MagicMock()
+    first = [make_praw_submission("a1", now)]
+    # 150 submissions are posted between the first two polls, more than a single listing holds
+    posted = [make_praw_submission(to_base36(36 ** 3 + i), now) for i in range(150)]
+    polls = []
+
+    def new(limit):
+        if limit is None:
+            return iter(list(reversed(posted)) + first)
+        polls.append(limit)
+        return first if len(polls) == 1 else list(reversed(posted))[:limit]
+
+    praw_handler._reddit.subreddit.return_value.new.side_effect = new
+    stream = praw_handler.stream_new_submissions("test")
+    submissions = list(islice(stream, 150))
+    assert [submission.id for submission in submissions] == [submission.id for submission in posted]
+
+
+def test_praw_handler_against_fake_reddit():
+    fake = FakeReddit(budget=100, window=600).start()
+    try:
+        praw_handler = PrawHandler(
+            reddit_kwargs=dict(fake.praw_kwargs, client_id="test", client_secret="test"),
+            pacer=RateLimitPacer(min_interval=0.01, base_backoff=0.01))
+        stream = praw_handler.stream_new_submissions(["test", "linux"], skip_existing=False)
+        first = fake.post("test", title="first")
+        fake.post("other")
+        second = fake.post("linux", title="second")
+        submissions = list(islice(stream, 2))
+
+        assert [(s.id, s.title, s.subreddit) for s in submissions] == [(first, "first", "test"),
+                                                                       (second, "second", "linux")]
+        assert submissions[0].url == f"https://redd.it/{first}"
+        # rate limit headers were picked up from the responses
+        assert praw_handler.pacer.remaining is not None
+        assert praw_handler.pacer.remaining < 100
+
+        # the backlog is paged through 100 submissions at a time
+        posted = [fake.post("test") for _ in range(150)]
+        backlog = praw_handler.fetch_backlog(["test"], second, 60 * 60)
+        assert [submission.id for submission in backlog] == posted
+    finally:
+        fake.stop()
+
+
+def test_loadtest_announces_everything():
+    report = loadtest.run(rate=50, duration=1, subreddits=2, outage=0.3, poll_interval=0.05, budget=10 ** 5)
+    assert report.posted > 0
+    assert report.announced == report.posted
+    assert report.recovery_time is not None
+
+
+def test_loadtest_cardinal_stands_by_unless_leader():
+    cardinal = loadtest.RecordingCardinal()
+    assert cardinal.is_leader is True
+    cardinal.is_leader = False
+
+    praw_handler = PrawHandler()
+    praw_handler.stream_new_submissions = MagicMock()
+    subwatch = SubWatchPlugin.create(cardinal, {}, praw_handler)
+    subwatch.trigger_init(cardinal, None, None, None)
+
+    assert subwatch._thread is None
+    praw_handler.stream_new_submissions.assert_not_called()
+    assert cardinal.messages == []
+
+
 def test_praw_handler():
     praw_handler = PrawHandler()
     for submission in praw_handler.stream_new_submissions("test", skip_existing=False):